@@ -0,0 +1,282 @@
+"""
+Scan analysis engine.
+
+Each scan type is served by an Analyzer backend. Requests for the same
+analyzer that arrive within INFERENCE_MAX_WAIT_MS of each other are stacked
+into one array and run through the model in a single forward pass, up to
+INFERENCE_MAX_BATCH_SIZE images at a time. A batch may mix scan types that
+share an analyzer; each image keeps its own scan type for the report.
+
+Backends are configured with ANALYZER_BACKENDS, a comma-separated list of
+``<scan_type>=<kind>:<path>`` entries, e.g.
+
+    ANALYZER_BACKENDS="ct=onnx:/models/ct.onnx,xray=numpy:/models/xray.npz"
+
+Scan types without an entry use the placeholder analyzer.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from metrics import Histogram, Labelled
+
+logger = logging.getLogger(__name__)
+
+
+class Analyzer:
+    name = "base"
+    version = "0"
+
+    def load(self) -> None:
+        """Load weights; called once per process before serving traffic."""
+
+    def predict_batch(self, scan_types: Sequence[str], images: np.ndarray) -> List[str]:
+        """Return one report per image in the (N, H, W) float32 batch in [0, 1].
+
+        ``scan_types`` holds the scan type of each image.
+        """
+        raise NotImplementedError
+
+
+class PlaceholderAnalyzer(Analyzer):
+    name = "placeholder"
+    version = "placeholder-1"
+
+    def predict_batch(self, scan_types: Sequence[str], images: np.ndarray) -> List[str]:
+        return [
+            f"AI Analysis for {scan_type} scan: This is a placeholder AI-generated report. "
+            "The image shows normal anatomical structures with no apparent abnormalities detected. "
+            "Further clinical correlation is recommended."
+            for scan_type in scan_types
+        ]
+
+
+class ClassifierAnalyzer(Analyzer):
+    """Base for models that map an image batch to class probabilities."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.labels: Sequence[str] = []
+        self.version = f"{self.name}:{self.path.name}"
+
+    def model_files(self) -> List[Path]:
+        return [self.path]
+
+    def fingerprint(self) -> str:
+        """
+        Version from the content of the model files, so replacing the weights
+        at the same path gives new memo keys for the analysis results.
+        """
+        digest = hashlib.sha256()
+        for path in self.model_files():
+            with open(path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    digest.update(chunk)
+        return f"{self.name}:{self.path.name}:{digest.hexdigest()[:16]}"
+
+    def probabilities(self, images: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict_batch(self, scan_types: Sequence[str], images: np.ndarray) -> List[str]:
+        probs = self.probabilities(images)
+        reports = []
+        for scan_type, row in zip(scan_types, probs):
+            top = np.argsort(row)[::-1][:3]
+            findings = ", ".join(f"{self.labels[i]} ({row[i]:.0%})" for i in top)
+            reports.append(
+                f"AI Analysis for {scan_type} scan: Most likely findings: {findings}. "
+                "Further clinical correlation is recommended."
+            )
+        return reports
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+class NumpyAnalyzer(ClassifierAnalyzer):
+    """Linear classifier stored as an .npz with ``weights``, ``bias`` and ``labels``."""
+
+    name = "numpy"
+
+    def load(self) -> None:
+        model = np.load(self.path, allow_pickle=False)
+        self.weights = model["weights"].astype(np.float32)
+        self.bias = model["bias"].astype(np.float32)
+        self.labels = [str(label) for label in model["labels"]]
+        self.version = self.fingerprint()
+
+    def probabilities(self, images: np.ndarray) -> np.ndarray:
+        flat = images.reshape(len(images), -1)
+        return _softmax(flat @ self.weights + self.bias)
+
+
+class OnnxAnalyzer(ClassifierAnalyzer):
+    """ONNX classifier; labels are read from a ``<model>.labels.json`` sidecar."""
+
+    name = "onnx"
+
+    @property
+    def labels_path(self) -> Path:
+        return self.path.with_suffix(".labels.json")
+
+    def model_files(self) -> List[Path]:
+        return [self.path, self.labels_path]
+
+    def load(self) -> None:
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(str(self.path), providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.labels = json.loads(self.labels_path.read_text())
+        self.version = self.fingerprint()
+
+    def probabilities(self, images: np.ndarray) -> np.ndarray:
+        # Models expect NCHW
+        (logits,) = self.session.run(None, {self.input_name: images[:, None, :, :]})
+        return _softmax(logits)
+
+
+ANALYZER_KINDS = {"numpy": NumpyAnalyzer, "onnx": OnnxAnalyzer}
+
+
+def parse_backends(spec: str) -> Dict[str, Analyzer]:
+    analyzers = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        scan_type, _, backend = entry.partition("=")
+        kind, _, path = backend.partition(":")
+        if kind not in ANALYZER_KINDS or not path:
+            raise ValueError(f"Invalid ANALYZER_BACKENDS entry: {entry}")
+        analyzers[scan_type.strip().lower()] = ANALYZER_KINDS[kind](path)
+    return analyzers
+
+
+class InferenceEngine:
+    def __init__(
+        self,
+        analyzers: Dict[str, Analyzer],
+        default: Analyzer,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        threads: int = 1,
+        idle_seconds: float = 60,
+    ):
+        self.analyzers = analyzers
+        self.default = default
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.idle_seconds = idle_seconds
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="inference")
+        # One queue and batcher per analyzer in use; a batcher exits after
+        # idle_seconds without work and is started again on demand
+        self._queues: Dict[Analyzer, asyncio.Queue] = {}
+        self._batchers: Dict[Analyzer, asyncio.Task] = {}
+        self.batch_latency = Histogram()
+        self.batch_sizes = Histogram(buckets=[1, 2, 4, 8, 16, 32, 64])
+
+    def analyzer_for(self, scan_type: str) -> Analyzer:
+        return self.analyzers.get(scan_type.lower(), self.default)
+
+    def model_version(self, scan_type: str) -> str:
+        return self.analyzer_for(scan_type).version
+
+    def load(self) -> None:
+        for analyzer in {id(a): a for a in [self.default, *self.analyzers.values()]}.values():
+            analyzer.load()
+            logger.info("Loaded %s analyzer %s", analyzer.name, analyzer.version)
+
+    async def analyze(self, scan_type: str, image: np.ndarray) -> str:
+        analyzer = self.analyzer_for(scan_type)
+        if analyzer not in self._queues:
+            self._queues[analyzer] = asyncio.Queue()
+            self._batchers[analyzer] = asyncio.create_task(self._batch_loop(analyzer, self._queues[analyzer]))
+        future = asyncio.get_running_loop().create_future()
+        # put_nowait: no await between finding the queue and filling it, so
+        # its batcher cannot retire in between
+        self._queues[analyzer].put_nowait((scan_type, image, future))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> list:
+        """The next batch; empty if nothing arrived for idle_seconds."""
+        try:
+            batch = [await asyncio.wait_for(queue.get(), self.idle_seconds)]
+        except asyncio.TimeoutError:
+            return []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch_loop(self, analyzer: Analyzer, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect(queue)
+            if not batch and queue.empty():
+                # Idle: retire; analyze() starts a new batcher when needed
+                del self._queues[analyzer], self._batchers[analyzer]
+                return
+            batch = [item for item in batch if not item[2].cancelled()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                scan_types = [scan_type for scan_type, _, _ in batch]
+                images = np.stack([image for _, image, _ in batch])
+                reports = await loop.run_in_executor(
+                    self._executor, analyzer.predict_batch, scan_types, images
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batch_latency.observe(time.perf_counter() - started)
+            self.batch_sizes.observe(len(batch))
+            for (_, _, future), report in zip(batch, reports):
+                if not future.done():
+                    future.set_result(report)
+
+    async def stop(self) -> None:
+        batchers = list(self._batchers.values())
+        for task in batchers:
+            task.cancel()
+        await asyncio.gather(*batchers, return_exceptions=True)
+        self._batchers.clear()
+        self._queues.clear()
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queued": Labelled("analyzer", {analyzer.version: queue.qsize() for analyzer, queue in self._queues.items()}),
+            "batch_latency_seconds": self.batch_latency.snapshot(),
+            "batch_size": self.batch_sizes.snapshot(),
+        }
+
+
+def create_inference_engine() -> InferenceEngine:
+    return InferenceEngine(
+        parse_backends(os.environ.get("ANALYZER_BACKENDS", "")),
+        PlaceholderAnalyzer(),
+        max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", 8)),
+        max_wait_ms=float(os.environ.get("INFERENCE_MAX_WAIT_MS", 10)),
+        threads=int(os.environ.get("INFERENCE_THREADS", 1)),
+    )
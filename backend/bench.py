@@ -0,0 +1,361 @@
+"""
+Load-testing and benchmark harness for the API.
+
+Runs concurrent register/login/upload/list/detail workloads and records
+p50/p95/p99 latency, throughput and memory per endpoint as JSON, so runs can
+be compared for regressions:
+
+    python bench.py run --users 50 --uploads 4 --image-size 1024 --out base.json
+    python bench.py run --target uvicorn --out candidate.json
+    python bench.py compare base.json candidate.json
+
+Targets:
+
+- ``inprocess`` (default) drives the ASGI app directly, no sockets involved;
+- ``uvicorn`` starts a local uvicorn worker on a free port;
+- any ``http://`` URL benchmarks an already running server (no memory figures).
+
+The first two default to the in-memory Mongo stand-in (``mongomock://``, see
+database.py); pass ``--mongo-url mongodb://localhost:27017`` to use a local
+server instead.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+import typer
+from PIL import Image
+
+ROOT_DIR = Path(__file__).parent
+PHASES = ["register", "login", "upload", "list", "detail"]
+
+cli = typer.Typer(help="Benchmark the Radiologix API")
+
+
+def make_image(size: int, image_format: str, seed: int) -> bytes:
+    # Smooth gradient plus noise: compresses like a real scan rather than
+    # like pure noise or a flat image
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 200, size, dtype=np.float32)
+    pixels = gradient[None, :] + gradient[:, None] / 4 + rng.normal(0, 12, (size, size))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="L")
+    buffer = io.BytesIO()
+    image.save(buffer, image_format.upper())
+    return buffer.getvalue()
+
+
+def rss_bytes(pid: Optional[int] = None) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        import resource
+
+        # Peak rather than current, and in KiB on Linux but bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class MemorySampler:
+    """Sample the server's resident set size in the background during a phase."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.start = self.peak = self.end = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sample(self) -> None:
+        while True:
+            current = rss_bytes(self.pid)
+            if current is not None:
+                self.peak = max(self.peak or 0, current)
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.start = rss_bytes(self.pid)
+        self._task = asyncio.create_task(self._sample())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.end = rss_bytes(self.pid)
+        if self.end is not None:
+            self.peak = max(self.peak or 0, self.end)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        def mb(value):
+            return round(value / 2**20, 2) if value is not None else None
+
+        return {"rss_start_mb": mb(self.start), "rss_peak_mb": mb(self.peak), "rss_end_mb": mb(self.end)}
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+async def run_phase(name: str, calls: list, concurrency: int, server_pid: Optional[int], track: bool) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def timed(call):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await call()
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                response, ok = None, False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+            return response if ok else None
+
+    started = time.perf_counter()
+    with MemorySampler(server_pid) if track else nullcontext() as sampler:
+        results = await asyncio.gather(*(timed(call) for call in calls))
+    stats = summarize(latencies, errors, time.perf_counter() - started)
+    if sampler is not None:
+        stats.update(sampler.summary())
+    typer.echo(
+        f"{name:>8}: {stats['count']} requests, {errors} errors, "
+        f"p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms, {stats['throughput_rps']} req/s"
+    )
+    return {"stats": stats, "results": results}
+
+
+async def run_workload(http: httpx.AsyncClient, options: dict, server_pid: Optional[int], track: bool) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    image = make_image(options["image_size"], options["image_format"], options["seed"])
+    content_type = f"image/{options['image_format']}"
+    password = "bench-password"
+    emails = [f"bench-{run_id}-{i}@example.com" for i in range(options["users"])]
+    endpoints = {}
+
+    async def phase(name, calls):
+        outcome = await run_phase(name, calls, options["concurrency"], server_pid, track)
+        endpoints[name] = outcome["stats"]
+        return outcome["results"]
+
+    await phase("register", [
+        lambda email=email: http.post("/api/auth/register", json={"email": email, "name": "Bench", "password": password})
+        for email in emails
+    ])
+    tokens = await phase("login", [
+        lambda email=email: http.post("/api/auth/login", json={"email": email, "password": password})
+        for email in emails
+    ])
+    headers = [{"Authorization": f"Bearer {r.json()['access_token']}"} for r in tokens if r is not None]
+    if not headers:
+        raise typer.BadParameter("No user could log in; is the target healthy?")
+
+    uploaders = [h for h in headers for _ in range(options["uploads"])]
+    uploads = await phase("upload", [
+        lambda h=h, i=i: http.post(
+            "/api/scans", headers=h,
+            data={"scan_type": options["scan_type"]},
+            files={"image": (f"scan-{i}.{options['image_format']}", image, content_type)},
+        )
+        for i, h in enumerate(uploaders)
+    ])
+    await phase("list", [
+        lambda h=h: http.get("/api/scans", headers=h, params={"limit": options["page_size"]})
+        for h in headers for _ in range(options["lists"])
+    ])
+    scans = [(h, r.json()["id"]) for h, r in zip(uploaders, uploads) if r is not None]
+    await phase("detail", [lambda h=h, scan_id=scan_id: http.get(f"/api/scans/{scan_id}", headers=h) for h, scan_id in scans])
+    return endpoints
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_env(mongo_url: str, blob_dir: str) -> Dict[str, str]:
+    return {
+        "MONGO_URL": mongo_url,
+        "DB_NAME": f"bench_{uuid.uuid4().hex[:8]}",
+        "BLOB_STORE_BACKEND": "local",
+        "BLOB_STORE_PATH": blob_dir,
+        # The workload comes from one address and would trip per-IP limits
+        "RATE_LIMITS_ENABLED": "false",
+    }
+
+
+@asynccontextmanager
+async def open_target(target: str, mongo_url: str):
+    """Yield (client, server pid) for the requested target."""
+    timeout = httpx.Timeout(120.0)
+    if target.startswith(("http://", "https://")):
+        async with httpx.AsyncClient(base_url=target, timeout=timeout) as http:
+            yield http, None
+        return
+
+    with tempfile.TemporaryDirectory(prefix="radiologix-bench-") as blob_dir:
+        env = server_env(mongo_url, blob_dir)
+        if target == "inprocess":
+            # server.py reads its configuration at import time
+            os.environ.update(env)
+            sys.path.insert(0, str(ROOT_DIR))
+            import server
+
+            await server.app.router.startup()
+            try:
+                transport = httpx.ASGITransport(app=server.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as http:
+                    yield http, os.getpid()
+            finally:
+                await server.app.router.shutdown()
+            return
+
+        if target != "uvicorn":
+            raise typer.BadParameter(f"Unknown target {target!r}; use inprocess, uvicorn or a URL")
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT_DIR, env={**os.environ, **env},
+        )
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as http:
+                for _ in range(200):
+                    if process.poll() is not None:
+                        raise typer.BadParameter("uvicorn exited during startup")
+                    try:
+                        if (await http.get("/api/health")).status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    await asyncio.sleep(0.1)
+                yield http, process.pid
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command()
+def run(
+    target: str = typer.Option("inprocess", help="inprocess, uvicorn, or the base URL of a running server"),
+    mongo_url: str = typer.Option("mongomock://", help="Mongo for inprocess/uvicorn targets"),
+    users: int = typer.Option(20, min=1),
+    uploads: int = typer.Option(2, min=0, help="Uploads per user"),
+    lists: int = typer.Option(5, min=0, help="Listing requests per user"),
+    concurrency: int = typer.Option(16, min=1),
+    image_size: int = typer.Option(512, min=8, help="Edge length of the generated square images, in pixels"),
+    image_format: str = typer.Option("png", help="png or jpeg"),
+    scan_type: str = typer.Option("CT"),
+    page_size: int = typer.Option(50, min=1),
+    seed: int = typer.Option(0),
+    out: Optional[Path] = typer.Option(None, help="Where to write the JSON results"),
+):
+    """Run the workload once and record per-endpoint results."""
+    options = {
+        "users": users, "uploads": uploads, "lists": lists, "concurrency": concurrency,
+        "image_size": image_size, "image_format": image_format.lower(), "scan_type": scan_type,
+        "page_size": page_size, "seed": seed,
+    }
+    track = not target.startswith(("http://", "https://"))
+    # One INFO line per request would dominate the in-process timings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def main():
+        async with open_target(target, mongo_url) as (http, pid):
+            return await run_workload(http, options, pid, track)
+
+    endpoints = asyncio.run(main())
+    result = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "revision": git_revision(),
+            "target": target,
+            "mongo": mongo_url if track else None,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "options": options,
+        },
+        "endpoints": endpoints,
+    }
+    out = out or ROOT_DIR / "bench_results" / f"{datetime.utcnow():%Y%m%dT%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2))
+    typer.echo(f"Results written to {out}")
+
+
+@cli.command()
+def compare(
+    baseline: Path,
+    candidate: Path,
+    tolerance: float = typer.Option(0.10, help="Allowed relative slowdown before a metric counts as a regression"),
+):
+    """Compare two result files; exits non-zero if the candidate regressed."""
+    base = json.loads(baseline.read_text())["endpoints"]
+    cand = json.loads(candidate.read_text())["endpoints"]
+    regressions = []
+    typer.echo(f"{'endpoint':>8}  {'metric':<14} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for name in [p for p in PHASES if p in base and p in cand]:
+        for metric, higher_is_worse in [("p50_ms", True), ("p95_ms", True), ("p99_ms", True),
+                                        ("throughput_rps", False), ("rss_peak_mb", True), ("errors", True)]:
+            old, new = base[name].get(metric), cand[name].get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            worse = change > tolerance if higher_is_worse else change < -tolerance
+            if metric == "errors":
+                worse = new > old
+            marker = "  REGRESSION" if worse else ""
+            typer.echo(f"{name:>8}  {metric:<14} {old:>10} {new:>10} {change:>+8.1%}{marker}")
+            if worse:
+                regressions.append(f"{name} {metric}")
+    if regressions:
+        typer.echo(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        raise typer.Exit(code=1)
+    typer.echo("No regressions")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,176 @@
+"""
+In-process caches.
+
+TTLCache is a bounded LRU map whose entries also expire after a fixed TTL.
+SharedInvalidation fans invalidations out to every worker over Redis pub/sub
+so per-process caches stay coherent when the API runs with several workers.
+AnalysisResultCache memoizes AI reports per image content and model.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Hashable, Optional
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": Counter(self.hits),
+            "misses": Counter(self.misses),
+            "evictions": Counter(self.evictions),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SharedInvalidation:
+    """
+    Broadcast cache invalidations between workers through a Redis channel.
+
+    Without a Redis URL this is a no-op and each worker relies on its own TTL.
+    """
+
+    def __init__(self, cache: TTLCache, redis_url: Optional[str], channel: str):
+        self.cache = cache
+        self.redis_url = redis_url
+        self.channel = channel
+        self._redis = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if not self.redis_url:
+            return
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(self.redis_url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub) -> None:
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    key = message["data"].decode()
+                    if key == "*":
+                        self.cache.clear()
+                    else:
+                        self.cache.discard(key)
+        except asyncio.CancelledError:
+            await pubsub.unsubscribe(self.channel)
+            raise
+        except Exception:
+            # Fall back to TTL-only coherence rather than taking the app down
+            logger.exception("Cache invalidation listener on %s stopped", self.channel)
+
+    async def invalidate(self, key: str) -> None:
+        self.cache.discard(key)
+        if self._redis is not None:
+            await self._redis.publish(self.channel, key)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._redis is not None:
+            await self._redis.close()
+
+
+class AnalysisResultCache:
+    """
+    Two-tier memo of analysis reports keyed by (content hash, scan type,
+    model version): an in-process LRU in front of a Mongo collection that
+    survives restarts and is shared by every worker.
+    """
+
+    def __init__(self, collection, maxsize: int = 10000, ttl: float = 24 * 3600):
+        self.collection = collection
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.store_hits = 0
+        self.misses = 0
+
+    async def get(self, image_ref: str, scan_type: str, model_version: str) -> Optional[str]:
+        key = (image_ref, scan_type, model_version)
+        report = self.memory.get(key)
+        if report is not None:
+            return report
+        doc = await self.collection.find_one(
+            {"image_ref": image_ref, "scan_type": scan_type, "model_version": model_version},
+            {"_id": 0, "ai_report": 1},
+        )
+        if doc is None:
+            self.misses += 1
+            return None
+        self.store_hits += 1
+        self.memory.set(key, doc["ai_report"])
+        return doc["ai_report"]
+
+    async def set(self, image_ref: str, scan_type: str, model_version: str, ai_report: str) -> None:
+        self.memory.set((image_ref, scan_type, model_version), ai_report)
+        await self.collection.update_one(
+            {"image_ref": image_ref, "scan_type": scan_type, "model_version": model_version},
+            {"$set": {"ai_report": ai_report, "updated_at": datetime.utcnow()},
+             "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def stats(self) -> dict:
+        memory_hits = self.memory.hits
+        lookups = memory_hits + self.store_hits + self.misses
+        return {
+            "memory": self.memory.stats(),
+            "store_hits": Counter(self.store_hits),
+            "misses": Counter(self.misses),
+            "hit_rate": (memory_hits + self.store_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,260 @@
+"""
+Negotiated response compression.
+
+CompressionMiddleware encodes responses with the best encoding both sides
+support: brotli (``br``, needs the brotli package), zstd (needs zstandard)
+or gzip. It skips small bodies, responses that already carry a
+Content-Encoding, partial content, and content types that are compressed
+already (images, zip, the .npy arrays) or must not be buffered (SSE).
+
+Streamed bodies of unknown length, such as NDJSON listings, are
+compressed chunk by chunk and flushed after each one, so clients still see
+lines as they are produced.
+
+Compressing a large body takes long enough to stall every other request
+on the worker, so bodies or chunks above ``thread_bytes`` are compressed
+in a thread.
+"""
+
+import asyncio
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Already compressed, or streamed to the client event by event
+SKIPPED_CONTENT_TYPES = (
+    "image/", "video/", "audio/", "application/zip", "application/gzip", "application/x-npy",
+    "application/zstd", "application/octet-stream", "application/vnd.apache.parquet", "text/event-stream",
+)
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int = 6):
+        # wbits=31 writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, level: int = 4):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def process(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def process(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+ENCODERS = {"br": BrotliEncoder, "zstd": ZstdEncoder, "gzip": GzipEncoder}
+
+
+def available_encodings(preference: Sequence[str]) -> List[str]:
+    installed = {"br": brotli is not None, "zstd": zstandard is not None, "gzip": True}
+    return [name for name in preference if installed.get(name)]
+
+
+def negotiate(accept_encoding: str, supported: Sequence[str]) -> Optional[str]:
+    """Pick the supported encoding with the highest q-value; ties go to server preference."""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[token] = q
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        encodings: Sequence[str] = ("br", "zstd", "gzip"),
+        min_bytes: int = 1024,
+        thread_bytes: int = 256 * 1024,
+        levels: Optional[Dict[str, int]] = None,
+    ):
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.min_bytes = min_bytes
+        self.thread_bytes = thread_bytes
+        self.levels = levels or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def encoder(self, encoding: str):
+        level = self.levels.get(encoding)
+        return ENCODERS[encoding]() if level is None else ENCODERS[encoding](level)
+
+    async def run(self, func, data: bytes, *args) -> bytes:
+        if len(data) >= self.thread_bytes:
+            return await asyncio.to_thread(func, data, *args)
+        return func(data, *args)
+
+
+def _compressible(status: int, headers: MutableHeaders) -> bool:
+    if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "").lower()
+    return not content_type.startswith(SKIPPED_CONTENT_TYPES)
+
+
+class _CompressingResponder:
+    """
+    Wraps ``send`` for one response.
+
+    Bodies of known length are buffered and compressed in one go. Streams
+    are buffered only until they reach ``min_bytes``, then compressed chunk
+    by chunk.
+    """
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self._start: Optional[dict] = None
+        self._known_length = False
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._encoder = None
+        self._passthrough = False
+
+    async def send(self, message: dict) -> None:
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=list(message["headers"]))
+            length = headers.get("content-length")
+            if _compressible(message["status"], headers) and not (
+                length is not None and length.isdigit() and int(length) < self.middleware.min_bytes
+            ):
+                headers.add_vary_header("Accept-Encoding")
+                self._start = {**message, "headers": headers.raw}
+                self._known_length = length is not None
+            else:
+                self._passthrough = True
+                await self._send(message)
+            return
+        if message["type"] != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self._start is None:
+            await self._send_chunk(body, more_body)
+            return
+
+        self._buffer.append(body)
+        self._buffered += len(body)
+        if more_body and (self._known_length or self._buffered < self.middleware.min_bytes):
+            return
+        body, self._buffer = b"".join(self._buffer), []
+        start, self._start = self._start, None
+        headers = MutableHeaders(raw=start["headers"])
+        if not more_body and len(body) < self.middleware.min_bytes:
+            # Too small to be worth it; send as is
+            self._passthrough = True
+            await self._send(start)
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        self._encoder = self.middleware.encoder(self.encoding)
+        headers["Content-Encoding"] = self.encoding
+        if "etag" in headers and not headers["etag"].startswith("W/"):
+            # A strong ETag names the exact bytes, which are now different
+            headers["ETag"] = f"W/{headers['etag']}"
+        if more_body:
+            del headers["Content-Length"]
+            await self._send(start)
+            await self._send_chunk(body, more_body)
+            return
+        body = await self.middleware.run(self._compress_all, body)
+        headers["Content-Length"] = str(len(body))
+        await self._send(start)
+        await self._send({"type": "http.response.body", "body": body})
+
+    async def _send_chunk(self, body: bytes, more_body: bool) -> None:
+        out = await self.middleware.run(self._encoder.process, body, True) if body else b""
+        if not more_body:
+            out += self._encoder.finish()
+        await self._send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+    def _compress_all(self, body: bytes) -> bytes:
+        return self._encoder.process(body) + self._encoder.finish()
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parse COMPRESSION_LEVELS, e.g. ``gzip=5,br=5``."""
+    levels: Dict[str, int] = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = entry.partition("=")
+        if name.strip() not in ENCODERS or not level.strip().isdigit():
+            raise ValueError(f"Invalid COMPRESSION_LEVELS entry: {entry}")
+        levels[name.strip()] = int(level)
+    return levels
+
+
+def parse_encodings(spec: str) -> Tuple[str, ...]:
+    encodings = tuple(filter(None, (part.strip().lower() for part in spec.split(","))))
+    unknown = [name for name in encodings if name not in ENCODERS]
+    if unknown:
+        raise ValueError(f"Unknown COMPRESSION_ENCODINGS: {', '.join(unknown)}")
+    return encodings
@@ -0,0 +1,166 @@
+"""
+MongoDB client construction.
+
+MONGO_URL may be a regular mongodb:// URL or ``mongomock://`` for an
+in-memory stand-in (requires the mongomock-motor package). The stand-in is
+meant for benchmarks and local experiments; it does not support every server
+feature (no explain(), text search, change streams or read routing) and
+ignores the pool settings below.
+
+Pool and routing settings, all optional:
+
+- MONGO_MIN_POOL_SIZE / MONGO_MAX_POOL_SIZE: connections kept per server
+  (pymongo defaults: 0 / 100)
+- MONGO_WAIT_QUEUE_TIMEOUT_MS: how long a request waits for a free
+  connection before failing, instead of queueing indefinitely
+- MONGO_COMPRESSORS: e.g. ``zstd,snappy``; needs the zstandard or
+  python-snappy package, and the server picks the first it supports
+- MONGO_READ_PREFERENCE: default routing for every read (``primary``)
+- MONGO_LISTING_READ_PREFERENCE: routing for listing endpoints only, e.g.
+  ``secondaryPreferred``; MONGO_MAX_STALENESS_SECONDS bounds how far behind
+  a secondary may be
+"""
+
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+from pymongo import monitoring
+from pymongo.read_preferences import (
+    Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred, _ServerMode,
+)
+
+from metrics import Counter, Labelled
+
+IN_MEMORY_SCHEME = "mongomock://"
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def is_in_memory(mongo_url: str) -> bool:
+    return mongo_url.startswith(IN_MEMORY_SCHEME)
+
+
+def read_preference(name: str, max_staleness: int = -1) -> _ServerMode:
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference {name!r}; expected one of {', '.join(READ_PREFERENCES)}")
+    if name == "primary":
+        return Primary()
+    return READ_PREFERENCES[name](max_staleness=max_staleness)
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+    Connection pool utilization per server, from pymongo pool events.
+
+    Callbacks run on whichever thread touches the pool, hence the lock.
+    """
+
+    # Event totals, as opposed to the open/waiting/checked_out levels
+    COUNTERS = ("pools_created", "pools_cleared", "created", "checkouts")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._checkout_failures: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _count(self, event, field: str, delta: int = 1) -> None:
+        with self._lock:
+            self._servers[self._address(event)][field] += delta
+
+    def pool_created(self, event) -> None:
+        self._count(event, "pools_created")
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        self._count(event, "pools_cleared")
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        self._count(event, "open")
+        self._count(event, "created")
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._count(event, "open", -1)
+
+    def connection_check_out_started(self, event) -> None:
+        self._count(event, "waiting")
+
+    def connection_check_out_failed(self, event) -> None:
+        self._count(event, "waiting", -1)
+        with self._lock:
+            self._checkout_failures[self._address(event)][event.reason] += 1
+
+    def connection_checked_out(self, event) -> None:
+        self._count(event, "waiting", -1)
+        self._count(event, "checked_out")
+        self._count(event, "checkouts")
+
+    def connection_checked_in(self, event) -> None:
+        self._count(event, "checked_out", -1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return Labelled("address", {
+                address: {
+                    **{field: Counter(value) if field in self.COUNTERS else value for field, value in counters.items()},
+                    "checkout_failed": Labelled("reason", {
+                        reason: Counter(count) for reason, count in self._checkout_failures.get(address, {}).items()
+                    }),
+                }
+                for address, counters in self._servers.items()
+            })
+
+
+def client_options() -> dict:
+    options = {}
+    if "MONGO_MIN_POOL_SIZE" in os.environ:
+        options["minPoolSize"] = int(os.environ["MONGO_MIN_POOL_SIZE"])
+    if "MONGO_MAX_POOL_SIZE" in os.environ:
+        options["maxPoolSize"] = int(os.environ["MONGO_MAX_POOL_SIZE"])
+    if "MONGO_WAIT_QUEUE_TIMEOUT_MS" in os.environ:
+        options["waitQueueTimeoutMS"] = int(os.environ["MONGO_WAIT_QUEUE_TIMEOUT_MS"])
+    if os.environ.get("MONGO_COMPRESSORS"):
+        options["compressors"] = os.environ["MONGO_COMPRESSORS"]
+    if os.environ.get("MONGO_READ_PREFERENCE"):
+        options["read_preference"] = read_preference(
+            os.environ["MONGO_READ_PREFERENCE"], int(os.environ.get("MONGO_MAX_STALENESS_SECONDS", -1))
+        )
+    return options
+
+
+def listing_read_preference(mongo_url: str) -> Optional[_ServerMode]:
+    """Read preference for listing queries, or None to use the client default."""
+    name = os.environ.get("MONGO_LISTING_READ_PREFERENCE")
+    if not name or is_in_memory(mongo_url):
+        return None
+    return read_preference(name, int(os.environ.get("MONGO_MAX_STALENESS_SECONDS", -1)))
+
+
+def create_client(mongo_url: str, **options):
+    if is_in_memory(mongo_url):
+        from mongomock_motor import AsyncMongoMockClient
+
+        return AsyncMongoMockClient()
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    return AsyncIOMotorClient(mongo_url, **{**client_options(), **options})
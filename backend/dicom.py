@@ -0,0 +1,273 @@
+"""
+DICOM series ingestion.
+
+A CT or MRI study arrives as hundreds of single-frame DICOM files (or a few
+multi-frame ones). Ingestion reads only the headers to group files into
+series and order their slices, then decodes one file at a time into a
+single contiguous ``(frames, rows, columns)`` .npy volume in the stored
+pixel type. The volume is stored in the blob store like any other blob.
+
+Readers memory-map the volume, so fetching a slice, a slab or the middle
+frame for analysis touches only those pages rather than the whole study.
+
+Requires the pydicom package; compressed transfer syntaxes additionally
+need one of its pixel data handlers (pylibjpeg, gdcm).
+"""
+
+import io
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import imaging
+
+try:
+    import pydicom
+    from pydicom.errors import InvalidDicomError
+    from pydicom.multival import MultiValue
+except ImportError:
+    pydicom = None
+    InvalidDicomError = Exception
+    MultiValue = list
+
+
+class DicomUnavailable(RuntimeError):
+    pass
+
+
+def require_pydicom() -> None:
+    if pydicom is None:
+        raise DicomUnavailable("DICOM ingestion requires the pydicom package")
+
+
+def _first(value, default=None):
+    # Multi-valued elements (e.g. several window presets) use the first one
+    if value is None or value == "":
+        return default
+    if isinstance(value, (list, tuple, MultiValue)):
+        return value[0] if len(value) else default
+    return value
+
+
+def _float(value, default: Optional[float] = None) -> Optional[float]:
+    value = _first(value)
+    try:
+        return float(value) if value is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass
+class DicomFile:
+    path: Path
+    study_uid: str
+    series_uid: str
+    sop_uid: str
+    instance_number: Optional[int]
+    position: Optional[float]
+    frames: int
+    rows: int
+    columns: int
+    dtype: str
+    slope: float
+    intercept: float
+    window_center: Optional[float]
+    window_width: Optional[float]
+    modality: Optional[str]
+    series_description: Optional[str]
+    study_description: Optional[str]
+    study_date: Optional[str]
+    pixel_spacing: Optional[List[float]]
+    slice_thickness: Optional[float]
+
+
+def _pixel_dtype(ds) -> np.dtype:
+    bits = int(ds.get("BitsAllocated", 16))
+    signed = int(ds.get("PixelRepresentation", 0)) == 1
+    if bits == 8:
+        return np.dtype(np.int8 if signed else np.uint8)
+    if bits == 16:
+        return np.dtype(np.int16 if signed else np.uint16)
+    if bits == 32:
+        return np.dtype(np.int32 if signed else np.uint32)
+    raise ValueError(f"Unsupported BitsAllocated: {bits}")
+
+
+def _slice_position(ds) -> Optional[float]:
+    # Distance along the slice normal; sorts correctly whatever the
+    # acquisition orientation
+    position = ds.get("ImagePositionPatient")
+    orientation = ds.get("ImageOrientationPatient")
+    if position is None or orientation is None or len(orientation) != 6:
+        return None
+    row, column = np.asarray(orientation[:3], float), np.asarray(orientation[3:], float)
+    return float(np.dot(np.cross(row, column), np.asarray(position, float)))
+
+
+def read_header(path: Path) -> Optional[DicomFile]:
+    """Parse one file's header; None if it is not a DICOM image."""
+    require_pydicom()
+    try:
+        ds = pydicom.dcmread(str(path), stop_before_pixels=True)
+    except (InvalidDicomError, OSError, ValueError):
+        return None
+    if "Rows" not in ds or "Columns" not in ds or "SeriesInstanceUID" not in ds:
+        return None
+    if int(ds.get("SamplesPerPixel", 1)) != 1:
+        raise ValueError(f"{path.name}: only monochrome images are supported")
+    instance_number = ds.get("InstanceNumber")
+    spacing = ds.get("PixelSpacing")
+    return DicomFile(
+        path=path,
+        study_uid=str(ds.get("StudyInstanceUID", "")),
+        series_uid=str(ds.SeriesInstanceUID),
+        sop_uid=str(ds.get("SOPInstanceUID", path.name)),
+        instance_number=int(instance_number) if instance_number not in (None, "") else None,
+        position=_slice_position(ds),
+        frames=int(ds.get("NumberOfFrames", 1) or 1),
+        rows=int(ds.Rows),
+        columns=int(ds.Columns),
+        dtype=_pixel_dtype(ds).str,
+        slope=_float(ds.get("RescaleSlope"), 1.0),
+        intercept=_float(ds.get("RescaleIntercept"), 0.0),
+        window_center=_float(ds.get("WindowCenter")),
+        window_width=_float(ds.get("WindowWidth")),
+        modality=str(ds.get("Modality")) if ds.get("Modality") else None,
+        series_description=str(ds.get("SeriesDescription")) if ds.get("SeriesDescription") else None,
+        study_description=str(ds.get("StudyDescription")) if ds.get("StudyDescription") else None,
+        study_date=str(ds.get("StudyDate")) if ds.get("StudyDate") else None,
+        pixel_spacing=[float(v) for v in spacing] if spacing else None,
+        slice_thickness=_float(ds.get("SliceThickness")),
+    )
+
+
+@dataclass
+class DicomSeries:
+    study_uid: str
+    series_uid: str
+    files: List[DicomFile] = field(default_factory=list)
+
+    @property
+    def frames(self) -> int:
+        return sum(f.frames for f in self.files)
+
+    def metadata(self) -> dict:
+        """Everything readers need to interpret the volume; no patient identifiers."""
+        first = self.files[0]
+        return {
+            "study_instance_uid": self.study_uid,
+            "series_instance_uid": self.series_uid,
+            "modality": first.modality,
+            "series_description": first.series_description,
+            "study_description": first.study_description,
+            "study_date": first.study_date,
+            "frames": self.frames,
+            "rows": first.rows,
+            "columns": first.columns,
+            "dtype": first.dtype,
+            "pixel_spacing": first.pixel_spacing,
+            "slice_thickness": first.slice_thickness,
+            "window_center": first.window_center,
+            "window_width": first.window_width,
+            # Per frame, since some series vary the rescale slice by slice
+            "rescale_slopes": [f.slope for f in self.files for _ in range(f.frames)],
+            "rescale_intercepts": [f.intercept for f in self.files for _ in range(f.frames)],
+            "slice_positions": [f.position for f in self.files for _ in range(f.frames)],
+        }
+
+
+def group_series(files: Iterable[DicomFile]) -> List[DicomSeries]:
+    series: Dict[Tuple[str, str], DicomSeries] = {}
+    seen = set()
+    for f in files:
+        if f.sop_uid in seen:
+            continue
+        seen.add(f.sop_uid)
+        key = (f.study_uid, f.series_uid)
+        series.setdefault(key, DicomSeries(*key)).files.append(f)
+    for s in series.values():
+        if all(f.position is not None for f in s.files):
+            s.files.sort(key=lambda f: f.position)
+        else:
+            s.files.sort(key=lambda f: (f.instance_number is None, f.instance_number or 0, f.path.name))
+        shapes = {(f.rows, f.columns, f.dtype) for f in s.files}
+        if len(shapes) > 1:
+            raise ValueError(f"Series {s.series_uid} mixes frame sizes or pixel types")
+    return list(series.values())
+
+
+def write_volume(series: DicomSeries, path: Path) -> None:
+    """Decode the series file by file into one contiguous .npy volume."""
+    require_pydicom()
+    first = series.files[0]
+    volume = np.lib.format.open_memmap(
+        str(path), mode="w+", dtype=np.dtype(first.dtype), shape=(series.frames, first.rows, first.columns)
+    )
+    index = 0
+    for f in series.files:
+        pixels = pydicom.dcmread(str(f.path)).pixel_array
+        pixels = pixels.reshape(f.frames, f.rows, f.columns)
+        volume[index:index + f.frames] = pixels
+        index += f.frames
+    volume.flush()
+    del volume
+
+
+def open_volume(path: Path) -> np.ndarray:
+    return np.load(str(path), mmap_mode="r", allow_pickle=False)
+
+
+def window(frame: np.ndarray, slope: float, intercept: float,
+           center: Optional[float] = None, width: Optional[float] = None) -> np.ndarray:
+    """Rescale stored values to modality units and window them to 8 bits."""
+    values = frame.astype(np.float32) * slope + intercept
+    if center is None or width is None or width <= 0:
+        low, high = float(values.min()), float(values.max())
+    else:
+        low, high = center - width / 2, center + width / 2
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return np.clip((values - low) * scale, 0, 255).astype(np.uint8)
+
+
+def render_frame(path: Path, metadata: dict, index: int,
+                 center: Optional[float] = None, width: Optional[float] = None) -> Image.Image:
+    volume = open_volume(path)
+    pixels = window(
+        volume[index],
+        metadata["rescale_slopes"][index],
+        metadata["rescale_intercepts"][index],
+        metadata.get("window_center") if center is None else center,
+        metadata.get("window_width") if width is None else width,
+    )
+    return Image.fromarray(pixels, mode="L")
+
+
+def frame_png(path: Path, metadata: dict, index: int,
+              center: Optional[float] = None, width: Optional[float] = None) -> bytes:
+    buffer = io.BytesIO()
+    render_frame(path, metadata, index, center, width).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def frame_npy(path: Path, index: int) -> bytes:
+    """One frame in its stored pixel type, as .npy bytes."""
+    return imaging.encode_array(np.ascontiguousarray(open_volume(path)[index]))
+
+
+def decode_volume(path: Path, metadata: dict, preview_size: int = imaging.PREVIEW_SIZE,
+                  thumbnail_size: int = imaging.THUMBNAIL_SIZE) -> imaging.DecodedImage:
+    """Derivatives and analyzer input for a series, from its middle slice."""
+    image = render_frame(path, metadata, metadata["frames"] // 2)
+    return imaging.derive(image, metadata["columns"], metadata["rows"], preview_size, thumbnail_size)
+
+
+def npy_header(dtype: np.dtype, shape: Tuple[int, ...]) -> bytes:
+    """Header for a C-ordered .npy file, so slabs can be streamed frame by frame."""
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buffer, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape}
+    )
+    return buffer.getvalue()
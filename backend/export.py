@@ -0,0 +1,261 @@
+"""
+Bulk export of scan reports.
+
+Reports are read through a Mongo cursor a batch at a time and each batch is
+encoded and handed on before the next is fetched, so memory stays flat
+however many reports are exported. Formats:
+
+- csv: one header row, then one row per report; text that a spreadsheet
+  would run as a formula is prefixed with ``'``
+- ndjson: one JSON document per line
+- parquet: one row group per batch; needs the pyarrow package
+
+Images are not inlined: rows carry the blob key (``image_ref``) and the API
+path the image can be fetched from (``image_url``).
+
+The API serves a user's own reports on /api/scans/export. For analytics
+across all users, run the CLI against the database directly:
+
+    python export.py --format parquet --out reports.parquet
+    python export.py --format csv --scan-type CT --since 2024-01-01 > ct.csv
+"""
+
+import asyncio
+import csv
+import io
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+import typer
+from dotenv import load_dotenv
+
+from database import create_client
+from responses import dumps
+from search import search_filter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Column order for every format; image_url is derived from id
+EXPORT_FIELDS = [
+    "id", "user_id", "scan_type", "analysis_status", "ai_report",
+    "image_ref", "image_url", "image_content_type", "image_size", "image_width", "image_height",
+    "series_id", "frame_count", "created_at", "updated_at",
+]
+INTEGER_FIELDS = {"image_size", "image_width", "image_height", "frame_count"}
+DATETIME_FIELDS = {"created_at", "updated_at"}
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Leading characters that make spreadsheets treat a cell as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+class ExportUnavailable(RuntimeError):
+    pass
+
+
+def export_filter(user_id: Optional[str] = None, scan_type: Optional[str] = None,
+                  created_from: Optional[datetime] = None, created_to: Optional[datetime] = None) -> dict:
+    query = search_filter(user_id, scan_type, created_from, created_to)
+    if user_id is None:
+        del query["user_id"]
+    return query
+
+
+def export_row(scan: dict) -> dict:
+    row = {field: scan.get(field) for field in EXPORT_FIELDS}
+    row["image_url"] = f"/api/scans/{scan['id']}/image"
+    return row
+
+
+async def iter_batches(collection, query: dict, batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Rows matching ``query``, oldest first, ``batch_size`` at a time."""
+    projection = {"_id": 0, **{field: 1 for field in EXPORT_FIELDS if field != "image_url"}}
+    # Per user, user_created_desc serves the sort. Across all users only _id
+    # is indexed in creation order; sorting on created_at would buffer the
+    # whole collection on the server
+    sort = [("created_at", 1), ("id", 1)] if "user_id" in query else [("_id", 1)]
+    cursor = collection.find(query, projection).sort(sort).batch_size(batch_size)
+    batch = []
+    async for scan in cursor:
+        batch.append(export_row(scan))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CsvExport:
+    media_type = "text/csv; charset=utf-8"
+    extension = "csv"
+
+    def header(self) -> bytes:
+        return self._encode([EXPORT_FIELDS])
+
+    def write(self, rows: List[dict]) -> bytes:
+        return self._encode([
+            [self._cell(row[field]) for field in EXPORT_FIELDS] for row in rows
+        ])
+
+    def finish(self) -> bytes:
+        return b""
+
+    @staticmethod
+    def _cell(value):
+        if value is None:
+            return ""
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+            return "'" + value
+        return value
+
+    @staticmethod
+    def _encode(rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+
+class NdjsonExport:
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def header(self) -> bytes:
+        return b""
+
+    def write(self, rows: List[dict]) -> bytes:
+        return b"".join(dumps(row) + b"\n" for row in rows)
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class ParquetExport:
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def __init__(self, compression: str = "zstd"):
+        if pyarrow is None:
+            raise ExportUnavailable("Parquet export requires the pyarrow package")
+        # A fixed schema, so batches with only missing values still line up
+        self.schema = pyarrow.schema([
+            (field, pyarrow.int64() if field in INTEGER_FIELDS
+             else pyarrow.timestamp("us") if field in DATETIME_FIELDS
+             else pyarrow.string())
+            for field in EXPORT_FIELDS
+        ])
+        self._sink = _ChunkSink()
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, self.schema, compression=compression)
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def write(self, rows: List[dict]) -> bytes:
+        self._writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        # The footer, with the schema and row group index
+        self._writer.close()
+        return self._sink.drain()
+
+
+EXPORT_FORMATS: Dict[str, type] = {"csv": CsvExport, "ndjson": NdjsonExport, "parquet": ParquetExport}
+
+
+async def export_chunks(collection, query: dict, exporter, batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """The encoded export, one chunk per batch."""
+    header = exporter.header()
+    if header:
+        yield header
+    async for rows in iter_batches(collection, query, batch_size):
+        # Encoding a batch (parquet especially) is CPU work, off the event loop
+        yield await asyncio.to_thread(exporter.write, rows)
+    footer = exporter.finish()
+    if footer:
+        yield footer
+
+
+cli = typer.Typer(help="Export Radiologix scan reports")
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise typer.BadParameter(f"{value!r} is not an ISO date")
+
+
+@cli.command()
+def reports(
+    format: str = typer.Option("csv", help="csv, ndjson or parquet"),
+    out: Optional[Path] = typer.Option(None, help="Output file; defaults to stdout"),
+    user_id: Optional[str] = typer.Option(None, help="Only this user's reports; defaults to everyone's"),
+    scan_type: Optional[str] = typer.Option(None),
+    since: Optional[str] = typer.Option(None, help="Created at or after (ISO date)"),
+    until: Optional[str] = typer.Option(None, help="Created before (ISO date)"),
+    batch_size: int = typer.Option(DEFAULT_BATCH_SIZE, min=1, help="Reports per Mongo batch (and parquet row group)"),
+):
+    """Stream scan reports to a file, oldest first."""
+    if format not in EXPORT_FORMATS:
+        raise typer.BadParameter(f"Unknown format {format!r}; use {', '.join(EXPORT_FORMATS)}")
+    try:
+        exporter = EXPORT_FORMATS[format]()
+    except ExportUnavailable as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(code=1)
+    query = export_filter(user_id, scan_type, _parse_date(since), _parse_date(until))
+
+    async def run():
+        load_dotenv(Path(__file__).parent / ".env")
+        client = create_client(os.environ["MONGO_URL"])
+        output = open(out, "wb") if out else sys.stdout.buffer
+        try:
+            collection = client[os.environ["DB_NAME"]].scan_reports
+            async for chunk in export_chunks(collection, query, exporter, batch_size):
+                output.write(chunk)
+        finally:
+            if out:
+                output.close()
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    cli()
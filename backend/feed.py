@@ -0,0 +1,415 @@
+"""
+Per-user feed of scan report changes.
+
+Dashboards keep their listing current by applying the changes from this feed
+instead of re-fetching it. Each change carries a resume token; a client that
+reconnects with the last token it saw receives only what changed after it.
+
+ChangeStreamFeed watches scan_reports with one Mongo change stream per
+process, filtered to the listing fields, and fans its events out to the
+open feeds of each report's owner. Updates carry only the fields that
+changed. Change streams need a replica set. On a standalone server the feed
+switches to PollingFeed the first time it finds out, and the in-memory
+stand-in always uses PollingFeed.
+
+PollingFeed re-queries the user's reports whose updated_at moved past the
+token, every ``interval`` seconds. Changed reports are sent whole. updated_at
+comes from the writer's clock before the write commits, so a slow writer can
+commit a value behind what the feed has already passed; each poll therefore
+re-reads an ``overlap_seconds`` window behind its position and skips the
+(id, updated_at) pairs it has already sent. A change committed later than
+that window is still missed.
+
+A feed opened without a token starts with a ``ready`` change carrying the
+current position. Clients should open the feed first and fetch their listing
+after ``ready``, so nothing is lost in between. Applying a change twice is
+harmless, and clients should apply both inserts and updates by id: a
+resumed feed repeats the overlap window, and a late insert may arrive as an
+update.
+
+Tokens from one kind of feed are not valid for the other, and change stream
+history does not last forever. When a token cannot be honoured, the feed
+emits a ``reset`` change. The client should re-fetch its listing, then carry
+on from the reset's token.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Deque, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from pymongo.errors import OperationFailure
+
+from database import is_in_memory
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Server error when $changeStream runs on a standalone mongod
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class FeedChange(NamedTuple):
+    op: str  # ready, insert, update or reset
+    scan: Optional[dict]
+    token: str
+
+
+class InvalidResumeToken(ValueError):
+    pass
+
+
+def encode_token(value: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def decode_token(token: str) -> dict:
+    try:
+        value = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        raise InvalidResumeToken(token)
+    if not isinstance(value, dict):
+        raise InvalidResumeToken(token)
+    return value
+
+
+class PollingFeed:
+    def __init__(self, collection, fields: Sequence[str], interval: float = 2.0, batch_size: int = 100,
+                 overlap_seconds: float = 5.0):
+        self.collection = collection
+        self.fields = list(fields)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.changes_sent = 0
+        self.resets = 0
+
+    def _position(self, token: Optional[str]) -> Tuple[Optional[Tuple[datetime, str]], bool]:
+        """(updated_at, id) to continue after, and whether the token had to be discarded."""
+        if token is None:
+            return None, False
+        try:
+            value = decode_token(token)
+            return (datetime.fromisoformat(value["t"]), str(value["id"])), False
+        except (InvalidResumeToken, KeyError, TypeError, ValueError):
+            return None, True
+
+    @staticmethod
+    def _token(position: Tuple[datetime, str]) -> str:
+        return encode_token({"t": position[0].isoformat(), "id": position[1]})
+
+    async def changes(self, user_id: str, token: Optional[str] = None) -> AsyncIterator[Optional[FeedChange]]:
+        """Changes after ``token``, forever; yields None after each idle poll."""
+        position, discarded = self._position(token)
+        if position is None:
+            # Start from now; there is no history to replay. BSON dates only
+            # keep milliseconds
+            now = datetime.utcnow()
+            position = (now.replace(microsecond=now.microsecond // 1000 * 1000), "")
+            self.resets += discarded
+            yield FeedChange("reset" if discarded else "ready", None, self._token(position))
+        projection = {"_id": 0, **{field: 1 for field in self.fields}, "id": 1, "created_at": 1, "updated_at": 1}
+        # (id, updated_at) of the changes sent within the overlap window; a
+        # token is the position of the last change its client received
+        sent: Set[Tuple[str, datetime]] = {(position[1], position[0])}
+        while True:
+            window_start = position[0] - self.overlap
+            after = None
+            while True:
+                if after is None:
+                    query = {"user_id": user_id, "updated_at": {"$gte": window_start}}
+                else:
+                    query = {
+                        "user_id": user_id,
+                        "$or": [
+                            {"updated_at": {"$gt": after[0]}},
+                            {"updated_at": after[0], "id": {"$gt": after[1]}},
+                        ],
+                    }
+                scans = await (
+                    self.collection.find(query, projection)
+                    .sort([("updated_at", 1), ("id", 1)])
+                    .limit(self.batch_size)
+                    .to_list(self.batch_size)
+                )
+                for scan in scans:
+                    updated_at = scan.pop("updated_at")
+                    after = (updated_at, scan["id"])
+                    if (scan["id"], updated_at) in sent:
+                        continue
+                    sent.add((scan["id"], updated_at))
+                    # Created after everything the client has seen: new to it
+                    op = "insert" if scan.get("created_at") and scan["created_at"] > position[0] else "update"
+                    position = max(position, after)
+                    self.changes_sent += 1
+                    yield FeedChange(op, scan, self._token(position))
+                if len(scans) < self.batch_size:
+                    break
+            window_start = position[0] - self.overlap
+            sent = {key for key in sent if key[1] >= window_start}
+            yield None
+            await asyncio.sleep(self.interval)
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"changes_sent": Counter(self.changes_sent), "resets": Counter(self.resets)}
+
+
+class _Subscriber:
+    """Change events for one open feed, as the shared stream delivers them."""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.events: Deque[dict] = deque()
+        # Set when events had to be dropped: the token to reset the client to
+        self.overflowed_at: Optional[dict] = None
+        self.closed = False
+        self._wakeup = asyncio.Event()
+
+    def push(self, event: dict) -> None:
+        if len(self.events) >= self.max_pending:
+            # Too slow a reader; drop what it has not read and reset it
+            self.events.clear()
+            self.overflowed_at = event["_id"]
+        else:
+            self.events.append(event)
+        self._wakeup.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+
+    def skip_through(self, event_id: dict) -> None:
+        """Drop buffered events up to and including ``event_id``, if it is buffered."""
+        ids = [event["_id"] for event in self.events]
+        if event_id in ids:
+            for _ in range(ids.index(event_id) + 1):
+                self.events.popleft()
+
+    async def wait(self, timeout: float) -> None:
+        if not self.events and not self.closed and self.overflowed_at is None:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class ChangeStreamFeed:
+    """
+    One change stream per process, shared by every open feed.
+
+    Each read on a change stream occupies one of Motor's worker threads for
+    up to ``max_await_seconds``, so a stream per feed would let idle feeds
+    starve the rest of the API. Instead a single background stream watches
+    all users and hands each event to the feeds of the report's owner.
+
+    A feed resuming from a token first catches up on a short-lived stream of
+    its own, from the token to the present, then continues from the shared
+    stream, skipping whatever the catch-up already sent.
+    """
+
+    def __init__(self, collection, fields: Sequence[str], fallback: PollingFeed, max_await_seconds: float = 2.0,
+                 catch_up_await_seconds: float = 0.5, idle_seconds: float = 5.0, max_pending: int = 1000):
+        self.collection = collection
+        self.fields = list(fields)
+        self.fallback = fallback
+        self.max_await_seconds = max_await_seconds
+        self.catch_up_await_seconds = catch_up_await_seconds
+        self.idle_seconds = idle_seconds
+        self.max_pending = max_pending
+        self.supported = True
+        self.changes_sent = 0
+        self.resets = 0
+        self.overflows = 0
+        # Resume token of the shared stream, up to which events have been handed out
+        self.position: Optional[dict] = None
+        self._subscribers: Dict[str, Set[_Subscriber]] = defaultdict(set)
+        self._task: Optional[asyncio.Task] = None
+        self._started: Optional[asyncio.Future] = None
+
+    def _pipeline(self, user_id: Optional[str] = None) -> List[dict]:
+        # The full document is looked up for updates, so they can be matched
+        # on user_id; updates that touch no listing field are dropped on the
+        # server
+        listing_updates = [{f"updateDescription.updatedFields.{field}": {"$exists": True}} for field in self.fields]
+        match = {"$or": [{"operationType": {"$in": ["insert", "replace"]}}, *listing_updates]}
+        if user_id is not None:
+            match["fullDocument.user_id"] = user_id
+        return [
+            {"$match": match},
+            {"$project": {
+                "operationType": 1,
+                "documentKey": 1,
+                "fullDocument.id": 1,
+                "fullDocument.user_id": 1,
+                **{f"fullDocument.{field}": 1 for field in self.fields},
+                **{f"updateDescription.updatedFields.{field}": 1 for field in self.fields},
+            }},
+        ]
+
+    async def _watch(self, pipeline: List[dict], resume_after: Optional[dict], max_await_seconds: float):
+        """Open a stream; returns it with its first event, or None if there is none yet."""
+        stream = self.collection.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=resume_after,
+            max_await_time_ms=int(max_await_seconds * 1000),
+        )
+        try:
+            # The first read runs the aggregate: unsupported servers and
+            # resume tokens that have fallen out of the oplog fail here
+            return stream, await stream.try_next()
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def _run(self) -> None:
+        """The shared stream: hand every event to the owner's open feeds."""
+        try:
+            stream, event = await self._watch(self._pipeline(), None, self.max_await_seconds)
+        except asyncio.CancelledError:
+            self._started.cancel()
+            raise
+        except Exception as e:
+            self._started.set_exception(e)
+            return
+        # Nobody is subscribed yet, so the first event only sets the position
+        self.position = event["_id"] if event else stream.resume_token
+        self._started.set_result(None)
+        try:
+            async with stream:
+                while True:
+                    event = await stream.try_next()
+                    if event is None:
+                        self.position = stream.resume_token
+                        continue
+                    owner = (event.get("fullDocument") or {}).get("user_id")
+                    for subscriber in self._subscribers.get(owner, ()):
+                        subscriber.push(event)
+                    self.position = event["_id"]
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Open feeds end; clients reconnect with their last token and
+            # catch up from there
+            logger.exception("Scan feed change stream failed; closing open feeds")
+        finally:
+            for subscribers in self._subscribers.values():
+                for subscriber in subscribers:
+                    subscriber.close()
+            self._subscribers.clear()
+
+    async def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._started = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._run())
+        await asyncio.shield(self._started)
+
+    def _change(self, event: dict) -> FeedChange:
+        if event["operationType"] == "update":
+            op, scan = "update", dict(event["updateDescription"]["updatedFields"])
+        else:
+            op, scan = "insert" if event["operationType"] == "insert" else "update", dict(event["fullDocument"])
+            if "user_id" not in self.fields:
+                scan.pop("user_id", None)
+        scan["id"] = event["fullDocument"]["id"]
+        return FeedChange(op, scan, encode_token({"cs": event["_id"]}))
+
+    async def changes(self, user_id: str, token: Optional[str] = None) -> AsyncIterator[Optional[FeedChange]]:
+        """Changes after ``token``, forever; yields None when idle for ``idle_seconds``."""
+        resume_after = None
+        reset = False
+        if token is not None:
+            try:
+                resume_after = decode_token(token)["cs"]
+            except (InvalidResumeToken, KeyError):
+                reset = True
+        if self.supported:
+            try:
+                await self._ensure_running()
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                    raise
+                logger.warning("MongoDB does not support change streams (not a replica set); polling for the scan feed")
+                self.supported = False
+        if not self.supported:
+            async for change in self.fallback.changes(user_id, token):
+                yield change
+            return
+
+        # Subscribe before catching up, so nothing falls between the two
+        subscriber = _Subscriber(self.max_pending)
+        self._subscribers[user_id].add(subscriber)
+        position = self.position
+        try:
+            if resume_after is not None:
+                # Catch up on what happened since the token
+                caught_up = None
+                try:
+                    stream, event = await self._watch(
+                        self._pipeline(user_id), resume_after, self.catch_up_await_seconds
+                    )
+                except OperationFailure as e:
+                    logger.info("Scan feed resume token rejected (%s); starting from now", e)
+                    reset = True
+                else:
+                    async with stream:
+                        while event is not None:
+                            self.changes_sent += 1
+                            yield self._change(event)
+                            caught_up = event["_id"]
+                            event = await stream.try_next()
+                    if caught_up is not None:
+                        subscriber.skip_through(caught_up)
+            if resume_after is None or reset:
+                self.resets += reset
+                yield FeedChange("reset" if reset else "ready", None, encode_token({"cs": position}))
+            while not subscriber.closed:
+                if subscriber.overflowed_at is not None:
+                    self.overflows += 1
+                    self.resets += 1
+                    overflowed_at, subscriber.overflowed_at = subscriber.overflowed_at, None
+                    yield FeedChange("reset", None, encode_token({"cs": overflowed_at}))
+                elif subscriber.events:
+                    self.changes_sent += 1
+                    yield self._change(subscriber.events.popleft())
+                else:
+                    await subscriber.wait(self.idle_seconds)
+                    if not subscriber.events and subscriber.overflowed_at is None and not subscriber.closed:
+                        yield None
+        finally:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "change_streams": self.supported,
+            "open_feeds": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "changes_sent": Counter(self.changes_sent + self.fallback.changes_sent),
+            "resets": Counter(self.resets + self.fallback.resets),
+            "overflows": Counter(self.overflows),
+        }
+
+
+def create_scan_feed(collection, mongo_url: str, fields: Sequence[str], poll_interval: float = 2.0):
+    polling = PollingFeed(collection, fields, interval=poll_interval)
+    if is_in_memory(mongo_url):
+        return polling
+    return ChangeStreamFeed(collection, fields, fallback=polling)
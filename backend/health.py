@@ -0,0 +1,65 @@
+"""
+Readiness checks.
+
+ReadinessProbe runs a set of named dependency checks concurrently, each with
+its own timeout, and reports status and latency per dependency. Results are
+cached for a short time and concurrent probes share one in-flight run, so
+load balancers polling every worker at high frequency add almost no load.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+Check = Callable[[], Awaitable[Optional[dict]]]
+
+
+class ReadinessProbe:
+    def __init__(self, checks: Dict[str, Check], cache_seconds: float = 2.0, timeout: float = 2.0):
+        self.checks = checks
+        self.cache_seconds = cache_seconds
+        self.timeout = timeout
+        self._result: Optional[dict] = None
+        self._expires_at = 0.0
+        self._running: Optional[asyncio.Future] = None
+
+    async def _run_check(self, check: Check) -> dict:
+        started = time.perf_counter()
+        try:
+            details = await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            result = {"status": "error", "error": f"timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        else:
+            result = {"status": "ok", **(details or {})}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    async def _run(self) -> dict:
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run_check(self.checks[name]) for name in names))
+        checks = dict(zip(names, results))
+        ready = all(result["status"] == "ok" for result in checks.values())
+        return {
+            "status": "ready" if ready else "not_ready",
+            "checked_at": datetime.utcnow(),
+            "checks": checks,
+        }
+
+    def _finished(self, task: asyncio.Future) -> None:
+        self._running = None
+        if not task.cancelled():
+            self._result = task.result()
+            self._expires_at = time.monotonic() + self.cache_seconds
+
+    async def check(self) -> dict:
+        if self._result is not None and time.monotonic() < self._expires_at:
+            return {**self._result, "cached": True}
+        if self._running is None:
+            self._running = asyncio.ensure_future(self._run())
+            self._running.add_done_callback(self._finished)
+        # Shielded so a probe that disconnects doesn't cancel the run other
+        # probes are waiting on
+        return {**await asyncio.shield(self._running), "cached": False}
@@ -0,0 +1,104 @@
+"""
+Image decoding and derivative generation.
+
+Every upload is decoded exactly once, in the analysis job, into:
+
+- a preview (1024 px on the long edge by default) for detail views,
+- a thumbnail (256 px by default) for listings,
+- the normalized float32 array the analyzers consume.
+
+Derivatives are stored in the blob store next to the original, so the API
+never has to ship full-resolution images unless a client asks for them.
+"""
+
+import io
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+from PIL import Image
+
+PREVIEW_SIZE = 1024
+THUMBNAIL_SIZE = 256
+ANALYZER_INPUT_SIZE = (224, 224)
+ARRAY_CONTENT_TYPE = "application/x-npy"
+
+
+@dataclass
+class Derivative:
+    data: bytes
+    content_type: str
+    width: int
+    height: int
+
+
+@dataclass
+class DecodedImage:
+    width: int
+    height: int
+    derivatives: Dict[str, Derivative]
+    array: np.ndarray
+
+
+def _to_display_mode(image: Image.Image) -> Image.Image:
+    # 16-bit and float scans (common for CT/MRI exports) need windowing to
+    # 8 bits; a plain convert("L") would clip them
+    if image.mode in ("I", "I;16", "I;16B", "I;16L", "F"):
+        pixels = np.asarray(image, dtype=np.float32)
+        low, high = float(pixels.min()), float(pixels.max())
+        scale = 255.0 / (high - low) if high > low else 0.0
+        return Image.fromarray(((pixels - low) * scale).astype(np.uint8), mode="L")
+    if image.mode in ("L", "RGB"):
+        return image.copy()
+    if image.mode in ("LA", "RGBA", "P"):
+        return image.convert("RGBA").convert("RGB")
+    return image.convert("RGB")
+
+
+def _encode(image: Image.Image) -> Derivative:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85, optimize=True)
+    return Derivative(buffer.getvalue(), "image/jpeg", image.width, image.height)
+
+
+def encode_array(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_array(data: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+def derive(image: Image.Image, width: int, height: int, preview_size: int = PREVIEW_SIZE,
+           thumbnail_size: int = THUMBNAIL_SIZE) -> DecodedImage:
+    """Build the derivatives from an image already in display mode (L or RGB)."""
+    preview = image
+    preview.thumbnail((preview_size, preview_size), Image.LANCZOS)
+    thumbnail = preview.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+
+    analyzer_input = preview.convert("L").resize(ANALYZER_INPUT_SIZE, Image.BILINEAR)
+    array = np.asarray(analyzer_input, dtype=np.float32) / 255.0
+
+    return DecodedImage(
+        width=width,
+        height=height,
+        derivatives={
+            "preview": _encode(preview),
+            "thumbnail": _encode(thumbnail),
+            "array": Derivative(encode_array(array), ARRAY_CONTENT_TYPE, *ANALYZER_INPUT_SIZE),
+        },
+        array=array,
+    )
+
+
+def decode(data: bytes, preview_size: int = PREVIEW_SIZE, thumbnail_size: int = THUMBNAIL_SIZE) -> DecodedImage:
+    with Image.open(io.BytesIO(data)) as source:
+        width, height = source.size
+        # For JPEGs this lets the decoder skip straight to a reduced scale
+        # instead of materializing every pixel of a large original
+        source.draft(source.mode, (preview_size, preview_size))
+        image = _to_display_mode(source)
+    return derive(image, width, height, preview_size, thumbnail_size)
@@ -0,0 +1,190 @@
+"""
+MongoDB index declarations for the hot queries in server.py.
+
+The API creates these on startup. To audit a running database:
+
+    python indexes.py check     # report missing indexes and collection scans
+    python indexes.py ensure    # create anything that is missing
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import typer
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from database import create_client
+
+# How long finished analysis jobs are kept; the scan report keeps the outcome.
+# Changing it means dropping finished_ttl so it can be recreated.
+JOB_RETENTION_SECONDS = int(os.environ.get("ANALYSIS_JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # register/login look users up by email
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        # get_current_user runs on every authenticated request
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "scan_reports": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Per-user listing, newest first; id breaks created_at ties for the
+        # keyset cursor
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_created_desc",
+        ),
+        # Reuse of decoded derivatives across identical uploads
+        IndexModel([("image_ref", ASCENDING)], name="image_ref"),
+        # Search filtered by scan type (and date range), newest first
+        IndexModel(
+            [("user_id", ASCENDING), ("scan_type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_type_created_desc",
+        ),
+        # Free-text search; the user_id prefix confines each search to one
+        # user's entries in the index
+        IndexModel([("user_id", ASCENDING), ("ai_report", TEXT)], name="user_report_text"),
+        # Scan feed polling, where change streams are unavailable
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)], name="user_updated"),
+    ],
+    "analysis_results": [
+        IndexModel(
+            [("image_ref", ASCENDING), ("scan_type", ASCENDING), ("model_version", ASCENDING)],
+            unique=True,
+            name="result_key_unique",
+        ),
+    ],
+    "dicom_series": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Frame and volume reads look the series up by its scan
+        IndexModel([("scan_id", ASCENDING), ("user_id", ASCENDING)], name="scan_user"),
+    ],
+    "analysis_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        # Workers claim the oldest available job
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)], name="status_available"),
+        # Only completed and failed jobs have finished_at, so only they expire
+        IndexModel(
+            [("finished_at", ASCENDING)],
+            expireAfterSeconds=JOB_RETENTION_SECONDS,
+            name="finished_ttl",
+        ),
+    ],
+}
+
+# Representative filters for each hot query, used to explain() query plans
+QUERY_SHAPES = [
+    ("users", "login by email", {"email": "probe@example.com"}, None),
+    ("users", "current user by id", {"id": "probe"}, None),
+    ("scan_reports", "scan by id", {"id": "probe", "user_id": "probe"}, None),
+    (
+        "scan_reports",
+        "user scan listing",
+        {"user_id": "probe", "created_at": {"$lt": datetime.utcnow()}},
+        [("created_at", DESCENDING), ("id", DESCENDING)],
+    ),
+    (
+        "scan_reports",
+        "scan search by type",
+        {"user_id": "probe", "scan_type": "probe", "created_at": {"$gte": datetime(2000, 1, 1)}},
+        [("created_at", DESCENDING), ("id", DESCENDING)],
+    ),
+    ("scan_reports", "scan text search", {"user_id": "probe", "$text": {"$search": "probe"}}, None),
+    (
+        "analysis_results",
+        "memoized report",
+        {"image_ref": "probe", "scan_type": "probe", "model_version": "probe"},
+        None,
+    ),
+    ("analysis_jobs", "job status", {"id": "probe"}, None),
+    (
+        "analysis_jobs",
+        "claim next job",
+        {"status": "pending", "available_at": {"$lte": datetime.utcnow()}},
+        [("available_at", ASCENDING)],
+    ),
+]
+
+
+async def ensure_indexes(db) -> None:
+    for collection, models in INDEXES.items():
+        await db[collection].create_indexes(models)
+
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def check_indexes(db) -> List[str]:
+    """Return a list of human-readable problems; empty means all good."""
+    problems = []
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        existing_keys = {tuple(map(tuple, info["key"])) for info in existing.values()}
+        for model in models:
+            spec = model.document
+            if TEXT in spec["key"].values():
+                # The server rewrites text index keys (_fts/_ftsx), so match by name
+                if spec["name"] not in existing:
+                    problems.append(f"{collection}: missing index {spec['name']} {dict(spec['key'])}")
+            elif tuple(spec["key"].items()) not in existing_keys:
+                problems.append(f"{collection}: missing index {spec['name']} {dict(spec['key'])}")
+
+    for collection, label, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        if "COLLSCAN" in stages:
+            problems.append(f"{collection}: '{label}' runs a collection scan ({' -> '.join(stages)})")
+        if sort and "SORT" in stages:
+            problems.append(f"{collection}: '{label}' sorts in memory ({' -> '.join(stages)})")
+    return problems
+
+
+cli = typer.Typer(help="Manage Radiologix MongoDB indexes")
+
+
+async def _with_db(func):
+    load_dotenv(Path(__file__).parent / ".env")
+    client = create_client(os.environ["MONGO_URL"])
+    try:
+        return await func(client[os.environ["DB_NAME"]])
+    finally:
+        client.close()
+
+
+@cli.command()
+def ensure():
+    """Create any missing indexes."""
+    asyncio.run(_with_db(ensure_indexes))
+    typer.echo("Indexes are up to date")
+
+
+@cli.command()
+def check():
+    """Report missing indexes and queries that fall back to collection scans."""
+    problems = asyncio.run(_with_db(check_indexes))
+    for problem in problems:
+        typer.echo(problem)
+    if problems:
+        raise typer.Exit(code=1)
+    typer.echo("All hot queries are served by indexes")
+
+
+if __name__ == "__main__":
+    cli()
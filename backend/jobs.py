@@ -0,0 +1,308 @@
+"""
+MongoDB-backed queue for scan analysis jobs.
+
+Submitting a scan enqueues a job document in ``analysis_jobs`` and returns
+straight away. Worker tasks claim jobs with an atomic find_one_and_update,
+so any number of API processes can share one queue. A claimed job holds a
+lease; if its worker dies the lease expires and another worker picks the
+job up again. Failed attempts are retried with exponential backoff.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL_STATUSES = (COMPLETED, FAILED)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class AnalysisQueue:
+    def __init__(
+        self,
+        db,
+        analyze: Callable[[dict], Awaitable[str]],
+        concurrency: int = 2,
+        max_attempts: int = 3,
+        max_pending: int = 1000,
+        lease_seconds: float = 300,
+        timeout_seconds: float = 120,
+        retry_backoff_seconds: float = 2,
+        poll_interval: float = 1.0,
+    ):
+        self.jobs = db.analysis_jobs
+        self.scans = db.scan_reports
+        self.analyze = analyze
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.timeout_seconds = timeout_seconds
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._workers: List[asyncio.Task] = []
+        self._draining = False
+        self._wakeup = asyncio.Event()
+        self._watchers: Dict[str, List[asyncio.Event]] = {}
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    # Producer side
+
+    async def pending_count(self) -> int:
+        return await self.jobs.count_documents({"status": {"$in": [PENDING, RUNNING]}})
+
+    async def check_capacity(self) -> None:
+        # Backpressure: refuse new work rather than let the backlog grow
+        # without bound
+        if await self.pending_count() >= self.max_pending:
+            raise QueueFull()
+
+    async def remaining_capacity(self) -> int:
+        return max(self.max_pending - await self.pending_count(), 0)
+
+    def _new_job(self, scan: dict, now: datetime) -> dict:
+        return {
+            "id": scan.get("job_id") or str(uuid.uuid4()),
+            "scan_id": scan["id"],
+            "user_id": scan["user_id"],
+            "scan_type": scan["scan_type"],
+            "image_ref": scan["image_ref"],
+            "image_content_type": scan.get("image_content_type"),
+            "status": PENDING,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "available_at": now,
+            "locked_until": None,
+            "worker_id": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    async def enqueue(self, scan: dict) -> dict:
+        job = self._new_job(scan, datetime.utcnow())
+        await self.jobs.insert_one(dict(job))
+        self._wakeup.set()
+        return job
+
+    async def enqueue_many(self, scans: List[dict]) -> List[dict]:
+        if not scans:
+            return []
+        now = datetime.utcnow()
+        jobs = [self._new_job(scan, now) for scan in scans]
+        await self.jobs.insert_many([dict(job) for job in jobs], ordered=False)
+        self._wakeup.set()
+        return jobs
+
+    # Status notifications for long-polling / SSE clients
+
+    def _notify(self, scan_id: str) -> None:
+        for event in self._watchers.pop(scan_id, []):
+            event.set()
+
+    async def wait_for_update(self, scan_id: str, timeout: float) -> None:
+        """
+        Wait until this process finishes a step of the scan's job, or timeout.
+
+        Jobs may be run by another worker process, so callers must re-read the
+        status afterwards rather than trusting the wake-up.
+        """
+        event = asyncio.Event()
+        self._watchers.setdefault(scan_id, []).append(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watchers = self._watchers.get(scan_id)
+            if watchers and event in watchers:
+                watchers.remove(event)
+                if not watchers:
+                    del self._watchers[scan_id]
+
+    # Consumer side
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": PENDING, "available_at": {"$lte": now}},
+                    # Lease expired: the worker that held it is gone
+                    {"status": RUNNING, "locked_until": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "worker_id": self.worker_id,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _claimed(self, job: dict) -> dict:
+        # Matches the job only while it is still held under this claim; once
+        # the lease expired and another worker took it over, attempts moved on
+        return {"id": job["id"], "worker_id": self.worker_id, "attempts": job["attempts"]}
+
+    async def _set_scan_status(self, job: dict, fields: dict) -> None:
+        fields["updated_at"] = datetime.utcnow()
+        await self.scans.update_one({"id": job["scan_id"]}, {"$set": fields})
+        self._notify(job["scan_id"])
+
+    async def _run_job(self, job: dict) -> None:
+        await self._set_scan_status(job, {"analysis_status": RUNNING})
+        try:
+            ai_report = await asyncio.wait_for(self.analyze(job), self.timeout_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._handle_failure(job, e)
+            return
+        now = datetime.utcnow()
+        result = await self.jobs.update_one(
+            self._claimed(job),
+            {"$set": {"status": COMPLETED, "locked_until": None, "error": None, "updated_at": now, "finished_at": now}},
+        )
+        if not result.matched_count:
+            logger.warning("Analysis job %s was taken over by another worker; dropping its result", job["id"])
+            return
+        await self._set_scan_status(job, {"analysis_status": COMPLETED, "ai_report": ai_report})
+        self.completed += 1
+
+    async def _handle_failure(self, job: dict, error: Exception) -> None:
+        now = datetime.utcnow()
+        message = f"{type(error).__name__}: {error}"
+        if job["attempts"] < job["max_attempts"]:
+            delay = self.retry_backoff_seconds * 2 ** (job["attempts"] - 1)
+            logger.warning("Analysis job %s failed (attempt %d), retrying in %.0fs: %s",
+                           job["id"], job["attempts"], delay, message)
+            result = await self.jobs.update_one(
+                self._claimed(job),
+                {"$set": {
+                    "status": PENDING,
+                    "available_at": now + timedelta(seconds=delay),
+                    "locked_until": None,
+                    "error": message,
+                    "updated_at": now,
+                }},
+            )
+            if not result.matched_count:
+                return
+            await self._set_scan_status(job, {"analysis_status": PENDING})
+            self.retried += 1
+        else:
+            logger.error("Analysis job %s failed permanently: %s", job["id"], message)
+            result = await self.jobs.update_one(
+                self._claimed(job),
+                {"$set": {
+                    "status": FAILED, "locked_until": None, "error": message, "updated_at": now, "finished_at": now,
+                }},
+            )
+            if not result.matched_count:
+                return
+            await self._set_scan_status(job, {"analysis_status": FAILED})
+            self.failed += 1
+
+    async def _release(self, job: dict) -> None:
+        # Hand an interrupted job straight back rather than leaving it for
+        # lease expiry; the interrupted attempt doesn't count
+        now = datetime.utcnow()
+        result = await self.jobs.update_one(
+            {**self._claimed(job), "status": RUNNING},
+            {"$set": {"status": PENDING, "available_at": now, "locked_until": None, "updated_at": now},
+             "$inc": {"attempts": -1}},
+        )
+        if result.matched_count:
+            await self._set_scan_status(job, {"analysis_status": PENDING})
+
+    async def _worker(self) -> None:
+        while not self._draining:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to claim analysis job")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.active += 1
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                try:
+                    await self._release(job)
+                except Exception:
+                    logger.exception("Failed to release analysis job %s", job["id"])
+                raise
+            except Exception:
+                logger.exception("Analysis job %s crashed", job["id"])
+            finally:
+                self.active -= 1
+
+    async def start(self) -> None:
+        self._draining = False
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker()))
+        logger.info("Started %d analysis workers (%s)", self.concurrency, self.worker_id)
+
+    async def stop(self, drain_timeout: float = 0) -> None:
+        # Stop claiming, give running jobs up to drain_timeout to finish, then
+        # cancel the rest, which go straight back to the queue
+        self._draining = True
+        self._wakeup.set()
+        if self._workers and drain_timeout > 0:
+            _, running = await asyncio.wait(self._workers, timeout=drain_timeout)
+            if running:
+                logger.warning("Interrupting %d analysis jobs still running after %gs", self.active, drain_timeout)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def check(self) -> dict:
+        """Raise unless workers are running; otherwise report the backlog."""
+        alive = sum(1 for task in self._workers if not task.done())
+        if not alive:
+            raise RuntimeError("No analysis workers are running")
+        pending = await self.pending_count()
+        return {"workers": alive, "pending": pending, "max_pending": self.max_pending}
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "active": self.active,
+            "completed": Counter(self.completed),
+            "failed": Counter(self.failed),
+            "retried": Counter(self.retried),
+        }
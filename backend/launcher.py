@@ -0,0 +1,166 @@
+"""
+Production launcher for the API.
+
+    python launcher.py serve                   # one worker per available core
+    python launcher.py serve --workers 4 --port 8001
+    python launcher.py reload                  # graceful reload (gunicorn)
+    python launcher.py stop                    # graceful shutdown
+
+Each worker process imports server.py itself and completes its startup
+hooks (Mongo ping, indexes, model load, analysis workers) before it accepts
+connections. On SIGTERM a worker stops accepting, lets in-flight requests
+and uploads finish, then drains running analysis jobs for up to
+ANALYSIS_DRAIN_SECONDS; jobs still running after that go back to the
+queue for another worker.
+
+The gunicorn engine (default when gunicorn is installed) runs uvicorn
+workers under a gunicorn master. It supports graceful reload on SIGHUP,
+where new workers start on the current code and old ones drain, and
+recycling workers after --max-requests. The plain uvicorn engine needs no
+extra dependency but cannot reload gracefully: its master exits on SIGHUP,
+so ``reload`` refuses to signal it. Restart it with ``stop`` and ``serve``.
+"""
+
+import importlib.util
+import os
+import signal
+from pathlib import Path
+from typing import Optional, Tuple
+
+import typer
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+DEFAULT_PIDFILE = ROOT_DIR / "radiologix.pid"
+
+cli = typer.Typer(help="Run the Radiologix API in production")
+
+
+def default_workers() -> int:
+    # Respect CPU affinity and container limits where the platform reports them
+    if "WEB_CONCURRENCY" in os.environ:
+        return int(os.environ["WEB_CONCURRENCY"])
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+def default_engine() -> str:
+    return "gunicorn" if importlib.util.find_spec("gunicorn") else "uvicorn"
+
+
+def run_gunicorn(host: str, port: int, workers: int, graceful_timeout: int, max_requests: int, pidfile: Path) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    # Leave room after the request drain for the lifespan shutdown, which
+    # drains analysis jobs, before gunicorn kills the worker
+    drain_seconds = float(os.environ.get("ANALYSIS_DRAIN_SECONDS", 30))
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "chdir": str(ROOT_DIR),
+        "graceful_timeout": graceful_timeout + int(drain_seconds) + 5,
+        "timeout": 120,
+        "keepalive": 5,
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests // 10,
+        "pidfile": str(pidfile),
+        "accesslog": "-",
+        # The master must not import the app: workers import it after
+        # forking, which is what lets a reload pick up new code
+        "preload_app": False,
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return importlib.import_module("server").app
+
+    Application().run()
+
+
+def run_uvicorn(host: str, port: int, workers: int, graceful_timeout: int, pidfile: Path) -> None:
+    import uvicorn
+
+    # The engine goes on a second line; gunicorn's own pidfile has only the PID
+    pidfile.write_text(f"{os.getpid()}\nuvicorn\n")
+    try:
+        uvicorn.run(
+            "server:app",
+            host=host,
+            port=port,
+            workers=workers,
+            app_dir=str(ROOT_DIR),
+            timeout_graceful_shutdown=graceful_timeout,
+            proxy_headers=True,
+        )
+    finally:
+        pidfile.unlink(missing_ok=True)
+
+
+@cli.command()
+def serve(
+    host: str = typer.Option("0.0.0.0"),
+    port: int = typer.Option(8001),
+    workers: Optional[int] = typer.Option(None, min=1, help="Worker processes; defaults to one per available core"),
+    engine: Optional[str] = typer.Option(None, help="gunicorn or uvicorn; defaults to gunicorn when installed"),
+    graceful_timeout: int = typer.Option(30, help="Seconds in-flight requests get to finish on shutdown"),
+    max_requests: int = typer.Option(0, help="Recycle a worker after this many requests (gunicorn only, 0 = never)"),
+    pidfile: Path = typer.Option(DEFAULT_PIDFILE),
+):
+    """Start the API with N workers."""
+    load_dotenv(ROOT_DIR / ".env")
+    workers = workers or default_workers()
+    engine = engine or default_engine()
+    typer.echo(f"Starting {workers} {engine} worker(s) on {host}:{port}")
+    if engine == "gunicorn":
+        run_gunicorn(host, port, workers, graceful_timeout, max_requests, pidfile)
+    elif engine == "uvicorn":
+        run_uvicorn(host, port, workers, graceful_timeout, pidfile)
+    else:
+        raise typer.BadParameter(f"Unknown engine {engine!r}; use gunicorn or uvicorn")
+
+
+def _read_pidfile(pidfile: Path) -> Tuple[int, str]:
+    """The master's PID and engine."""
+    try:
+        lines = pidfile.read_text().split()
+        return int(lines[0]), lines[1] if len(lines) > 1 else "gunicorn"
+    except (OSError, ValueError, IndexError):
+        typer.echo(f"No running launcher found ({pidfile})", err=True)
+        raise typer.Exit(code=1)
+
+
+def _signal_master(pid: int, pidfile: Path, sig: signal.Signals) -> None:
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        typer.echo(f"Process {pid} from {pidfile} is not running", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"Sent {sig.name} to {pid}")
+
+
+@cli.command()
+def reload(pidfile: Path = typer.Option(DEFAULT_PIDFILE)):
+    """Gracefully replace every worker with one running the current code (gunicorn engine)."""
+    pid, engine = _read_pidfile(pidfile)
+    if engine != "gunicorn":
+        # SIGHUP would shut a uvicorn master down rather than reload it
+        typer.echo(f"The {engine} engine cannot reload gracefully; use stop and serve instead", err=True)
+        raise typer.Exit(code=1)
+    _signal_master(pid, pidfile, signal.SIGHUP)
+
+
+@cli.command()
+def stop(pidfile: Path = typer.Option(DEFAULT_PIDFILE)):
+    """Gracefully shut down: drain requests and analysis jobs, then exit."""
+    pid, _ = _read_pidfile(pidfile)
+    _signal_master(pid, pidfile, signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,360 @@
+"""
+Lightweight in-process metrics.
+
+Histogram backs the latency and size statistics reported by the other
+modules. RequestMetrics, MongoCommandTimer and EventLoopLagMonitor collect
+request-level data, and render_prometheus() turns all of it, plus any
+component ``stats()`` dicts, into the Prometheus text format served on
+/metrics.
+
+Keys of a stats() dict become part of metric names, so they must be fixed.
+Where the keys are data (scan types, servers, routes), the component wraps
+that level in Labelled and its keys are exported as a label instead.
+Numbers are exported as gauges unless the component wraps them in Counter,
+which exports them as counters with the conventional ``_total`` suffix.
+"""
+
+import asyncio
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Seconds; tuned for work in the 1 ms - 10 s range
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes; 100 B to 100 MB
+SIZE_BUCKETS = tuple(10 ** exponent for exponent in range(2, 9))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Labelled(dict):
+    """A stats() level keyed by label values rather than metric names."""
+
+    def __init__(self, label: str, values=()):
+        super().__init__(values)
+        self.label = label
+
+
+class Counter(int):
+    """A stats() value that only ever increases, exported as a counter."""
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One slot per bucket plus the +Inf overflow bucket
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # Each step is atomic under the GIL; a concurrent snapshot may see
+        # count and sum one observation apart, which is fine for monitoring
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(list(self.buckets) + [float("inf")], self.counts):
+            cumulative += bucket_count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class RequestMetrics:
+    """Per-route request latency and body sizes, plus in-flight requests."""
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str, str], Histogram] = defaultdict(Histogram)
+        self.request_bytes: Dict[Tuple[str, str], Histogram] = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.response_bytes: Dict[Tuple[str, str], Histogram] = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float, received: int, sent: int) -> None:
+        self.latency[(method, route, str(status))].observe(seconds)
+        self.request_bytes[(method, route)].observe(received)
+        self.response_bytes[(method, route)].observe(sent)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware feeding RequestMetrics.
+
+    Routes are labelled with their path template (``/api/scans/{scan_id}``)
+    so label cardinality stays bounded; unmatched paths share one label.
+    Byte counts are taken from the ASGI messages themselves, so streamed
+    bodies are measured too.
+    """
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        received = sent = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            self.metrics.in_flight -= 1
+            route = scope.get("route")
+            self.metrics.observe(
+                scope["method"], getattr(route, "path", "unmatched"), status,
+                time.perf_counter() - started, received, sent,
+            )
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    pymongo command listener timing every command by name.
+
+    Callbacks run on motor's worker threads, hence the lock.
+    """
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], Histogram] = defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def _observe(self, event, outcome: str) -> None:
+        with self._lock:
+            self.latency[(event.command_name, outcome)].observe(event.duration_micros / 1e6)
+
+    def snapshot(self) -> List[Tuple[Tuple[str, str], Histogram]]:
+        with self._lock:
+            return sorted(self.latency.items())
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self._observe(event, "success")
+
+    def failed(self, event) -> None:
+        self._observe(event, "failure")
+
+
+class EventLoopLagMonitor:
+    """Measure how late the event loop wakes a task that sleeps for a fixed interval."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lag = Histogram()
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - expected)
+            self.lag.observe(self.last)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusWriter:
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.lines: List[str] = []
+        self._declared = set()
+
+    def _declare(self, name: str, kind: str, help_text: str) -> None:
+        if name not in self._declared:
+            self._declared.add(name)
+            self.lines.append(f"# HELP {name} {help_text}")
+            self.lines.append(f"# TYPE {name} {kind}")
+
+    def gauge(self, name: str, value: float, help_text: str, labels: Optional[Dict[str, str]] = None) -> None:
+        name = f"{self.prefix}_{name}"
+        self._declare(name, "gauge", help_text)
+        self.lines.append(f"{name}{_format_labels(labels or {})} {_format_value(value)}")
+
+    def counter(self, name: str, value: int, help_text: str, labels: Optional[Dict[str, str]] = None) -> None:
+        name = f"{self.prefix}_{name}_total"
+        self._declare(name, "counter", help_text)
+        self.lines.append(f"{name}{_format_labels(labels or {})} {_format_value(value)}")
+
+    def histogram(self, name: str, histogram: Histogram, help_text: str, labels: Optional[Dict[str, str]] = None) -> None:
+        name = f"{self.prefix}_{name}"
+        labels = labels or {}
+        self._declare(name, "histogram", help_text)
+        cumulative = 0
+        for bound, bucket_count in zip(list(histogram.buckets) + [math.inf], list(histogram.counts)):
+            cumulative += bucket_count
+            bucket_labels = {**labels, "le": _format_value(float(bound))}
+            self.lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+        self.lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(histogram.sum))}")
+        self.lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    def snapshot(self, name: str, snapshot: Dict[str, Any], help_text: str,
+                 labels: Optional[Dict[str, str]] = None) -> None:
+        """Export a Histogram.snapshot() taken elsewhere as a histogram."""
+        name = f"{self.prefix}_{name}"
+        labels = labels or {}
+        self._declare(name, "histogram", help_text)
+        for bound, cumulative in snapshot["buckets"].items():
+            self.lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+        self.lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(snapshot['sum']))}")
+        self.lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+
+    def stats(self, component: str, stats: Dict[str, Any]) -> None:
+        """
+        Export a component's stats() dict: numeric leaves as gauges or
+        counters, histogram snapshots as histograms.
+
+        Raises ValueError when two keys flatten to the same metric, since
+        Prometheus rejects a series exposed twice.
+        """
+        # Samples of one metric must be contiguous, but a Labelled level
+        # yields them interleaved with its siblings
+        series: Dict[str, List[Tuple[Dict[str, str], Any]]] = defaultdict(list)
+        paths: Dict[str, Tuple[str, ...]] = {}
+        for path, labels, value in _flatten_value((component,), stats, {}):
+            name = "_".join(_METRIC_NAME_UNSAFE.sub("_", str(key)) for key in path)
+            if paths.setdefault(name, path) != path:
+                raise ValueError(f"{'.'.join(path)} and {'.'.join(paths[name])} both export as {self.prefix}_{name}")
+            series[name].append((labels, value))
+        for name, samples in series.items():
+            help_text = f"{component} stats: {'.'.join(paths[name][1:])}"
+            for labels, value in samples:
+                if isinstance(value, dict):
+                    self.snapshot(name, value, help_text, labels)
+                elif isinstance(value, Counter):
+                    self.counter(name, value, help_text, labels)
+                else:
+                    self.gauge(name, value, help_text, labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+_METRIC_NAME_UNSAFE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _flatten_value(
+    path: Tuple[str, ...], value: Any, labels: Dict[str, str],
+) -> Iterable[Tuple[Tuple[str, ...], Dict[str, str], Any]]:
+    """(key path, labels, number or histogram snapshot) for every exportable leaf of ``value``."""
+    if isinstance(value, bool):
+        yield path, labels, int(value)
+    elif isinstance(value, (int, float)):
+        yield path, labels, value
+    elif isinstance(value, Labelled):
+        for key, item in value.items():
+            yield from _flatten_value(path, item, {**labels, value.label: str(key)})
+    elif isinstance(value, dict) and "buckets" in value:
+        yield path, labels, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten_value((*path, str(key)), item, labels)
+
+
+def render_prometheus(
+    requests: RequestMetrics,
+    mongo: MongoCommandTimer,
+    loop_lag: EventLoopLagMonitor,
+    components: Dict[str, Dict[str, Any]],
+    prefix: str = "radiologix",
+) -> str:
+    writer = PrometheusWriter(prefix)
+    writer.gauge("http_requests_in_flight", requests.in_flight, "HTTP requests currently being served")
+    for (method, route, status), histogram in sorted(requests.latency.items()):
+        writer.histogram(
+            "http_request_duration_seconds", histogram, "HTTP request latency by route",
+            {"method": method, "route": route, "status": status},
+        )
+    for (method, route), histogram in sorted(requests.request_bytes.items()):
+        writer.histogram(
+            "http_request_size_bytes", histogram, "HTTP request body size by route",
+            {"method": method, "route": route},
+        )
+    for (method, route), histogram in sorted(requests.response_bytes.items()):
+        writer.histogram(
+            "http_response_size_bytes", histogram, "HTTP response body size by route",
+            {"method": method, "route": route},
+        )
+    for (command, outcome), histogram in mongo.snapshot():
+        writer.histogram(
+            "mongo_command_duration_seconds", histogram, "MongoDB command latency",
+            {"command": command, "outcome": outcome},
+        )
+    writer.histogram("event_loop_lag_seconds", loop_lag.lag, "Event loop scheduling delay")
+    writer.gauge("event_loop_lag_last_seconds", loop_lag.last, "Most recent event loop scheduling delay")
+    for component, stats in components.items():
+        writer.stats(component, stats)
+    return writer.render()
@@ -0,0 +1,99 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (100-300 ms per call at the default cost), so
+hashing and verification run in a small dedicated thread pool. The bcrypt C
+extension releases the GIL, so the threads genuinely run in parallel while
+the event loop keeps serving other requests.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from metrics import Counter
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_pending: int = 100):
+        # Pinning min and max to the configured cost makes verify_and_update
+        # flag every hash made with a different cost for rehashing
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(max_workers)
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.max_queued_seen = 0
+
+    async def _run(self, func, *args):
+        # Shed load instead of letting a login storm build an unbounded queue
+        if self.queued >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self.queued += 1
+        self.max_queued_seen = max(self.max_queued_seen, self.queued)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Return (valid, new_hash); new_hash is set when the stored cost is stale."""
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed)
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "queued": self.queued,
+            "active": self.active,
+            "completed": Counter(self.completed),
+            "rejected": Counter(self.rejected),
+            "rehashed": Counter(self.rehashed),
+            "max_queued_seen": self.max_queued_seen,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def create_password_hasher() -> PasswordHasher:
+    return PasswordHasher(
+        rounds=int(os.environ.get("BCRYPT_ROUNDS", 12)),
+        max_workers=int(os.environ.get("BCRYPT_WORKERS", min(4, os.cpu_count() or 1))),
+        max_pending=int(os.environ.get("BCRYPT_MAX_PENDING", 100)),
+    )
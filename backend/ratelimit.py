@@ -0,0 +1,233 @@
+"""
+Rate limiting and admission control.
+
+RateLimiter applies token buckets per client IP and per user to named
+routes. Buckets live in process memory by default; with a Redis URL they
+are shared by every worker, so limits hold however many processes serve
+the API.
+
+Limits are written as ``<count>/<period>`` (``second``, ``minute``,
+``hour``), which allows bursts of up to ``count`` requests refilled evenly
+over the period. RATE_LIMITS overrides the defaults with a comma-separated
+list of ``<route>.<scope>=<limit>`` entries, e.g.
+
+    RATE_LIMITS="scans.user=30/minute,login.ip=50/minute,register.ip=off"
+
+ConcurrencyLimit caps how many requests of one kind a process serves at
+once, rejecting the excess instead of queueing it.
+"""
+
+import ipaddress
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from metrics import Counter, Labelled
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+@dataclass(frozen=True)
+class Rate:
+    count: float
+    period: float
+
+    @property
+    def per_second(self) -> float:
+        return self.count / self.period
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["Rate"]:
+        """Parse ``10/minute``; ``off`` disables the limit."""
+        spec = spec.strip()
+        if spec.lower() in ("off", "none", "0"):
+            return None
+        count, _, period = spec.partition("/")
+        try:
+            rate = cls(float(count), PERIODS[period.strip().lower()])
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid rate limit {spec!r}; expected <count>/<second|minute|hour>")
+        if rate.count <= 0:
+            raise ValueError(f"Invalid rate limit {spec!r}; count must be positive")
+        return rate
+
+
+@dataclass
+class RateLimitRule:
+    """Limits for one route, by scope (``ip``, ``user``, or any other identity)."""
+
+    name: str
+    limits: Dict[str, Optional[Rate]] = field(default_factory=dict)
+
+
+class MemoryBucketStore:
+    """Token buckets in a bounded LRU map, for a single process."""
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, rate: Rate, cost: float = 1) -> float:
+        """
+        Take ``cost`` tokens; return 0 if allowed, else seconds until it would
+        be. A negative cost gives tokens back, up to the bucket size.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (rate.count, now))
+        tokens = min(rate.count, tokens + (now - updated) * rate.per_second)
+        if tokens >= cost:
+            tokens = min(rate.count, tokens - cost)
+            wait = 0.0
+        else:
+            wait = (cost - tokens) / rate.per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # Dropping the least recently used bucket only ever makes a client
+        # look fresher, never throttles anyone wrongly
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def close(self) -> None:
+        pass
+
+
+# Refill and take atomically on the server, using the server clock so
+# workers on different hosts agree
+_TOKEN_BUCKET_SCRIPT = """
+local count = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or count
+local updated = tonumber(state[2]) or now
+tokens = math.min(count, tokens + (now - updated) * per_second)
+local wait = 0
+if tokens >= cost then
+    tokens = math.min(count, tokens - cost)
+else
+    wait = (cost - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(count / per_second) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through Redis."""
+
+    def __init__(self, redis_url: str, prefix: str = "radiologix:ratelimit:"):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.from_url(redis_url)
+        self._script = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, rate: Rate, cost: float = 1) -> float:
+        wait = await self._script(keys=[self.prefix + key], args=[rate.count, rate.per_second, cost])
+        return float(wait)
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+class RateLimiter:
+    def __init__(self, rules: Dict[str, RateLimitRule], store=None, enabled: bool = True):
+        self.rules = rules
+        self.store = store or MemoryBucketStore()
+        self.enabled = enabled
+        self.limited: Dict[str, int] = {}
+
+    async def check(self, route: str, **identities: Optional[str]) -> float:
+        """
+        Take one token from every bucket that applies; return 0 if the request
+        may proceed, else how many seconds the client should wait.
+        """
+        wait = await self._take(route, 1, identities)
+        if wait:
+            self.limited[route] = self.limited.get(route, 0) + 1
+        return wait
+
+    async def refund(self, route: str, **identities: Optional[str]) -> None:
+        """Give back the token ``check`` took, e.g. to charge only failed attempts."""
+        await self._take(route, -1, identities)
+
+    async def _take(self, route: str, cost: float, identities: Dict[str, Optional[str]]) -> float:
+        rule = self.rules.get(route)
+        if not self.enabled or rule is None:
+            return 0.0
+        wait = 0.0
+        for scope, identity in identities.items():
+            rate = rule.limits.get(scope)
+            if rate is None or not identity:
+                continue
+            try:
+                wait = max(wait, await self.store.take(f"{route}:{scope}:{identity}", rate, cost))
+            except Exception:
+                # An unreachable shared store must not take the API down
+                logger.exception("Rate limit store unavailable; allowing request")
+        return wait
+
+    async def close(self) -> None:
+        await self.store.close()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "limited": Labelled("route", {route: Counter(count) for route, count in self.limited.items()})}
+
+
+def parse_overrides(rules: Dict[str, RateLimitRule], spec: str) -> Dict[str, RateLimitRule]:
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        target, _, limit = entry.partition("=")
+        route, _, scope = target.strip().partition(".")
+        if route not in rules or not scope or not limit:
+            raise ValueError(f"Invalid RATE_LIMITS entry: {entry}")
+        rules[route].limits[scope] = Rate.parse(limit)
+    return rules
+
+
+def client_network(host: Optional[str]) -> Optional[str]:
+    """
+    The /24 (IPv4) or /64 (IPv6) network of a client address, so a limit
+    keyed on it covers what one client can easily hop between.
+    """
+    if not host:
+        return None
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+class ConcurrencyLimit:
+    """Non-blocking cap on concurrent requests of one kind within a process."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+
+    @property
+    def full(self) -> bool:
+        return self.active >= self.limit
+
+    def try_acquire(self) -> bool:
+        if self.active >= self.limit:
+            self.rejected += 1
+            return False
+        self.active += 1
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "active": self.active, "rejected": Counter(self.rejected)}
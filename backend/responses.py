@@ -0,0 +1,54 @@
+"""
+Fast response rendering.
+
+FastJSONResponse renders with orjson when it is installed (falling back to
+the standard library), and NDJSONResponse streams one JSON document per line
+from an async iterator so large listings never have to be materialized.
+Handlers that return these directly also skip FastAPI's response_model
+re-validation, which is only safe for data already shaped by a trusted
+projection.
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any, AsyncIterable, Optional
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import Request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class NDJSONResponse(StreamingResponse):
+    def __init__(self, documents: AsyncIterable[Any], status_code: int = 200, headers: Optional[dict] = None):
+        async def lines():
+            async for document in documents:
+                yield dumps(document) + b"\n"
+
+        super().__init__(lines(), status_code=status_code, headers=headers, media_type=NDJSON_MEDIA_TYPE)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
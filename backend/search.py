@@ -0,0 +1,182 @@
+"""
+Search over scan reports.
+
+Searches are always scoped to one user and may filter on scan type and a
+creation date range. Free text matches words in ``ai_report``; hits are
+ranked by relevance, then newest first. Without text they are simply
+newest first.
+
+MongoScanSearch relies on the compound text index on (user_id, ai_report)
+and on (user_id, scan_type, created_at) for the filters (see indexes.py),
+and ranks by Mongo's textScore. Mongo stems English words and supports
+"quoted phrases" and -negation.
+
+The in-memory Mongo stand-in has no $text, so LocalScanSearch keeps an
+inverted index in process memory instead, ranked with BM25. Before each
+search it catches up on reports whose updated_at moved since the last one,
+so it also sees reports written by other workers. It matches whole words
+only: no stemming, phrases or negation.
+"""
+
+import asyncio
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from database import is_in_memory
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it no not of on or that the there this to was were with".split()
+)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return [word for word in _WORD.findall((text or "").lower()) if word not in STOP_WORDS]
+
+
+def search_filter(user_id: str, scan_type: Optional[str] = None,
+                  created_from: Optional[datetime] = None, created_to: Optional[datetime] = None) -> dict:
+    query = {"user_id": user_id}
+    if scan_type:
+        query["scan_type"] = scan_type
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = created_from
+        if created_to:
+            query["created_at"]["$lt"] = created_to
+    return query
+
+
+NEWEST_FIRST = [("created_at", -1), ("id", -1)]
+
+
+class MongoScanSearch:
+    def __init__(self, collection):
+        self.collection = collection
+        self.searches = 0
+
+    async def search(self, query: dict, text: Optional[str], projection: dict, offset: int, limit: int) -> List[dict]:
+        """Hits for ``query`` (see search_filter), with a ``score`` when searching text."""
+        self.searches += 1
+        if not text:
+            cursor = self.collection.find(query, projection).sort(NEWEST_FIRST)
+        else:
+            score = {"$meta": "textScore"}
+            cursor = (
+                self.collection.find({**query, "$text": {"$search": text}}, {**projection, "score": score})
+                .sort([("score", score), *NEWEST_FIRST])
+            )
+        return await cursor.skip(offset).limit(limit).to_list(limit)
+
+    def stats(self) -> dict:
+        return {"searches": self.searches}
+
+
+class InvertedIndex:
+    """Word -> {scan id: term frequency}, plus what the filters need per scan."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.docs: Dict[str, Tuple[str, str, datetime, int, Tuple[str, ...]]] = {}
+        self._total_length = 0
+
+    def add(self, scan: dict) -> None:
+        self.remove(scan["id"])
+        counts = Counter(tokenize(scan.get("ai_report")))
+        if not counts:
+            return
+        for word, count in counts.items():
+            self.postings[word][scan["id"]] = count
+        length = sum(counts.values())
+        self.docs[scan["id"]] = (scan["user_id"], scan.get("scan_type"), scan["created_at"], length, tuple(counts))
+        self._total_length += length
+
+    def remove(self, scan_id: str) -> None:
+        doc = self.docs.pop(scan_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc[3]
+        for word in doc[4]:
+            postings = self.postings[word]
+            postings.pop(scan_id, None)
+            if not postings:
+                del self.postings[word]
+
+    def search(self, query: dict, text: str) -> List[Tuple[float, str]]:
+        """(score, scan id) for every scan matching any word and the filters, best first."""
+        words = set(tokenize(text))
+        if not words or not self.docs:
+            return []
+        average_length = self._total_length / len(self.docs)
+        created_at = query.get("created_at", {})
+        scores: Dict[str, float] = defaultdict(float)
+        for word in words:
+            postings = self.postings.get(word)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for scan_id, count in postings.items():
+                user_id, scan_type, created, length, _ = self.docs[scan_id]
+                if user_id != query["user_id"] or query.get("scan_type", scan_type) != scan_type:
+                    continue
+                if created < created_at.get("$gte", created) or created >= created_at.get("$lt", datetime.max):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[scan_id] += idf * count * (self.k1 + 1) / (count + norm)
+        # Ties: newest first, as Mongo does
+        return sorted(
+            ((score, scan_id) for scan_id, score in scores.items()),
+            key=lambda hit: (hit[0], self.docs[hit[1]][2], hit[1]),
+            reverse=True,
+        )
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+
+class LocalScanSearch(MongoScanSearch):
+    def __init__(self, collection):
+        super().__init__(collection)
+        self.index = InvertedIndex()
+        self._synced_to = datetime.min
+        self._lock = asyncio.Lock()
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            # >= rather than >: writes sharing the watermark's timestamp may
+            # not have been visible last time; re-adding a scan is harmless
+            cursor = self.collection.find(
+                {"updated_at": {"$gte": self._synced_to}},
+                {"_id": 0, "id": 1, "user_id": 1, "scan_type": 1, "ai_report": 1, "created_at": 1, "updated_at": 1},
+            )
+            async for scan in cursor:
+                self.index.add(scan)
+                self._synced_to = max(self._synced_to, scan["updated_at"])
+
+    async def search(self, query: dict, text: Optional[str], projection: dict, offset: int, limit: int) -> List[dict]:
+        if not text:
+            return await super().search(query, text, projection, offset, limit)
+        self.searches += 1
+        await self.refresh()
+        hits = self.index.search(query, text)[offset:offset + limit]
+        rank = {scan_id: (position, score) for position, (score, scan_id) in enumerate(hits)}
+        scans = await self.collection.find({"id": {"$in": list(rank)}}, projection).to_list(None)
+        for scan in scans:
+            scan["score"] = rank[scan["id"]][1]
+        return sorted(scans, key=lambda scan: rank[scan["id"]][0])
+
+    def stats(self) -> dict:
+        return {**super().stats(), "indexed_reports": len(self.index), "indexed_words": len(self.index.postings)}
+
+
+def create_scan_search(collection, mongo_url: str) -> MongoScanSearch:
+    if is_in_memory(mongo_url):
+        return LocalScanSearch(collection)
+    return MongoScanSearch(collection)
@@ -1,32 +1,82 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Request, Response, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
+from starlette.datastructures import Headers
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uuid
+import hashlib
+import math
+import tempfile
+import zipfile
+import zlib
 from datetime import datetime, timedelta
 import jwt
-from passlib.context import CryptContext
 import base64
-from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import json
+from analysis import create_inference_engine
+from cache import AnalysisResultCache, SharedInvalidation, TTLCache
+from compression import CompressionMiddleware, parse_encodings, parse_levels
+import dicom
+from export import EXPORT_FORMATS, ExportUnavailable, export_chunks, export_filter
+from feed import create_scan_feed
+from database import PoolMonitor, create_client, listing_read_preference
+from health import ReadinessProbe
+import imaging
+from indexes import ensure_indexes
+from jobs import AnalysisQueue, QueueFull, TERMINAL_STATUSES
+from metrics import (
+    PROMETHEUS_CONTENT_TYPE, EventLoopLagMonitor, MetricsMiddleware, MongoCommandTimer, RequestMetrics,
+    render_prometheus,
+)
+from passwords import PasswordHasherBusy, create_password_hasher
+from ratelimit import ConcurrencyLimit, Rate, RateLimiter, RateLimitRule, RedisBucketStore, client_network, parse_overrides
+from responses import FastJSONResponse, NDJSONResponse, dumps, wants_ndjson
+from search import create_scan_search, search_filter
+from storage import (
+    DEFAULT_CONTENT_TYPE, BlobNotFound, BlobTooLarge, create_blob_store, parse_data_url, sniff_content_type,
+    to_data_url,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Request, MongoDB and event loop instrumentation, served on /metrics
+request_metrics = RequestMetrics()
+mongo_command_timer = MongoCommandTimer()
+mongo_pool_monitor = PoolMonitor()
+event_loop_lag = EventLoopLagMonitor(interval=float(os.environ.get('EVENT_LOOP_LAG_INTERVAL', 0.5)))
+
+# MongoDB connection (pool size, compression and read routing are
+# configured through MONGO_* variables, see database.py)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = create_client(mongo_url, event_listeners=[mongo_command_timer, mongo_pool_monitor])
 db = client[os.environ['DB_NAME']]
 
+# Listings tolerate slightly stale data, so they may be served by
+# secondaries (MONGO_LISTING_READ_PREFERENCE)
+listing_preference = listing_read_preference(mongo_url)
+scan_listing = db.scan_reports.with_options(read_preference=listing_preference) if listing_preference else db.scan_reports
+
+# Report search: Mongo text index, or an in-process index on the stand-in
+scan_search = create_scan_search(scan_listing, mongo_url)
+
+# Scan image storage (content-addressed, see storage.py)
+blob_store = create_blob_store(db)
+
+# Opt-in: render JSON with orjson and skip response re-validation where the
+# data comes straight from a trusted projection
+FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', '').lower() in ('1', 'true', 'yes')
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse if FAST_JSON_RESPONSES else JSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -36,12 +86,88 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-produc
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Upload limits
+SCAN_UPLOAD_MAX_BYTES = int(os.environ.get('SCAN_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+BATCH_UPLOAD_MAX_BYTES = int(os.environ.get('BATCH_UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+DICOM_MAX_FILES = int(os.environ.get('DICOM_MAX_FILES', 5000))
+# Uncompressed size of one DICOM file; the whole upload, archive members
+# included, is held to BATCH_UPLOAD_MAX_BYTES
+DICOM_FILE_MAX_BYTES = int(os.environ.get('DICOM_FILE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Scan analysis models, batched per scan type (see analysis.py)
+inference_engine = create_inference_engine()
+
+# Reports memoized per (image hash, scan type, model version), so second
+# reads and resubmissions of a study skip inference
+analysis_results = AnalysisResultCache(
+    db.analysis_results,
+    maxsize=int(os.environ.get('ANALYSIS_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('ANALYSIS_CACHE_TTL', 24 * 3600)),
+)
+
+# Status stream re-checks the database at least this often, since the job
+# may be running in another worker process
+SSE_POLL_SECONDS = float(os.environ.get('SSE_POLL_SECONDS', 2))
+
+# Scan change feeds share one change stream per process (see feed.py), so an
+# open feed costs a socket and a buffer rather than a Mongo connection; the
+# cap bounds that per process
+FEED_MAX_CONNECTIONS = int(os.environ.get('FEED_MAX_CONNECTIONS', 500))
+FEED_KEEPALIVE_SECONDS = float(os.environ.get('FEED_KEEPALIVE_SECONDS', 15))
+feed_slots = ConcurrencyLimit(FEED_MAX_CONNECTIONS)
+
+# Derivative sizes (long edge, px) generated for every upload
+PREVIEW_SIZE = int(os.environ.get('PREVIEW_SIZE', imaging.PREVIEW_SIZE))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', imaging.THUMBNAIL_SIZE))
+
+# Password hashing (bcrypt runs in a bounded thread pool, see passwords.py)
+password_hasher = create_password_hasher()
 
 # Security scheme
 security = HTTPBearer()
 
+# Authenticated users, so get_current_user can skip Mongo on most requests.
+# Set USER_CACHE_REDIS_URL to keep the caches of several workers coherent.
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60)),
+)
+user_cache_invalidation = SharedInvalidation(
+    user_cache, os.environ.get('USER_CACHE_REDIS_URL'), channel="radiologix:user-cache"
+)
+
+# Token-bucket rate limits per client IP, per user and, for login, per
+# account and client network (see ratelimit.py). Set RATE_LIMIT_REDIS_URL to share the buckets
+# between workers; RATE_LIMITS overrides individual limits.
+RATE_LIMIT_RULES = {
+    "login": RateLimitRule("login", {"ip": Rate.parse("20/minute"), "account": Rate.parse("10/minute")}),
+    "register": RateLimitRule("register", {"ip": Rate.parse("10/minute")}),
+    "scans": RateLimitRule("scans", {"user": Rate.parse("60/minute"), "ip": Rate.parse("120/minute")}),
+    "scans_batch": RateLimitRule("scans_batch", {"user": Rate.parse("10/minute"), "ip": Rate.parse("20/minute")}),
+    "export": RateLimitRule("export", {"user": Rate.parse("6/minute")}),
+}
+RATE_LIMITED_ROUTES = {
+    ("POST", "/api/auth/login"): "login",
+    ("POST", "/api/auth/register"): "register",
+    ("POST", "/api/scans"): "scans",
+    ("POST", "/api/scans/batch"): "scans_batch",
+    ("POST", "/api/scans/dicom"): "scans_batch",
+    ("GET", "/api/scans/export"): "export",
+}
+rate_limit_redis_url = os.environ.get('RATE_LIMIT_REDIS_URL')
+rate_limiter = RateLimiter(
+    parse_overrides(RATE_LIMIT_RULES, os.environ.get('RATE_LIMITS', '')),
+    store=RedisBucketStore(rate_limit_redis_url) if rate_limit_redis_url else None,
+    enabled=os.environ.get('RATE_LIMITS_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+)
+
+# Uploads spool to disk and hash as they arrive; past this many at once per
+# process, new ones are turned away rather than slowing everyone down
+UPLOAD_ROUTES = ("scans", "scans_batch")
+upload_slots = ConcurrencyLimit(int(os.environ.get('MAX_CONCURRENT_UPLOADS', 32)))
+
 # Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -69,9 +195,21 @@ class ScanReport(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     scan_type: str
-    image_data: str  # Base64 encoded image
-    ai_report: str
+    image_ref: str  # SHA-256 key of the image in the blob store
+    image_size: int
+    image_content_type: str
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    # preview/thumbnail/array blob refs, filled in by the analysis job
+    derivatives: Optional[dict] = None
+    # DICOM series: image_ref is the (frames, rows, columns) .npy volume
+    series_id: Optional[str] = None
+    frame_count: Optional[int] = None
+    analysis_status: str = "pending"
+    job_id: Optional[str] = None
+    ai_report: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ScanReportCreate(BaseModel):
     scan_type: str
@@ -82,20 +220,117 @@ class ScanReportResponse(BaseModel):
     id: str
     user_id: str
     scan_type: str
-    image_data: str
-    ai_report: str
+    image_data: Optional[str] = None
+    image_content_type: Optional[str] = None
+    image_size: Optional[int] = None
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    series_id: Optional[str] = None
+    frame_count: Optional[int] = None
+    # Reports created before the analysis queue were analyzed inline
+    analysis_status: str = "completed"
+    job_id: Optional[str] = None
+    ai_report: Optional[str] = None
     created_at: datetime
 
+class ScanReportSummary(BaseModel):
+    # Listing shape: everything but the image, every field optional so
+    # clients can trim it further with ?fields=
+    id: str
+    user_id: Optional[str] = None
+    scan_type: Optional[str] = None
+    image_content_type: Optional[str] = None
+    image_size: Optional[int] = None
+    analysis_status: Optional[str] = None
+    ai_report: Optional[str] = None
+    created_at: Optional[datetime] = None
+    thumbnail_data: Optional[str] = None  # opt-in via ?fields=
+
+SCAN_SUMMARY_FIELDS = list(ScanReportSummary.model_fields)
+DEFAULT_SUMMARY_FIELDS = [f for f in SCAN_SUMMARY_FIELDS if f != "thumbnail_data"]
+SCANS_PAGE_DEFAULT = 50
+SCANS_PAGE_MAX = 200
+SCANS_STREAM_MAX = 10000
+# Search pages by offset, so it stops after this many hits; narrow the
+# query, or use /scans or an export, to go further
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 1000))
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+class ScanSearchHit(ScanReportSummary):
+    score: Optional[float] = None  # relevance, only when searching text
+
+class ScanStatusResponse(BaseModel):
+    id: str
+    job_id: Optional[str] = None
+    analysis_status: str
+    attempts: Optional[int] = None
+    error: Optional[str] = None
+    ai_report: Optional[str] = None
+    updated_at: Optional[datetime] = None
+
+class BatchItemResult(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    status: Literal["queued", "completed", "error"]
+    scan_id: Optional[str] = None
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchSubmitResponse(BaseModel):
+    submitted: int
+    failed: int
+    items: List[BatchItemResult]
+
+class DicomSeriesResult(BaseModel):
+    series_instance_uid: str
+    study_instance_uid: Optional[str] = None
+    status: Literal["queued", "completed", "error"]
+    series_id: Optional[str] = None
+    scan_id: Optional[str] = None
+    job_id: Optional[str] = None
+    modality: Optional[str] = None
+    series_description: Optional[str] = None
+    frames: Optional[int] = None
+    rows: Optional[int] = None
+    columns: Optional[int] = None
+    error: Optional[str] = None
+
+class DicomIngestResponse(BaseModel):
+    series: List[DicomSeriesResult]
+    # Files that are not DICOM images, or could not be read
+    skipped: List[str]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
 # Utility functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def hasher_busy_exception():
+    return HTTPException(
+        status_code=503,
+        detail="Authentication service is busy, please retry",
+        headers={"Retry-After": "1"},
+    )
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise hasher_busy_exception()
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise hasher_busy_exception()
+
+def rate_limited_exception(retry_after: float):
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests, please retry later",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -107,6 +342,146 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def encode_scan_cursor(scan: dict) -> str:
+    raw = json.dumps([scan["created_at"].isoformat(), scan["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_scan_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, scan_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(scan_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_search_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        offset = int(json.loads(raw)["offset"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not 0 <= offset < SEARCH_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+def scan_projection(fields: Optional[str]) -> dict:
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(requested) - set(SCAN_SUMMARY_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    else:
+        requested = DEFAULT_SUMMARY_FIELDS
+    # id and created_at are always needed to build the next cursor
+    projection = {"_id": 0, "id": 1, "created_at": 1}
+    projection.update({f: 1 for f in requested if f != "thumbnail_data"})
+    if "thumbnail_data" in requested:
+        projection["derivatives.thumbnail"] = 1
+    return projection
+
+async def existing_image_info(image_ref: str) -> Optional[dict]:
+    # Identical images (same content hash) share their derivatives
+    return await db.scan_reports.find_one(
+        {"image_ref": image_ref, "derivatives.array": {"$exists": True}},
+        {"_id": 0, "derivatives": 1, "image_width": 1, "image_height": 1},
+    )
+
+async def scan_derivatives(job: dict):
+    """
+    Return the image info to store on the scan, and the analyzer input array
+    when it was decoded here (None when reused from an identical image).
+    """
+    existing = await existing_image_info(job["image_ref"])
+    if existing:
+        return existing, None
+    
+    series = None
+    if job.get("image_content_type") == imaging.ARRAY_CONTENT_TYPE:
+        series = await db.dicom_series.find_one({"scan_id": job["scan_id"]}, {"_id": 0})
+    if series is not None:
+        # Memory-mapped: only the middle slice is read
+        volume_path = await blob_store.local_path(job["image_ref"])
+        decoded = await asyncio.to_thread(dicom.decode_volume, volume_path, series, PREVIEW_SIZE, THUMBNAIL_SIZE)
+    else:
+        image_bytes = await blob_store.get(job["image_ref"])
+        decoded = await asyncio.to_thread(imaging.decode, image_bytes, PREVIEW_SIZE, THUMBNAIL_SIZE)
+    derivatives = {}
+    for name, derivative in decoded.derivatives.items():
+        blob = await blob_store.put(derivative.data, derivative.content_type)
+        derivatives[name] = {**blob.dict(), "width": derivative.width, "height": derivative.height}
+    return {"derivatives": derivatives, "image_width": decoded.width, "image_height": decoded.height}, decoded.array
+
+async def analyze_scan(job: dict) -> str:
+    # Decode once: derivatives for the API and the analyzer input array
+    image_info, image = await scan_derivatives(job)
+    await db.scan_reports.update_one({"id": job["scan_id"]}, {"$set": image_info})
+    
+    model_version = inference_engine.model_version(job["scan_type"])
+    ai_report = await analysis_results.get(job["image_ref"], job["scan_type"], model_version)
+    if ai_report is not None:
+        return ai_report
+    
+    if image is None:
+        array_blob = await blob_store.get(image_info["derivatives"]["array"]["key"])
+        image = imaging.decode_array(array_blob)
+    ai_report = await inference_engine.analyze(job["scan_type"], image)
+    await analysis_results.set(job["image_ref"], job["scan_type"], model_version, ai_report)
+    return ai_report
+
+analysis_queue = AnalysisQueue(
+    db,
+    analyze_scan,
+    # Enough concurrent jobs to fill inference batches
+    concurrency=int(os.environ.get('ANALYSIS_WORKERS', 8)),
+    max_attempts=int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', 3)),
+    max_pending=int(os.environ.get('ANALYSIS_MAX_PENDING', 1000)),
+    timeout_seconds=float(os.environ.get('ANALYSIS_TIMEOUT', 120)),
+)
+# On shutdown, running jobs get this long to finish before being handed back
+ANALYSIS_DRAIN_SECONDS = float(os.environ.get('ANALYSIS_DRAIN_SECONDS', 30))
+
+def queue_full_exception():
+    return HTTPException(
+        status_code=503,
+        detail="Analysis queue is full, please retry later",
+        headers={"Retry-After": "30"},
+    )
+
+ImageVariant = Literal["preview", "thumbnail", "original", "none"]
+
+async def load_image_data(scan: dict, variant: ImageVariant = "original") -> Optional[str]:
+    if variant == "none":
+        return None
+    # Reports created before the blob store still carry the image inline
+    if scan.get("image_data"):
+        return scan["image_data"]
+    if variant == "original":
+        # A series original is the whole volume; it is read through the
+        # frames and volume endpoints, never inlined
+        if "image_ref" not in scan or scan.get("series_id"):
+            return None
+        blob = {"key": scan["image_ref"], "content_type": scan["image_content_type"]}
+    else:
+        # Derivatives appear once the analysis job has decoded the image.
+        # Until then there is nothing to embed: inlining the original would
+        # send the full upload to every listing. Clients that need it fetch
+        # /image?variant=original
+        blob = (scan.get("derivatives") or {}).get(variant)
+        if blob is None:
+            return None
+    try:
+        data = await blob_store.get(blob["key"])
+    except BlobNotFound:
+        logger.error("Blob %s missing for scan %s", blob["key"], scan["id"])
+        raise HTTPException(status_code=500, detail="Scan image is unavailable")
+    return to_data_url(data, blob["content_type"])
+
+async def scan_response(scan: dict, variant: ImageVariant = "preview") -> ScanReportResponse:
+    return ScanReportResponse(**{**scan, "image_data": await load_image_data(scan, variant)})
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=401,
@@ -121,10 +496,20 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.PyJWTError:
         raise credentials_exception
     
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
     user = await db.users.find_one({"id": user_id})
     if user is None:
         raise credentials_exception
-    return User(**user)
+    user = User(**user)
+    user_cache.set(user_id, user)
+    return user
+
+async def invalidate_user(user_id: str):
+    # Call after any write to a user document
+    await user_cache_invalidation.invalidate(user_id)
 
 # Authentication Routes
 @api_router.post("/auth/register", response_model=UserResponse)
@@ -135,22 +520,52 @@ async def register(user: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_obj = User(
         email=user.email,
         name=user.name,
         password_hash=hashed_password
     )
     
-    await db.users.insert_one(user_obj.dict())
+    try:
+        await db.users.insert_one(user_obj.dict())
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration (email_unique index)
+        raise HTTPException(status_code=400, detail="Email already registered")
     return UserResponse(**user_obj.dict())
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(user: UserLogin):
+async def login(user: UserLogin, request: Request):
+    # Per-account limit, on top of the per-IP one, against password guessing
+    # spread over the addresses of one network. It is keyed on the account
+    # and the client's network together, so failures sent from elsewhere
+    # cannot lock the owner out. Only failed attempts count: the token is
+    # taken up front, so concurrent guesses cannot overrun it, and given back
+    # on success
+    network = client_network(request.client.host if request.client else None)
+    account = f"{user.email.lower()}|{network}"
+    retry_after = await rate_limiter.check("login", account=account)
+    if retry_after:
+        raise rate_limited_exception(retry_after)
+    
     # Find user by email
     db_user = await db.users.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["password_hash"]):
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        valid, new_hash = await verify_password(user.password, db_user["password_hash"])
+    except HTTPException:
+        # The hasher was too busy to check: not a failed attempt
+        await rate_limiter.refund("login", account=account)
+        raise
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    await rate_limiter.refund("login", account=account)
+    
+    # BCRYPT_ROUNDS changed since this hash was made
+    if new_hash:
+        await db.users.update_one({"id": db_user["id"]}, {"$set": {"password_hash": new_hash}})
+        await invalidate_user(db_user["id"])
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -165,36 +580,738 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return UserResponse(**current_user.dict())
 
 # Scan Routes
-@api_router.post("/scans", response_model=ScanReportResponse)
+def unsupported_image_exception():
+    return HTTPException(
+        status_code=415,
+        detail="Unsupported image format; upload a PNG, JPEG, GIF, BMP, TIFF or WebP image",
+    )
+
+async def copy_to_blob_store(read):
+    # Copy chunk by chunk; hashing and the size limit are applied as the
+    # bytes go through, so no more than one chunk is held in memory
+    writer = blob_store.open_writer(max_bytes=SCAN_UPLOAD_MAX_BYTES)
+    try:
+        while chunk := await read(UPLOAD_CHUNK_SIZE):
+            await writer.write(chunk)
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        await writer.abort()
+        raise
+    
+    # The stored type comes from the magic bytes, never the client's header,
+    # since it is served back as the image's Content-Type
+    if writer.size and writer.content_type == DEFAULT_CONTENT_TYPE:
+        await writer.abort()
+        raise unsupported_image_exception()
+    try:
+        return await writer.commit(writer.content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def store_upload(image: UploadFile):
+    try:
+        return await copy_to_blob_store(image.read)
+    finally:
+        await image.close()
+
+async def new_scan_report(user_id: str, scan_type: str, blob) -> ScanReport:
+    scan_report = ScanReport(
+        user_id=user_id,
+        scan_type=scan_type,
+        image_ref=blob.key,
+        image_size=blob.size,
+        image_content_type=blob.content_type,
+    )
+    # Resubmitted study: reuse the memoized report and derivatives
+    model_version = inference_engine.model_version(scan_type)
+    cached_report = await analysis_results.get(blob.key, scan_type, model_version)
+    image_info = await existing_image_info(blob.key) if cached_report is not None else None
+    if image_info:
+        scan_report.analysis_status = "completed"
+        scan_report.ai_report = cached_report
+        scan_report.derivatives = image_info["derivatives"]
+        scan_report.image_width = image_info.get("image_width")
+        scan_report.image_height = image_info.get("image_height")
+    else:
+        scan_report.job_id = str(uuid.uuid4())
+    return scan_report
+
+@api_router.post("/scans", status_code=202, response_model=ScanReportResponse, response_model_exclude_none=True)
 async def create_scan_report(
+    response: Response,
     scan_type: str = Form(...),
-    image_data: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    image_data: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user)
 ):
-    # Generate AI report (placeholder for now)
-    ai_report = f"AI Analysis for {scan_type} scan: This is a placeholder AI-generated report. The image shows normal anatomical structures with no apparent abnormalities detected. Further clinical correlation is recommended."
+    response_image_data = None
+    if image is not None:
+        blob = await store_upload(image)
+    elif image_data:
+        # Legacy clients post the image as a base64 data URL
+        try:
+            image_bytes, _ = parse_data_url(image_data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        content_type = sniff_content_type(image_bytes)
+        if content_type == DEFAULT_CONTENT_TYPE:
+            raise unsupported_image_exception()
+        if len(image_bytes) > SCAN_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Blob exceeds the {SCAN_UPLOAD_MAX_BYTES} byte limit")
+        # Identical images share one blob
+        blob = await blob_store.put(image_bytes, content_type)
+        response_image_data = to_data_url(image_bytes, content_type)
+    else:
+        raise HTTPException(status_code=400, detail="Either image or image_data is required")
     
-    scan_report = ScanReport(
-        user_id=current_user.id,
-        scan_type=scan_type,
-        image_data=image_data,
-        ai_report=ai_report
-    )
+    scan_report = await new_scan_report(current_user.id, scan_type, blob)
+    if scan_report.analysis_status == "completed":
+        await db.scan_reports.insert_one(scan_report.dict())
+        response.status_code = 200
+        return ScanReportResponse(**scan_report.dict(), image_data=response_image_data)
     
+    try:
+        await analysis_queue.check_capacity()
+    except QueueFull:
+        raise queue_full_exception()
+    
+    # The report is produced by the analysis workers; clients follow it via
+    # /scans/{id}/status or /scans/{id}/events
     await db.scan_reports.insert_one(scan_report.dict())
-    return ScanReportResponse(**scan_report.dict())
+    await analysis_queue.enqueue(scan_report.dict())
+    return ScanReportResponse(**scan_report.dict(), image_data=response_image_data)
+
+def batch_sources(images: List[UploadFile], archive: Optional[UploadFile]):
+    """Yield (filename, async read) for every image in the batch."""
+    for image in images:
+        yield image.filename, image.read
+    if archive is None:
+        return
+    try:
+        zf = zipfile.ZipFile(archive.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="archive is not a valid zip file")
+    for info in zf.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or Path(name).name.startswith("."):
+            continue
+        yield name, zip_member_reader(zf, info)
+
+def zip_member_reader(zf: zipfile.ZipFile, info: zipfile.ZipInfo):
+    # Opened on first read, so a member that cannot be opened (encrypted,
+    # unsupported compression, bad header) fails its own item only
+    member = None
+    
+    async def read(size):
+        nonlocal member
+        if member is None:
+            member = await asyncio.to_thread(zf.open, info)
+        return await asyncio.to_thread(member.read, size)
+    
+    return read
+
+# What reading one batch item can raise besides HTTPException: corrupt or
+# encrypted zip members, and I/O errors
+BATCH_ITEM_ERRORS = (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError, OSError)
+
+@api_router.post("/scans/batch", status_code=202, response_model=BatchSubmitResponse, response_model_exclude_none=True)
+async def create_scan_batch(
+    scan_type: str = Form(...),
+    images: List[UploadFile] = File([]),
+    archive: Optional[UploadFile] = File(None),
+    current_user: User = Depends(get_current_user)
+):
+    # One auth lookup, one insert_many for the reports and one for the jobs;
+    # a bad item is reported in its result instead of failing the batch
+    results: List[BatchItemResult] = []
+    reports: List[ScanReport] = []
+    capacity = await analysis_queue.remaining_capacity()
+    try:
+        for index, (filename, read) in enumerate(batch_sources(images, archive)):
+            if index >= BATCH_MAX_ITEMS:
+                raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} images")
+            try:
+                blob = await copy_to_blob_store(read)
+                scan_report = await new_scan_report(current_user.id, scan_type, blob)
+            except HTTPException as e:
+                results.append(BatchItemResult(index=index, filename=filename, status="error", error=e.detail))
+                continue
+            except BATCH_ITEM_ERRORS as e:
+                logger.warning("Batch item %s (%s) is unreadable: %s", index, filename, e)
+                results.append(BatchItemResult(
+                    index=index, filename=filename, status="error", error=f"Could not read image: {e}"
+                ))
+                continue
+            if scan_report.analysis_status != "completed":
+                if capacity <= 0:
+                    results.append(BatchItemResult(
+                        index=index, filename=filename, status="error", error="Analysis queue is full"
+                    ))
+                    continue
+                capacity -= 1
+            reports.append(scan_report)
+            results.append(BatchItemResult(
+                index=index,
+                filename=filename,
+                status="completed" if scan_report.analysis_status == "completed" else "queued",
+                scan_id=scan_report.id,
+                job_id=scan_report.job_id,
+            ))
+    finally:
+        for upload in [*images, archive]:
+            if upload is not None:
+                await upload.close()
+    
+    if not results:
+        raise HTTPException(status_code=400, detail="No images in batch")
+    if reports:
+        await db.scan_reports.insert_many([r.dict() for r in reports], ordered=False)
+        await analysis_queue.enqueue_many([r.dict() for r in reports if r.analysis_status != "completed"])
+    failed = sum(1 for r in results if r.status == "error")
+    return BatchSubmitResponse(submitted=len(results) - failed, failed=failed, items=results)
+
+async def spool_dicom_sources(
+    files: List[UploadFile],
+    archive: Optional[UploadFile],
+    workdir: Path,
+    max_file_bytes: int = DICOM_FILE_MAX_BYTES,
+    max_total_bytes: int = BATCH_UPLOAD_MAX_BYTES,
+):
+    """
+    Copy every uploaded file to disk, where pydicom can read headers lazily.
+
+    Returns the spooled (filename, path) pairs and the names of files that
+    could not be read. Sizes are counted as archive members are inflated, so
+    a zip bomb is refused before it fills the disk.
+    """
+    paths, skipped = [], []
+    total = 0
+    for index, (filename, read) in enumerate(batch_sources(files, archive)):
+        if index >= DICOM_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"A DICOM upload may contain at most {DICOM_MAX_FILES} files")
+        path = workdir / f"{index:06d}.dcm"
+        size = 0
+        try:
+            with open(path, "wb") as out:
+                while chunk := await read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    total += len(chunk)
+                    if size > max_file_bytes:
+                        raise HTTPException(
+                            status_code=413, detail=f"{filename} exceeds the {max_file_bytes} byte limit per DICOM file"
+                        )
+                    if total > max_total_bytes:
+                        raise HTTPException(
+                            status_code=413, detail=f"DICOM upload exceeds the {max_total_bytes} byte limit"
+                        )
+                    await asyncio.to_thread(out.write, chunk)
+        except BATCH_ITEM_ERRORS as e:
+            logger.warning("DICOM file %s is unreadable: %s", filename, e)
+            path.unlink(missing_ok=True)
+            skipped.append(filename)
+            continue
+        paths.append((filename, path))
+    return paths, skipped
+
+def read_dicom_headers(paths):
+    headers, skipped = [], []
+    for filename, path in paths:
+        try:
+            header = dicom.read_header(path)
+        except ValueError:
+            header = None
+        if header is None:
+            skipped.append(filename)
+        else:
+            headers.append(header)
+    return headers, skipped
+
+@api_router.post("/scans/dicom", status_code=202, response_model=DicomIngestResponse, response_model_exclude_none=True)
+async def ingest_dicom(
+    scan_type: Optional[str] = Form(None, description="Defaults to each series' modality"),
+    files: List[UploadFile] = File([]),
+    archive: Optional[UploadFile] = File(None),
+    current_user: User = Depends(get_current_user)
+):
+    # One scan report per series; each series' pixel data is stored as one
+    # contiguous .npy volume that readers memory-map (see dicom.py)
+    if dicom.pydicom is None:
+        raise HTTPException(status_code=501, detail="DICOM ingestion is not available on this server")
+    with tempfile.TemporaryDirectory(dir=blob_store.spool_dir, prefix=".dicom-") as workdir:
+        workdir = Path(workdir)
+        try:
+            paths, unreadable = await spool_dicom_sources(files, archive, workdir)
+        finally:
+            for upload in [*files, archive]:
+                if upload is not None:
+                    await upload.close()
+        headers, skipped = await asyncio.to_thread(read_dicom_headers, paths)
+        skipped = unreadable + skipped
+        try:
+            all_series = dicom.group_series(headers)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not all_series:
+            raise HTTPException(status_code=400, detail="No DICOM images found")
+        
+        results: List[DicomSeriesResult] = []
+        reports: List[ScanReport] = []
+        series_docs = []
+        capacity = await analysis_queue.remaining_capacity()
+        for index, series in enumerate(all_series):
+            metadata = series.metadata()
+            result = DicomSeriesResult(
+                status="error",
+                **{key: metadata[key] for key in DicomSeriesResult.model_fields if key in metadata},
+            )
+            results.append(result)
+            volume_path = workdir / f"volume-{index}.npy"
+            try:
+                await asyncio.to_thread(dicom.write_volume, series, volume_path)
+            except Exception as e:
+                # Typically a compressed transfer syntax without a decoder
+                result.error = f"Could not decode pixel data: {e}"
+                continue
+            blob = await blob_store.put_file(str(volume_path), imaging.ARRAY_CONTENT_TYPE)
+            scan_report = await new_scan_report(current_user.id, scan_type or metadata["modality"] or "DICOM", blob)
+            if scan_report.analysis_status != "completed":
+                if capacity <= 0:
+                    result.error = "Analysis queue is full"
+                    continue
+                capacity -= 1
+            scan_report.series_id = str(uuid.uuid4())
+            scan_report.frame_count = metadata["frames"]
+            scan_report.image_width = metadata["columns"]
+            scan_report.image_height = metadata["rows"]
+            reports.append(scan_report)
+            series_docs.append({
+                "id": scan_report.series_id,
+                "scan_id": scan_report.id,
+                "user_id": current_user.id,
+                "volume_ref": blob.key,
+                **metadata,
+                "created_at": datetime.utcnow(),
+            })
+            result.status = "completed" if scan_report.analysis_status == "completed" else "queued"
+            result.series_id = scan_report.series_id
+            result.scan_id = scan_report.id
+            result.job_id = scan_report.job_id
+    
+    if reports:
+        await db.dicom_series.insert_many(series_docs)
+        await db.scan_reports.insert_many([r.dict() for r in reports], ordered=False)
+        await analysis_queue.enqueue_many([r.dict() for r in reports if r.analysis_status != "completed"])
+    return DicomIngestResponse(series=results, skipped=skipped)
+
+def scan_page_query(user_id: str, cursor: Optional[str]) -> dict:
+    # Keyset pagination, newest first; the cursor is the (created_at, id) of
+    # the last item on the previous page
+    query = {"user_id": user_id}
+    if cursor:
+        created_at, scan_id = decode_scan_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": scan_id}},
+        ]
+    return query
+
+async def summary_document(scan: dict, with_thumbnail: bool) -> dict:
+    if with_thumbnail:
+        scan["thumbnail_data"] = await load_image_data(scan, "thumbnail")
+        scan.pop("derivatives", None)
+    return scan
+
+async def stream_scan_summaries(query: dict, projection: dict, limit: int, with_thumbnail: bool):
+    cursor = (
+        scan_listing.find(query, projection)
+        .sort([("created_at", -1), ("id", -1)])
+        .limit(limit + 1)
+        .batch_size(min(limit + 1, 500))
+    )
+    sent = 0
+    last = None
+    async for scan in cursor:
+        if sent == limit:
+            # There is more: the last line carries the cursor for the next page
+            yield {"next_cursor": encode_scan_cursor(last)}
+            return
+        last = scan
+        yield await summary_document(scan, with_thumbnail)
+        sent += 1
+
+@api_router.get("/scans", response_model=List[ScanReportSummary], response_model_exclude_unset=True)
+async def get_user_scans(
+    request: Request,
+    response: Response,
+    limit: int = Query(SCANS_PAGE_DEFAULT, ge=1, le=SCANS_STREAM_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated summary fields to return"),
+    current_user: User = Depends(get_current_user)
+):
+    query = scan_page_query(current_user.id, cursor)
+    projection = scan_projection(fields)
+    with_thumbnail = bool(fields) and "thumbnail_data" in fields
+    
+    # Accept: application/x-ndjson streams summaries straight off the Mongo
+    # cursor, so much larger pages are allowed
+    if wants_ndjson(request):
+        return NDJSONResponse(stream_scan_summaries(query, projection, limit, with_thumbnail))
+    if limit > SCANS_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit may not exceed {SCANS_PAGE_MAX} unless streaming NDJSON")
+    
+    scans = await (
+        scan_listing.find(query, projection)
+        .sort([("created_at", -1), ("id", -1)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    headers = {}
+    if len(scans) > limit:
+        scans = scans[:limit]
+        headers["X-Next-Cursor"] = encode_scan_cursor(scans[-1])
+    scans = [await summary_document(scan, with_thumbnail) for scan in scans]
+    
+    if FAST_JSON_RESPONSES:
+        # The projection already limits documents to summary fields, so skip
+        # building and re-validating a model per item
+        return FastJSONResponse(scans, headers=headers)
+    response.headers.update(headers)
+    return [ScanReportSummary(**scan) for scan in scans]
+
+@api_router.get("/scans/search", response_model=List[ScanSearchHit], response_model_exclude_unset=True)
+async def search_scans(
+    response: Response,
+    q: Optional[str] = Query(None, max_length=500, description="Words to find in the AI report"),
+    scan_type: Optional[str] = None,
+    created_from: Optional[datetime] = Query(None, description="Inclusive"),
+    created_to: Optional[datetime] = Query(None, description="Exclusive"),
+    limit: int = Query(SCANS_PAGE_DEFAULT, ge=1, le=SCANS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated summary fields to return"),
+    current_user: User = Depends(get_current_user)
+):
+    # Relevance first when q is given, otherwise newest first; the next page
+    # cursor is returned in X-Next-Cursor as for /scans
+    offset = decode_search_cursor(cursor) if cursor else 0
+    limit = min(limit, SEARCH_MAX_RESULTS - offset)
+    query = search_filter(current_user.id, scan_type, created_from, created_to)
+    projection = scan_projection(fields)
+    with_thumbnail = bool(fields) and "thumbnail_data" in fields
+    
+    scans = await scan_search.search(query, q.strip() if q else None, projection, offset, limit + 1)
+    headers = {}
+    if len(scans) > limit:
+        scans = scans[:limit]
+        if offset + limit < SEARCH_MAX_RESULTS:
+            headers["X-Next-Cursor"] = encode_search_cursor(offset + limit)
+    scans = [await summary_document(scan, with_thumbnail) for scan in scans]
+    
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(scans, headers=headers)
+    response.headers.update(headers)
+    return [ScanSearchHit(**scan) for scan in scans]
+
+@api_router.get("/scans/export")
+async def export_scans(
+    format: Literal["csv", "ndjson", "parquet"] = "csv",
+    scan_type: Optional[str] = None,
+    created_from: Optional[datetime] = Query(None, description="Inclusive"),
+    created_to: Optional[datetime] = Query(None, description="Exclusive"),
+    current_user: User = Depends(get_current_user)
+):
+    # Every matching report, oldest first, streamed a Mongo batch at a time;
+    # images are referenced by image_ref/image_url, not inlined
+    try:
+        exporter = EXPORT_FORMATS[format]()
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    query = export_filter(current_user.id, scan_type, created_from, created_to)
+    filename = f"scan-reports-{datetime.utcnow():%Y%m%dT%H%M%S}.{exporter.extension}"
+    return StreamingResponse(
+        export_chunks(scan_listing, query, exporter, EXPORT_BATCH_SIZE),
+        media_type=exporter.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-@api_router.get("/scans", response_model=List[ScanReportResponse])
-async def get_user_scans(current_user: User = Depends(get_current_user)):
-    scans = await db.scan_reports.find({"user_id": current_user.id}).to_list(1000)
-    return [ScanReportResponse(**scan) for scan in scans]
+# Change streams when MongoDB supports them, else polling on updated_at
+scan_feed = create_scan_feed(
+    scan_listing, mongo_url, DEFAULT_SUMMARY_FIELDS,
+    poll_interval=float(os.environ.get('FEED_POLL_SECONDS', SSE_POLL_SECONDS)),
+)
+
+@api_router.get("/scans/feed")
+async def stream_scan_changes(
+    request: Request,
+    resume: Optional[str] = Query(None, description="Resume token; EventSource sends it as Last-Event-ID instead"),
+    current_user: User = Depends(get_current_user)
+):
+    # Server-sent events, one per new or changed scan ("insert"/"update", with
+    # the summary fields that changed), each with its resume token as the
+    # event id; see feed.py for "ready" and "reset"
+    token = resume or request.headers.get("last-event-id") or None
+    if feed_slots.full:
+        feed_slots.rejected += 1
+        raise HTTPException(status_code=503, detail="Too many open feeds, please retry later", headers={"Retry-After": "5"})
+    
+    async def events():
+        # Acquired here, not in the handler, so that a client gone before the
+        # body starts cannot leak the slot
+        if not feed_slots.try_acquire():
+            yield "retry: 5000\n\n"
+            return
+        try:
+            yield f"retry: {int(SSE_POLL_SECONDS * 1000)}\n\n"
+            last_sent = asyncio.get_running_loop().time()
+            async for change in scan_feed.changes(current_user.id, token):
+                now = asyncio.get_running_loop().time()
+                if change is not None:
+                    data = dumps(change.scan or {}).decode()
+                    yield f"id: {change.token}\nevent: {change.op}\ndata: {data}\n\n"
+                    last_sent = now
+                elif now - last_sent >= FEED_KEEPALIVE_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = now
+        finally:
+            feed_slots.release()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @api_router.get("/scans/{scan_id}", response_model=ScanReportResponse)
-async def get_scan_report(scan_id: str, current_user: User = Depends(get_current_user)):
+async def get_scan_report(
+    scan_id: str,
+    image: ImageVariant = Query("preview", description="Which rendition to embed as image_data"),
+    current_user: User = Depends(get_current_user)
+):
     scan = await db.scan_reports.find_one({"id": scan_id, "user_id": current_user.id})
     if not scan:
         raise HTTPException(status_code=404, detail="Scan not found")
-    return ScanReportResponse(**scan)
+    return await scan_response(scan, image)
+
+# Content-addressed blobs never change, so clients may cache them forever;
+# private because they are only served to their owner
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# For an original served in place of a missing derivative: revalidate each time
+FALLBACK_CACHE_CONTROL = "private, no-cache"
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def parse_byte_range(header: Optional[str], size: int):
+    """
+    Return (start, end) for a single ``bytes=`` range, None to serve the whole
+    body (no header, an invalid range, or a form we do not support), or
+    raise 416.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    if start_text and end_text and end < start:
+        # Invalid rather than unsatisfiable (RFC 9110 14.1.1): ignore it
+        return None
+    end = min(end, size - 1)
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+def if_range_matches(header: Optional[str], etag: str) -> bool:
+    # If-Range: only honour the range if the client's copy is still current.
+    # Unlike If-None-Match this needs a strong match, and we send no dates
+    return not header or header.strip() == etag
+
+@api_router.get("/scans/{scan_id}/image")
+async def get_scan_image(
+    scan_id: str,
+    request: Request,
+    variant: Literal["original", "preview", "thumbnail"] = "original",
+    current_user: User = Depends(get_current_user)
+):
+    scan = await db.scan_reports.find_one(
+        {"id": scan_id, "user_id": current_user.id},
+        {"_id": 0, "image_ref": 1, "image_size": 1, "image_content_type": 1, "derivatives": 1, "image_data": 1},
+    )
+    # The projection leaves an empty dict for a scan without any image
+    if scan is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    derivative = (scan.get("derivatives") or {}).get(variant) if variant != "original" else None
+    # Derivative pending or failed: the original stands in, but must not be
+    # cached under a URL that will name the derivative once it exists
+    fallback = variant != "original" and not derivative
+    
+    if "image_ref" not in scan:
+        # Legacy report with the image inline
+        if not scan.get("image_data"):
+            logger.error("Scan %s has no image", scan_id)
+            raise HTTPException(status_code=404, detail="Scan image not found")
+        try:
+            data, content_type = parse_data_url(scan["image_data"])
+        except ValueError as e:
+            logger.error("Inline image of scan %s is unreadable: %s", scan_id, e)
+            raise HTTPException(status_code=500, detail="Scan image is unavailable")
+        blob = {"key": hashlib.sha256(data).hexdigest(), "size": len(data), "content_type": content_type}
+    elif derivative:
+        blob = derivative
+    else:
+        blob = {"key": scan["image_ref"], "size": scan["image_size"], "content_type": scan["image_content_type"]}
+    
+    etag = f'"{blob["key"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": FALLBACK_CACHE_CONTROL if fallback else IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        # Never let a browser second-guess the stored type
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    size = blob["size"]
+    # A stale If-Range means the whole body, whatever the range says
+    range_header = request.headers.get("range")
+    if not if_range_matches(request.headers.get("if-range"), etag):
+        range_header = None
+    byte_range = parse_byte_range(range_header, size)
+    
+    if "image_ref" not in scan:
+        start, end = byte_range or (0, size - 1)
+        body = iter([data[start:end + 1]])
+    else:
+        if not await blob_store.exists(blob["key"]):
+            logger.error("Blob %s missing for scan %s", blob["key"], scan_id)
+            raise HTTPException(status_code=500, detail="Scan image is unavailable")
+        start, end = byte_range or (0, size - 1)
+        body = blob_store.iter_range(blob["key"], start, end)
+    
+    headers["Content-Length"] = str(end - start + 1)
+    status_code = 200
+    if byte_range:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(body, status_code=status_code, media_type=blob["content_type"], headers=headers)
+
+async def scan_status(scan_id: str, user_id: str) -> ScanStatusResponse:
+    scan = await db.scan_reports.find_one(
+        {"id": scan_id, "user_id": user_id},
+        {"_id": 0, "id": 1, "job_id": 1, "analysis_status": 1, "ai_report": 1, "updated_at": 1},
+    )
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    status = ScanStatusResponse(**{"analysis_status": "completed", **scan})
+    if scan.get("job_id"):
+        job = await db.analysis_jobs.find_one({"id": scan["job_id"]}, {"_id": 0, "attempts": 1, "error": 1})
+        if job:
+            status.attempts = job.get("attempts")
+            status.error = job.get("error")
+    return status
+
+async def scan_series(scan_id: str, user_id: str):
+    series = await db.dicom_series.find_one({"scan_id": scan_id, "user_id": user_id}, {"_id": 0})
+    if series is None:
+        raise HTTPException(status_code=404, detail="DICOM series not found")
+    try:
+        return series, await blob_store.local_path(series["volume_ref"])
+    except BlobNotFound:
+        logger.error("Volume %s missing for scan %s", series["volume_ref"], scan_id)
+        raise HTTPException(status_code=500, detail="Scan volume is unavailable")
+
+@api_router.get("/scans/{scan_id}/frames/{index}")
+async def get_scan_frame(
+    scan_id: str,
+    index: int,
+    format: Literal["png", "npy"] = Query("png", description="Windowed 8-bit PNG, or raw stored pixels as .npy"),
+    window_center: Optional[float] = None,
+    window_width: Optional[float] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # A slice viewer's request touches only this frame's pages of the volume
+    series, volume_path = await scan_series(scan_id, current_user.id)
+    if not 0 <= index < series["frames"]:
+        raise HTTPException(status_code=404, detail="Frame not found")
+    if format == "npy":
+        data = await asyncio.to_thread(dicom.frame_npy, volume_path, index)
+        media_type = imaging.ARRAY_CONTENT_TYPE
+    else:
+        data = await asyncio.to_thread(dicom.frame_png, volume_path, series, index, window_center, window_width)
+        media_type = "image/png"
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+@api_router.get("/scans/{scan_id}/volume")
+async def get_scan_volume(
+    scan_id: str,
+    start: int = Query(0, ge=0),
+    stop: Optional[int] = Query(None, ge=1, description="Exclusive; defaults to the last frame"),
+    current_user: User = Depends(get_current_user)
+):
+    # Frames [start, stop) as one .npy, streamed a frame at a time
+    series, volume_path = await scan_series(scan_id, current_user.id)
+    stop = min(stop or series["frames"], series["frames"])
+    if start >= stop:
+        raise HTTPException(status_code=400, detail="start must be below stop and the frame count")
+    
+    async def frames():
+        volume = dicom.open_volume(volume_path)
+        yield dicom.npy_header(volume.dtype, (stop - start, *volume.shape[1:]))
+        for i in range(start, stop):
+            yield await asyncio.to_thread(volume[i].tobytes)
+    
+    return StreamingResponse(
+        frames(), media_type=imaging.ARRAY_CONTENT_TYPE, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    )
+
+@api_router.get("/scans/{scan_id}/status", response_model=ScanStatusResponse, response_model_exclude_none=True)
+async def get_scan_status(scan_id: str, current_user: User = Depends(get_current_user)):
+    return await scan_status(scan_id, current_user.id)
+
+@api_router.get("/scans/{scan_id}/events")
+async def stream_scan_status(scan_id: str, current_user: User = Depends(get_current_user)):
+    # Server-sent events: one "status" event per change, closing once the
+    # analysis has completed or failed
+    status = await scan_status(scan_id, current_user.id)
+    
+    async def events():
+        current = status
+        last_sent = None
+        while True:
+            payload = current.model_dump_json(exclude_none=True)
+            if payload != last_sent:
+                yield f"event: status\ndata: {payload}\n\n"
+                last_sent = payload
+            elif current.analysis_status not in TERMINAL_STATUSES:
+                yield ": keep-alive\n\n"
+            if current.analysis_status in TERMINAL_STATUSES:
+                return
+            await analysis_queue.wait_for_update(scan_id, timeout=SSE_POLL_SECONDS)
+            current = await scan_status(scan_id, current_user.id)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # General Routes
 @api_router.get("/")
@@ -205,17 +1322,161 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body = render_prometheus(
+        request_metrics,
+        mongo_command_timer,
+        event_loop_lag,
+        {
+            "user_cache": user_cache.stats(),
+            "password_hasher": password_hasher.stats(),
+            "analysis_queue": analysis_queue.stats(),
+            "inference": inference_engine.stats(),
+            "analysis_results": analysis_results.stats(),
+            "mongo_pool": mongo_pool_monitor.stats(),
+            "rate_limiter": rate_limiter.stats(),
+            "upload_slots": upload_slots.stats(),
+            "search": scan_search.stats(),
+            "feed": scan_feed.stats(),
+            "feed_slots": feed_slots.stats(),
+        },
+    )
+    return Response(content=body, media_type=PROMETHEUS_CONTENT_TYPE)
+
+# Liveness: the process is up and serving; never touches dependencies, so a
+# slow database doesn't get healthy workers restarted
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+async def check_mongo():
+    await db.command("ping")
+
+# Readiness: every dependency a request may need is reachable. Results are
+# cached for READINESS_CACHE_SECONDS so frequent probes don't add load.
+readiness_probe = ReadinessProbe(
+    {
+        "mongo": check_mongo,
+        "blob_store": blob_store.check,
+        "analysis_queue": analysis_queue.check,
+    },
+    cache_seconds=float(os.environ.get('READINESS_CACHE_SECONDS', 2)),
+    timeout=float(os.environ.get('READINESS_TIMEOUT', 2)),
+)
+
+@api_router.get("/health/ready")
+async def readiness(response: Response):
+    result = await readiness_probe.check()
+    if result["status"] != "ready":
+        response.status_code = 503
+    return result
+
 # Include the router in the main app
 app.include_router(api_router)
 
+def upload_max_bytes(path: str) -> int:
+    # base64 clients need a third more room than the raw image
+    if path in ("/api/scans/batch", "/api/scans/dicom"):
+        return BATCH_UPLOAD_MAX_BYTES
+    return SCAN_UPLOAD_MAX_BYTES * 4 // 3 + UPLOAD_CHUNK_SIZE
+
+class UploadSizeLimit:
+    """
+    Refuse oversized POST bodies with 413 before they are parsed.
+
+    A declared Content-Length is checked up front; chunked bodies have none,
+    so the bytes are also counted as they arrive and reading stops at the
+    cap, before the multipart parser can spool the rest to disk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = upload_max_bytes(scope["path"])
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            await JSONResponse(status_code=413, content={"detail": "Upload too large"})(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                # FastAPI passes HTTPException through form parsing untouched
+                raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimit)
+
+def token_subject(request: Request) -> Optional[str]:
+    # Identify the user for per-user limits without a database lookup; a bad
+    # token only means the per-IP limit applies, and auth rejects it later
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except jwt.PyJWTError:
+        return None
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Runs before the body is read, so throttled uploads cost nothing
+    route = RATE_LIMITED_ROUTES.get((request.method, request.url.path))
+    if route is None:
+        return await call_next(request)
+    retry_after = await rate_limiter.check(
+        route, ip=request.client.host if request.client else None, user=token_subject(request)
+    )
+    if retry_after:
+        exc = rate_limited_exception(retry_after)
+        return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers)
+    if route not in UPLOAD_ROUTES:
+        return await call_next(request)
+    if not upload_slots.try_acquire():
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Too many uploads in progress, please retry"},
+            headers={"Retry-After": "1"},
+        )
+    try:
+        return await call_next(request)
+    finally:
+        upload_slots.release()
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges", "Retry-After", "Content-Disposition"],
 )
 
+# Negotiated gzip/br/zstd for text responses above COMPRESSION_MIN_BYTES;
+# images and other already-compressed types are sent as is
+if os.environ.get('COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+    app.add_middleware(
+        CompressionMiddleware,
+        encodings=parse_encodings(os.environ.get('COMPRESSION_ENCODINGS', 'br,zstd,gzip')),
+        min_bytes=int(os.environ.get('COMPRESSION_MIN_BYTES', 1024)),
+        thread_bytes=int(os.environ.get('COMPRESSION_THREAD_BYTES', 256 * 1024)),
+        levels=parse_levels(os.environ.get('COMPRESSION_LEVELS', '')),
+    )
+
+# Outermost, so latency includes the other middleware and rejected requests
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -223,6 +1484,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def warm_up_database():
+    # Fail startup, before the worker accepts traffic, if Mongo is unreachable
+    await db.command("ping")
+
+@app.on_event("startup")
+async def start_event_loop_lag_monitor():
+    event_loop_lag.start()
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes(db)
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    await user_cache_invalidation.start()
+
+@app.on_event("startup")
+async def start_analysis_workers():
+    await asyncio.to_thread(inference_engine.load)
+    await analysis_queue.start()
+
+@app.on_event("shutdown")
+async def stop_analysis_workers():
+    await analysis_queue.stop(drain_timeout=ANALYSIS_DRAIN_SECONDS)
+    await inference_engine.stop()
+
+@app.on_event("shutdown")
+async def stop_scan_feed():
+    await scan_feed.stop()
+
+@app.on_event("shutdown")
+async def stop_event_loop_lag_monitor():
+    await event_loop_lag.stop()
+
+@app.on_event("shutdown")
+async def stop_cache_invalidation():
+    await user_cache_invalidation.stop()
+
+@app.on_event("shutdown")
+async def close_rate_limiter():
+    await rate_limiter.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    password_hasher.shutdown()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
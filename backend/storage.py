@@ -0,0 +1,498 @@
+"""
+Content-addressed blob storage for scan images.
+
+Blobs are keyed by the SHA-256 digest of their bytes, so uploading the same
+image twice stores it once. The backend is picked with BLOB_STORE_BACKEND:
+"local" (default), "gridfs" or "s3".
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+ROOT_DIR = Path(__file__).parent
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# Magic numbers for the image formats the upload form accepts
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Blob exceeds the {max_bytes} byte limit")
+        self.max_bytes = max_bytes
+
+
+class BlobRef(BaseModel):
+    key: str  # SHA-256 hex digest of the content
+    size: int
+    content_type: str
+
+
+def sniff_content_type(data: bytes) -> str:
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return DEFAULT_CONTENT_TYPE
+
+
+def parse_data_url(image_data: str) -> Tuple[bytes, str]:
+    """Decode a ``data:<mime>;base64,<payload>`` URL or a bare base64 string."""
+    content_type = None
+    payload = image_data.strip()
+    if payload.startswith("data:"):
+        header, _, payload = payload.partition(",")
+        mime = header[len("data:"):].split(";")[0]
+        content_type = mime or None
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("image_data is not valid base64")
+    if not data:
+        raise ValueError("image_data is empty")
+    return data, content_type or sniff_content_type(data)
+
+
+def to_data_url(data: bytes, content_type: str) -> str:
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _evict_cache(cache_dir: Path, max_bytes: int, keep: Path) -> None:
+    """Delete the least recently used cached blobs until the rest fit in ``max_bytes``."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        # Dot files are downloads still in progress
+        if entry.name.startswith(".") or entry.path == str(keep):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries) + keep.stat().st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        # Readers that already mapped the file keep their copy until they close it
+        Path(path).unlink(missing_ok=True)
+        total -= size
+
+
+def _hash_file(path: str) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class BlobWriter:
+    """
+    Incremental writer for streamed uploads.
+
+    Chunks are hashed as they arrive and spooled to a temp file, so memory use
+    is bounded by the chunk size regardless of the blob size. The content
+    address is only known once the last chunk is in, at which point
+    ``commit`` hands the temp file to the store.
+    """
+
+    def __init__(self, store: "BlobStore", max_bytes: Optional[int] = None, spool_dir: Optional[Path] = None):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._head = b""
+        fd, self.path = tempfile.mkstemp(dir=spool_dir, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+
+    async def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            await self.abort()
+            raise BlobTooLarge(self.max_bytes)
+        self._hash.update(chunk)
+        if len(self._head) < 16:
+            self._head += chunk[:16]
+        await asyncio.to_thread(self._file.write, chunk)
+
+    @property
+    def content_type(self) -> str:
+        """Type sniffed from the first bytes written."""
+        return sniff_content_type(self._head)
+
+    async def commit(self, content_type: Optional[str] = None) -> BlobRef:
+        self._file.close()
+        if not self.size:
+            await self.abort()
+            raise ValueError("Uploaded image is empty")
+        key = self._hash.hexdigest()
+        content_type = content_type or sniff_content_type(self._head)
+        try:
+            if not await self.store.exists(key):
+                await self.store._write_file(key, self.path, content_type)
+        finally:
+            Path(self.path).unlink(missing_ok=True)
+        return BlobRef(key=key, size=self.size, content_type=content_type)
+
+    async def abort(self) -> None:
+        self._file.close()
+        Path(self.path).unlink(missing_ok=True)
+
+
+class BlobStore:
+    name = "base"
+    spool_dir: Optional[Path] = None
+    cache_dir: Path = Path(tempfile.gettempdir()) / "radiologix-blob-cache"
+    cache_max_bytes: int = 2 * 1024 ** 3
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def check(self) -> None:
+        """Raise if the backend cannot currently serve requests."""
+        await self.exists("0" * 64)
+
+    async def iter_range(
+        self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """Yield bytes ``start`` to ``end`` (inclusive, like HTTP ranges) in chunks."""
+        data = await self.get(key)
+        data = data[start:None if end is None else end + 1]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    async def _write(self, key: str, data: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    async def _write_file(self, key: str, path: str, content_type: str) -> None:
+        raise NotImplementedError
+
+    async def put(self, data: bytes, content_type: str) -> BlobRef:
+        key = hashlib.sha256(data).hexdigest()
+        if not await self.exists(key):
+            await self._write(key, data, content_type)
+        return BlobRef(key=key, size=len(data), content_type=content_type)
+
+    async def put_file(self, path: str, content_type: str) -> BlobRef:
+        """Store a file by content hash, consuming (moving or deleting) it."""
+        key, size = await asyncio.to_thread(_hash_file, path)
+        try:
+            if not await self.exists(key):
+                await self._write_file(key, path, content_type)
+        finally:
+            Path(path).unlink(missing_ok=True)
+        return BlobRef(key=key, size=size, content_type=content_type)
+
+    def open_writer(self, max_bytes: Optional[int] = None) -> BlobWriter:
+        return BlobWriter(self, max_bytes=max_bytes, spool_dir=self.spool_dir)
+
+    async def local_path(self, key: str) -> Path:
+        """
+        A local file holding the blob, e.g. for memory mapping. Remote backends
+        download it into ``cache_dir``; keys are content hashes, so a cached
+        copy never goes stale. The cache is kept under ``cache_max_bytes`` by
+        evicting the least recently used blobs (by mtime, which hits refresh).
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / key
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in self.iter_range(key):
+                    await asyncio.to_thread(f.write, chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        await asyncio.to_thread(_evict_cache, self.cache_dir, self.cache_max_bytes, path)
+        return path
+
+
+class LocalBlobStore(BlobStore):
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Spool uploads on the same filesystem so commit is a rename
+        self.spool_dir = self.root
+
+    def path_for(self, key: str) -> Path:
+        # Two levels of fan-out keep directory sizes sane
+        return self.root / key[:2] / key[2:4] / key
+
+    async def exists(self, key: str) -> bool:
+        return self.path_for(key).is_file()
+
+    async def get(self, key: str) -> bytes:
+        try:
+            return await asyncio.to_thread(self.path_for(key).read_bytes)
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    async def delete(self, key: str) -> None:
+        self.path_for(key).unlink(missing_ok=True)
+
+    async def local_path(self, key: str) -> Path:
+        path = self.path_for(key)
+        if not path.is_file():
+            raise BlobNotFound(key)
+        return path
+
+    async def check(self) -> None:
+        if not await asyncio.to_thread(os.access, self.root, os.W_OK | os.X_OK):
+            raise OSError(f"Blob store directory {self.root} is not writable")
+
+    async def iter_range(
+        self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        try:
+            f = await asyncio.to_thread(open, self.path_for(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    def _write_sync(self, key: str, data: bytes) -> None:
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see partial blobs
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    async def _write(self, key: str, data: bytes, content_type: str) -> None:
+        await asyncio.to_thread(self._write_sync, key, data)
+
+    def _write_file_sync(self, key: str, path: str) -> None:
+        target = self.path_for(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    async def _write_file(self, key: str, path: str, content_type: str) -> None:
+        await asyncio.to_thread(self._write_file_sync, key, path)
+
+
+class GridFSBlobStore(BlobStore):
+    name = "gridfs"
+
+    def __init__(self, db, bucket_name: str = "scan_blobs"):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        self.files = db[f"{bucket_name}.files"]
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+
+    async def check(self) -> None:
+        await self.files.find_one({}, {"_id": 1})
+
+    async def exists(self, key: str) -> bool:
+        return await self.files.find_one({"_id": key}, {"_id": 1}) is not None
+
+    async def get(self, key: str) -> bytes:
+        from gridfs.errors import NoFile
+
+        try:
+            stream = await self.bucket.open_download_stream(key)
+        except NoFile:
+            raise BlobNotFound(key)
+        return await stream.read()
+
+    async def delete(self, key: str) -> None:
+        from gridfs.errors import NoFile
+
+        try:
+            await self.bucket.delete(key)
+        except NoFile:
+            pass
+
+    async def iter_range(
+        self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        from gridfs.errors import NoFile
+
+        try:
+            stream = await self.bucket.open_download_stream(key)
+        except NoFile:
+            raise BlobNotFound(key)
+        stream.seek(start)
+        remaining = (stream.length if end is None else end + 1) - start
+        while remaining > 0:
+            chunk = await stream.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    async def _write(self, key: str, data: bytes, content_type: str) -> None:
+        try:
+            await self.bucket.upload_from_stream_with_id(
+                key, key, data, metadata={"contentType": content_type}
+            )
+        except DuplicateKeyError:
+            # A concurrent upload of the same content got there first
+            pass
+
+    async def _write_file(self, key: str, path: str, content_type: str) -> None:
+        with open(path, "rb") as source:
+            await self._write(key, source, content_type)
+
+
+class S3BlobStore(BlobStore):
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def check(self) -> None:
+        await asyncio.to_thread(self.s3.head_bucket, Bucket=self.bucket)
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(
+                self.s3.head_object, Bucket=self.bucket, Key=self.object_key(key)
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def get(self, key: str) -> bytes:
+        from botocore.exceptions import ClientError
+
+        try:
+            obj = await asyncio.to_thread(
+                self.s3.get_object, Bucket=self.bucket, Key=self.object_key(key)
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNotFound(key)
+            raise
+        return await asyncio.to_thread(obj["Body"].read)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(
+            self.s3.delete_object, Bucket=self.bucket, Key=self.object_key(key)
+        )
+
+    async def iter_range(
+        self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        from botocore.exceptions import ClientError
+
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        try:
+            obj = await asyncio.to_thread(
+                self.s3.get_object, Bucket=self.bucket, Key=self.object_key(key), Range=byte_range
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNotFound(key)
+            raise
+        body = obj["Body"]
+        try:
+            while chunk := await asyncio.to_thread(body.read, chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def _write(self, key: str, data: bytes, content_type: str) -> None:
+        await asyncio.to_thread(
+            self.s3.put_object,
+            Bucket=self.bucket,
+            Key=self.object_key(key),
+            Body=data,
+            ContentType=content_type,
+        )
+
+    async def _write_file(self, key: str, path: str, content_type: str) -> None:
+        await asyncio.to_thread(
+            self.s3.upload_file,
+            path,
+            self.bucket,
+            self.object_key(key),
+            ExtraArgs={"ContentType": content_type},
+        )
+
+
+def create_blob_store(db) -> BlobStore:
+    backend = os.environ.get("BLOB_STORE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalBlobStore(Path(os.environ.get("BLOB_STORE_PATH", ROOT_DIR / "blobs")))
+    if backend == "gridfs":
+        store = GridFSBlobStore(db, os.environ.get("GRIDFS_BUCKET", "scan_blobs"))
+    elif backend == "s3":
+        store = S3BlobStore(
+            os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", "scans/"),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+        )
+    else:
+        raise ValueError(f"Unknown BLOB_STORE_BACKEND: {backend}")
+    if os.environ.get("BLOB_CACHE_PATH"):
+        store.cache_dir = Path(os.environ["BLOB_CACHE_PATH"])
+    if os.environ.get("BLOB_CACHE_MAX_BYTES"):
+        store.cache_max_bytes = int(os.environ["BLOB_CACHE_MAX_BYTES"])
+    return store
@@ -650,6 +650,7 @@ const ScanPage = () => {
   const [selectedFile, setSelectedFile] = useState(null);
   const [uploading, setUploading] = useState(false);
   const [report, setReport] = useState(null);
+  const [previewUrl, setPreviewUrl] = useState(null);
   const [error, setError] = useState('');
 
   const scanInfo = {
@@ -685,13 +686,29 @@ const ScanPage = () => {
     }
   };
 
-  const convertToBase64 = (file) => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(file);
-      reader.onload = () => resolve(reader.result);
-      reader.onerror = error => reject(error);
-    });
+  useEffect(() => {
+    return () => {
+      if (previewUrl) URL.revokeObjectURL(previewUrl);
+    };
+  }, [previewUrl]);
+
+  // Analysis runs in a background job; poll until the report is ready, but
+  // give up on a job that is stuck rather than spinning forever
+  const waitForAnalysis = async (scan, timeoutMs = 5 * 60 * 1000) => {
+    const deadline = Date.now() + timeoutMs;
+    let status = scan;
+    while (status.analysis_status === 'pending' || status.analysis_status === 'running') {
+      if (Date.now() > deadline) {
+        throw new Error('Analysis is taking longer than expected; check back later');
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      const response = await axios.get(`${API}/scans/${scan.id}/status`);
+      status = response.data;
+    }
+    if (status.analysis_status === 'failed') {
+      throw new Error(status.error || 'Analysis failed');
+    }
+    return { ...scan, ...status };
   };
 
   const handleUpload = async () => {
@@ -709,11 +726,10 @@ const ScanPage = () => {
     setError('');
 
     try {
-      const base64Image = await convertToBase64(selectedFile);
-      
+      // Send the raw file; the backend streams it to storage
       const formData = new FormData();
       formData.append('scan_type', type);
-      formData.append('image_data', base64Image);
+      formData.append('image', selectedFile);
 
       const response = await axios.post(`${API}/scans`, formData, {
         headers: {
@@ -721,7 +737,8 @@ const ScanPage = () => {
         },
       });
 
-      setReport(response.data);
+      setPreviewUrl(URL.createObjectURL(selectedFile));
+      setReport(await waitForAnalysis(response.data));
       setSelectedFile(null);
     } catch (error) {
       console.error('Upload error:', error);
@@ -839,7 +856,7 @@ const ScanPage = () => {
                   Uploaded Image
                 </h3>
                 <img
-                  src={report.image_data}
+                  src={report.image_data || previewUrl}
                   alt="Uploaded scan"
                   className="max-w-full h-auto max-h-96 object-contain rounded-lg border"
                 />
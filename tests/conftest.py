@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py reads these at import; keep tests off real services and disks
+os.environ.setdefault("MONGO_URL", "mongomock://localhost")
+os.environ.setdefault("DB_NAME", "radiologix_test")
+os.environ.setdefault("BLOB_STORE_PATH", tempfile.mkdtemp(prefix="radiologix-test-blobs-"))
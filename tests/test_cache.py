@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import cache
+from cache import AnalysisResultCache, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_entries_expire_after_the_ttl(clock):
+    lru = TTLCache(ttl=10)
+    lru.set("a", 1)
+    clock.now += 9.9
+    assert lru.get("a") == 1
+    clock.now += 0.2
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    lru = TTLCache(maxsize=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+    assert (lru.get("a"), lru.get("b"), lru.get("c")) == (1, None, 3)
+    assert lru.evictions == 1
+
+
+def test_setting_again_refreshes_the_ttl(clock):
+    lru = TTLCache(ttl=10)
+    lru.set("a", 1)
+    clock.now += 8
+    lru.set("a", 2)
+    clock.now += 8
+    assert lru.get("a") == 2
+
+
+def test_discard_and_clear(clock):
+    lru = TTLCache()
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.discard("a")
+    lru.discard("missing")
+    assert (lru.get("a"), lru.get("b")) == (None, 2)
+    lru.clear()
+    assert len(lru) == 0
+
+
+def test_hit_and_miss_counters(clock):
+    lru = TTLCache(ttl=10)
+    lru.get("a")
+    lru.set("a", 1)
+    lru.get("a")
+    lru.get("a")
+    clock.now += 11
+    lru.get("a")
+    stats = lru.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 2, 0.5)
+
+
+def test_analysis_results_come_from_memory_then_store_then_miss():
+    async def scenario():
+        collection = AsyncMongoMockClient()["test"]["analysis_results"]
+        results = AnalysisResultCache(collection)
+        assert await results.get("img", "ct", "v1") is None
+        await results.set("img", "ct", "v1", "report")
+        assert await results.get("img", "ct", "v1") == "report"
+
+        # A fresh worker finds it in the shared store, then keeps it in memory
+        other = AnalysisResultCache(collection)
+        assert await other.get("img", "ct", "v1") == "report"
+        assert await other.get("img", "ct", "v1") == "report"
+        # Any part of the key differing is a miss
+        assert await other.get("img", "ct", "v2") is None
+        assert await other.get("img", "mri", "v1") is None
+        assert await collection.count_documents({}) == 1
+        return results.stats(), other.stats()
+
+    first, second = run(scenario())
+    assert (first["memory"]["hits"], first["store_hits"], first["misses"]) == (1, 0, 1)
+    assert (second["memory"]["hits"], second["store_hits"], second["misses"]) == (1, 1, 2)
+    assert second["hit_rate"] == 0.5
+
+
+def test_setting_a_result_again_replaces_it():
+    async def scenario():
+        collection = AsyncMongoMockClient()["test"]["analysis_results"]
+        results = AnalysisResultCache(collection)
+        await results.set("img", "ct", "v1", "old")
+        await results.set("img", "ct", "v1", "new")
+        assert await AnalysisResultCache(collection).get("img", "ct", "v1") == "new"
+        return await collection.count_documents({})
+
+    assert run(scenario()) == 1
@@ -0,0 +1,140 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+from compression import CompressionMiddleware, negotiate
+
+SUPPORTED = ["br", "zstd", "gzip"]
+
+
+def test_negotiate_picks_highest_q_value():
+    assert negotiate("gzip;q=1.0, br;q=0.5", SUPPORTED) == "gzip"
+    assert negotiate("gzip; q=0.2, zstd ;q=0.8", SUPPORTED) == "zstd"
+
+
+def test_negotiate_ties_go_to_server_preference():
+    assert negotiate("gzip, br", SUPPORTED) == "br"
+    assert negotiate("GZIP, Zstd", SUPPORTED) == "zstd"
+
+
+def test_negotiate_wildcard_covers_unlisted_encodings():
+    assert negotiate("*", SUPPORTED) == "br"
+    assert negotiate("br;q=0, *;q=0.5", SUPPORTED) == "zstd"
+    assert negotiate("gzip;q=0.4, *;q=0.5", ["gzip", "zstd"]) == "zstd"
+
+
+def test_negotiate_finds_nothing_acceptable():
+    assert negotiate("", SUPPORTED) is None
+    assert negotiate("identity", SUPPORTED) is None
+    assert negotiate("gzip;q=0", SUPPORTED) is None
+    assert negotiate("*;q=0", SUPPORTED) is None
+    assert negotiate("gzip;q=bogus", SUPPORTED) is None
+    assert negotiate("deflate", ["gzip"]) is None
+
+
+def app_sending(status, headers, chunks):
+    """An ASGI app sending ``chunks`` as the body; a single chunk gets a Content-Length."""
+
+    async def app(scope, receive, send):
+        raw = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+        if len(chunks) == 1:
+            raw.append((b"content-length", str(len(chunks[0])).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": raw})
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+
+    return app
+
+
+def call(app, accept_encoding="gzip", **options):
+    middleware = CompressionMiddleware(app, encodings=("gzip",), **options)
+    scope = {"type": "http", "method": "GET", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    start = messages[0]
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    return start["status"], headers, [message.get("body", b"") for message in messages[1:]]
+
+
+JSON = {"content-type": "application/json"}
+BIG = b'{"report": "' + b"no abnormality detected " * 200 + b'"}'
+
+
+def test_known_length_body_is_compressed_whole():
+    status, headers, bodies = call(app_sending(200, JSON, [BIG]))
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert len(bodies) == 1
+    assert headers["content-length"] == str(len(bodies[0]))
+    assert gzip.decompress(bodies[0]) == BIG
+
+
+def test_body_below_min_bytes_passes_through():
+    body = b'{"ok": true}'
+    status, headers, bodies = call(app_sending(200, JSON, [body]), min_bytes=1024)
+    assert "content-encoding" not in headers
+    assert headers["content-length"] == str(len(body))
+    assert bodies == [body]
+
+
+def test_short_stream_passes_through_once_it_ends():
+    chunks = [b'{"a": 1}\n', b'{"b": 2}\n']
+    status, headers, bodies = call(app_sending(200, {"content-type": "application/x-ndjson"}, chunks))
+    assert "content-encoding" not in headers
+    assert b"".join(bodies) == b"".join(chunks)
+
+
+def test_streamed_ndjson_is_flushed_line_by_line():
+    lines = [b'{"id": "%d", "report": "%s"}\n' % (i, b"x" * 300) for i in range(10)]
+    status, headers, bodies = call(
+        app_sending(200, {"content-type": "application/x-ndjson"}, lines), min_bytes=1024
+    )
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    # The first four lines reach min_bytes and go out together; after that
+    # every line is flushed as it comes
+    assert len(bodies) == 1 + 6
+    decoder = zlib.decompressobj(31)
+    seen = b""
+    for body in bodies[:-1]:
+        seen += decoder.decompress(body)
+        assert seen.endswith(b"\n")
+    seen += decoder.decompress(bodies[-1]) + decoder.flush()
+    assert seen == b"".join(lines)
+
+
+@pytest.mark.parametrize("etag, expected", [('"abc"', 'W/"abc"'), ('W/"abc"', 'W/"abc"')])
+def test_compressed_response_has_weak_etag(etag, expected):
+    status, headers, bodies = call(app_sending(200, {**JSON, "etag": etag}, [BIG]))
+    assert headers["content-encoding"] == "gzip"
+    assert headers["etag"] == expected
+
+
+def test_uncompressed_response_keeps_strong_etag():
+    status, headers, bodies = call(app_sending(200, {**JSON, "etag": '"abc"'}, [BIG]), accept_encoding="identity")
+    assert headers["etag"] == '"abc"'
+    assert bodies == [BIG]
+
+
+@pytest.mark.parametrize("status, headers", [
+    (200, {"content-type": "image/png"}),
+    (200, {"content-type": "text/event-stream"}),
+    (200, {**JSON, "content-encoding": "br"}),
+    (206, JSON),
+    (304, JSON),
+])
+def test_skipped_responses_pass_through(status, headers):
+    sent_status, sent_headers, bodies = call(app_sending(status, headers, [BIG]))
+    assert sent_status == status
+    assert sent_headers.get("content-encoding") == headers.get("content-encoding")
+    assert bodies == [BIG]
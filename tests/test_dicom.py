@@ -0,0 +1,164 @@
+import asyncio
+import io
+import zipfile
+
+import numpy as np
+import pydicom
+import pytest
+from fastapi import HTTPException
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from starlette.datastructures import UploadFile
+
+import dicom
+from server import spool_dicom_sources
+
+
+def zip_upload(members, compression=zipfile.ZIP_DEFLATED) -> UploadFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    buffer.seek(0)
+    return UploadFile(file=buffer, filename="study.zip")
+
+
+def spool(archive, tmp_path, **limits):
+    return asyncio.run(spool_dicom_sources([], archive, tmp_path, **limits))
+
+
+def test_spool_writes_every_member(tmp_path):
+    paths, skipped = spool(zip_upload({"a.dcm": b"a" * 10, "b.dcm": b"b" * 20}), tmp_path)
+    assert [(name, path.read_bytes()) for name, path in paths] == [("a.dcm", b"a" * 10), ("b.dcm", b"b" * 20)]
+    assert skipped == []
+
+
+def test_spool_refuses_a_member_over_the_file_limit(tmp_path):
+    # Compresses to a few kilobytes
+    archive = zip_upload({"bomb.dcm": bytes(4 * 1024 * 1024)})
+    with pytest.raises(HTTPException) as e:
+        spool(archive, tmp_path, max_file_bytes=1024 * 1024)
+    assert e.value.status_code == 413
+
+
+def test_spool_refuses_an_upload_over_the_total_limit(tmp_path):
+    archive = zip_upload({f"{i}.dcm": bytes(1024 * 1024) for i in range(3)})
+    with pytest.raises(HTTPException) as e:
+        spool(archive, tmp_path, max_total_bytes=2 * 1024 * 1024)
+    assert e.value.status_code == 413
+
+
+def test_spool_skips_a_corrupt_member(tmp_path):
+    archive = zip_upload({"good.dcm": b"g" * 1000, "bad.dcm": bytes(range(256)) * 400})
+    data = bytearray(archive.file.getvalue())
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as zf:
+        info = zf.getinfo("bad.dcm")
+    # Damage the deflate stream past the local header
+    start = info.header_offset + 30 + len(info.filename) + len(info.extra)
+    data[start:start + 64] = b"\xff" * 64
+    paths, skipped = spool(UploadFile(file=io.BytesIO(bytes(data)), filename="study.zip"), tmp_path)
+    assert [name for name, _ in paths] == ["good.dcm"]
+    assert skipped == ["bad.dcm"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["000000.dcm"]
+
+
+def test_spool_rejects_an_archive_that_is_not_a_zip(tmp_path):
+    with pytest.raises(HTTPException) as e:
+        spool(UploadFile(file=io.BytesIO(b"not a zip"), filename="study.zip"), tmp_path)
+    assert e.value.status_code == 400
+
+
+def write_dicom(path, series_uid, instance, pixels, position=None, sop_uid=None, slope=1.0):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    meta.MediaStorageSOPInstanceUID = sop_uid or generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(str(path), {}, file_meta=meta, preamble=b"\0" * 128)
+    if int(pydicom.__version__.split(".")[0]) < 3:
+        ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = "1.2.826.0.1.1"
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = "CT"
+    ds.InstanceNumber = instance
+    if position is not None:
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0, 0, position]
+    ds.RescaleSlope = slope
+    ds.RescaleIntercept = -1024
+    ds.Rows, ds.Columns = pixels.shape
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 16, 15
+    ds.PixelRepresentation = 1
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.PixelData = pixels.astype(np.int16).tobytes()
+    ds.save_as(str(path))
+    return path
+
+
+def frame(value, shape=(2, 3)):
+    return np.full(shape, value, dtype=np.int16)
+
+
+def headers(paths):
+    return [dicom.read_header(path) for path in paths]
+
+
+def test_read_header_skips_files_that_are_not_dicom_images(tmp_path):
+    text = tmp_path / "notes.txt"
+    text.write_text("not a scan")
+    assert dicom.read_header(text) is None
+    image = write_dicom(tmp_path / "a.dcm", "1.2.3", 1, frame(5))
+    header = dicom.read_header(image)
+    assert (header.series_uid, header.rows, header.columns, header.dtype) == ("1.2.3", 2, 3, "<i2")
+
+
+def test_series_are_grouped_and_ordered_by_slice_position(tmp_path):
+    # Instance numbers run against the positions; position wins
+    positioned = [write_dicom(tmp_path / f"p{i}.dcm", "1.2.3", 10 - i, frame(i), position=float(i) * 2.5)
+                  for i in (2, 0, 1)]
+    # Without positions, instance numbers order the slices
+    numbered = [write_dicom(tmp_path / f"n{i}.dcm", "1.2.4", i, frame(10 + i)) for i in (3, 1, 2)]
+    series = {s.series_uid: s for s in dicom.group_series(headers([*positioned, *numbered]))}
+    assert [f.path.name for f in series["1.2.3"].files] == ["p0.dcm", "p1.dcm", "p2.dcm"]
+    assert [f.path.name for f in series["1.2.4"].files] == ["n1.dcm", "n2.dcm", "n3.dcm"]
+    assert series["1.2.3"].metadata()["slice_positions"] == [0.0, 2.5, 5.0]
+
+
+def test_duplicate_instances_are_counted_once(tmp_path):
+    uid = generate_uid()
+    files = [write_dicom(tmp_path / f"{i}.dcm", "1.2.3", 1, frame(1), sop_uid=uid) for i in range(2)]
+    (series,) = dicom.group_series(headers(files))
+    assert series.frames == 1
+
+
+def test_series_mixing_frame_sizes_is_rejected(tmp_path):
+    files = [
+        write_dicom(tmp_path / "a.dcm", "1.2.3", 1, frame(1)),
+        write_dicom(tmp_path / "b.dcm", "1.2.3", 2, frame(1, shape=(4, 4))),
+    ]
+    with pytest.raises(ValueError):
+        dicom.group_series(headers(files))
+
+
+def test_volume_is_a_memory_mapped_npy_of_ordered_frames(tmp_path):
+    files = [write_dicom(tmp_path / f"{i}.dcm", "1.2.3", i, frame(i * 100), position=float(i), slope=i + 1)
+             for i in (1, 0, 2)]
+    (series,) = dicom.group_series(headers(files))
+    path = tmp_path / "volume.npy"
+    dicom.write_volume(series, path)
+
+    volume = dicom.open_volume(path)
+    assert isinstance(volume, np.memmap)
+    assert (volume.shape, volume.dtype) == ((3, 2, 3), np.int16)
+    assert [int(volume[i, 0, 0]) for i in range(3)] == [0, 100, 200]
+    metadata = series.metadata()
+    assert metadata["rescale_slopes"] == [1.0, 2.0, 3.0]
+    assert metadata["rescale_intercepts"] == [-1024.0] * 3
+
+    # What the frame and volume routes serve
+    assert np.array_equal(np.load(io.BytesIO(dicom.frame_npy(path, 2))), frame(200))
+    streamed = dicom.npy_header(volume.dtype, volume.shape) + b"".join(volume[i].tobytes() for i in range(3))
+    assert np.array_equal(np.load(io.BytesIO(streamed)), volume)
+    png = dicom.frame_png(path, metadata, 1)
+    assert png.startswith(b"\x89PNG")
@@ -0,0 +1,34 @@
+import csv
+import io
+from datetime import datetime
+
+from export import EXPORT_FIELDS, CsvExport
+
+
+def rows(data: bytes):
+    return list(csv.reader(io.StringIO(data.decode("utf-8"))))
+
+
+def test_csv_neutralises_formula_cells():
+    export = CsvExport()
+    row = {field: None for field in EXPORT_FIELDS}
+    row.update(ai_report="=HYPERLINK(\"http://x\")", scan_type="@SUM(A1)", user_id="-1+2", id="+1", image_size=-5)
+    (cells,) = rows(export.write([row]))
+    values = dict(zip(EXPORT_FIELDS, cells))
+    assert values["ai_report"] == "'=HYPERLINK(\"http://x\")"
+    assert values["scan_type"] == "'@SUM(A1)"
+    assert values["user_id"] == "'-1+2"
+    assert values["id"] == "'+1"
+    # Only text is touched; numbers stay numbers
+    assert values["image_size"] == "-5"
+
+
+def test_csv_leaves_plain_values_alone():
+    export = CsvExport()
+    row = {field: None for field in EXPORT_FIELDS}
+    row.update(ai_report="Normal study", created_at=datetime(2024, 1, 2, 3, 4, 5))
+    (cells,) = rows(export.write([row]))
+    values = dict(zip(EXPORT_FIELDS, cells))
+    assert values["ai_report"] == "Normal study"
+    assert values["created_at"] == "2024-01-02T03:04:05"
+    assert values["image_ref"] == ""
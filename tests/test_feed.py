@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from feed import PollingFeed, decode_token, encode_token
+
+FIELDS = ["scan_type", "analysis_status"]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_feed():
+    collection = AsyncMongoMockClient()["test"]["scan_reports"]
+    return PollingFeed(collection, FIELDS, interval=0.01, batch_size=2), collection
+
+
+def report(scan_id, when, user_id="u1", status="pending", created=None):
+    return {
+        "id": scan_id, "user_id": user_id, "scan_type": "xray", "analysis_status": status,
+        "created_at": created or when, "updated_at": when,
+    }
+
+
+async def take(changes, polls=3):
+    """The changes a feed yields until it has been idle for ``polls`` polls."""
+    received = []
+    idle = 0
+    while idle < polls:
+        change = await asyncio.wait_for(changes.__anext__(), 5)
+        if change is None:
+            idle += 1
+        else:
+            idle = 0
+            received.append(change)
+    return received
+
+
+def test_new_feed_starts_with_ready_then_sends_inserts_and_updates():
+    async def scenario():
+        feed, collection = make_feed()
+        await collection.insert_one(report("old", datetime.utcnow() - timedelta(minutes=1)))
+        changes = feed.changes("u1")
+        ready = await changes.__anext__()
+        assert ready.op == "ready" and ready.scan is None
+        assert await take(changes) == []
+
+        now = datetime.utcnow() + timedelta(milliseconds=5)
+        await collection.insert_one(report("s1", now))
+        await collection.insert_one(report("other-user", now, user_id="u2"))
+        inserted = await take(changes)
+        assert [(c.op, c.scan["id"], c.scan["analysis_status"]) for c in inserted] == [("insert", "s1", "pending")]
+
+        await collection.update_one(
+            {"id": "s1"}, {"$set": {"analysis_status": "completed", "updated_at": now + timedelta(seconds=1)}}
+        )
+        updated = await take(changes)
+        assert [(c.op, c.scan["analysis_status"]) for c in updated] == [("update", "completed")]
+        return feed
+
+    assert run(scenario()).changes_sent == 2
+
+
+def test_resume_sends_what_changed_after_the_token():
+    async def scenario():
+        feed, collection = make_feed()
+        start = datetime(2024, 1, 1)
+        for i in range(5):
+            await collection.insert_one(report(f"s{i}", start + timedelta(minutes=i)))
+        token = encode_token({"t": (start + timedelta(minutes=2)).isoformat(), "id": "s2"})
+        return await take(feed.changes("u1", token))
+
+    assert [change.scan["id"] for change in run(scenario())] == ["s3", "s4"]
+
+
+def test_tokens_advance_with_each_change():
+    async def scenario():
+        feed, collection = make_feed()
+        start = datetime(2024, 1, 1)
+        for i in range(3):
+            await collection.insert_one(report(f"s{i}", start + timedelta(minutes=i)))
+        token = encode_token({"t": (start - timedelta(minutes=1)).isoformat(), "id": ""})
+        return await take(feed.changes("u1", token))
+
+    changes = run(scenario())
+    assert [decode_token(change.token)["id"] for change in changes] == ["s0", "s1", "s2"]
+
+
+def test_late_commit_behind_the_position_is_still_delivered_once():
+    async def scenario():
+        feed, collection = make_feed()
+        now = datetime.utcnow()
+        await collection.insert_one(report("fast", now))
+        changes = feed.changes("u1", encode_token({"t": (now - timedelta(seconds=1)).isoformat(), "id": ""}))
+        first = await take(changes)
+        # A slower writer commits a timestamp the feed has already passed
+        await collection.insert_one(report("slow", now - timedelta(milliseconds=500)))
+        second = await take(changes)
+        return first, second
+
+    first, second = run(scenario())
+    assert [change.scan["id"] for change in first] == ["fast"]
+    assert [change.scan["id"] for change in second] == ["slow"]
+
+
+@pytest.mark.parametrize("token", ["not-a-token", encode_token({"t": "yesterday", "id": "x"}), encode_token(["t"])])
+def test_unusable_token_resets_the_client(token):
+    async def scenario():
+        feed, collection = make_feed()
+        changes = feed.changes("u1", token)
+        reset = await changes.__anext__()
+        assert reset.op == "reset"
+        assert decode_token(reset.token)["id"] == ""
+        return feed
+
+    assert run(scenario()).resets == 1
@@ -0,0 +1,104 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server
+from server import etag_matches, if_range_matches, parse_byte_range
+
+ETAG = '"abc123"'
+
+
+def test_etag_matches_exact_weak_list_and_star():
+    assert etag_matches(ETAG, ETAG)
+    assert etag_matches('W/"abc123"', ETAG)
+    assert etag_matches('"other", W/"abc123"', ETAG)
+    assert etag_matches(" * ", ETAG)
+
+
+def test_etag_matches_rejects_missing_and_different():
+    assert not etag_matches(None, ETAG)
+    assert not etag_matches("", ETAG)
+    assert not etag_matches('"abc"', ETAG)
+
+
+def test_byte_range_closed():
+    assert parse_byte_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_byte_range("bytes=10-10", 1000) == (10, 10)
+
+
+def test_byte_range_open_ended():
+    assert parse_byte_range("bytes=500-", 1000) == (500, 999)
+
+
+def test_byte_range_end_clamped_to_size():
+    assert parse_byte_range("bytes=900-5000", 1000) == (900, 999)
+
+
+def test_byte_range_suffix():
+    assert parse_byte_range("bytes=-100", 1000) == (900, 999)
+    # Longer than the body: the whole body
+    assert parse_byte_range("bytes=-5000", 1000) == (0, 999)
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-1", "bytes=0-1,5-6", "bytes=a-b", "bytes=-", "bytes=50-10"])
+def test_byte_range_unsupported_serves_whole_body(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=-0"])
+def test_byte_range_not_satisfiable(header):
+    with pytest.raises(HTTPException) as e:
+        parse_byte_range(header, 1000)
+    assert e.value.status_code == 416
+    assert e.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_if_range_without_header_keeps_range():
+    assert if_range_matches(None, ETAG)
+    assert if_range_matches("", ETAG)
+
+
+def test_if_range_needs_strong_match():
+    assert if_range_matches(' "abc123" ', ETAG)
+    assert not if_range_matches('W/"abc123"', ETAG)
+    assert not if_range_matches('"stale"', ETAG)
+    assert not if_range_matches("Wed, 21 Oct 2015 07:28:00 GMT", ETAG)
+
+
+@pytest.fixture
+def image_scan():
+    user = server.User(email="viewer@example.com", name="Viewer", password_hash="x")
+    data = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+    blob = asyncio.run(server.blob_store.put(data, "image/png"))
+    scan = {
+        "id": str(uuid.uuid4()), "user_id": user.id, "scan_type": "xray",
+        "image_ref": blob.key, "image_size": blob.size, "image_content_type": blob.content_type,
+    }
+    asyncio.run(server.db.scan_reports.insert_one(dict(scan)))
+    server.app.dependency_overrides[server.get_current_user] = lambda: user
+    yield TestClient(server.app), f"/api/scans/{scan['id']}/image", data, f'"{blob.key}"'
+    server.app.dependency_overrides.clear()
+
+
+def test_image_range_request_gets_partial_content(image_scan):
+    client, url, data, etag = image_scan
+    response = client.get(url, headers={"Range": "bytes=0-7", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.content == data[:8]
+
+
+def test_stale_if_range_serves_the_whole_image_even_for_an_unsatisfiable_range(image_scan):
+    client, url, data, _ = image_scan
+    response = client.get(url, headers={"Range": f"bytes={len(data) + 10}-", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == data
+
+
+def test_invalid_range_serves_the_whole_image(image_scan):
+    client, url, data, _ = image_scan
+    response = client.get(url, headers={"Range": "bytes=50-10"})
+    assert response.status_code == 200
+    assert response.content == data
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from analysis import Analyzer, InferenceEngine, PlaceholderAnalyzer, parse_backends
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class RecordingAnalyzer(Analyzer):
+    name = "recording"
+    version = "recording-1"
+
+    def __init__(self, error=None, gate=None):
+        self.batches = []
+        self.error = error
+        self.gate = gate
+
+    def predict_batch(self, scan_types, images):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(scan_types))
+        if self.error is not None:
+            raise self.error
+        return [f"{scan_type}:{image.sum():g}" for scan_type, image in zip(scan_types, images)]
+
+
+def image(value):
+    return np.full((2, 2), value, dtype=np.float32)
+
+
+def engine(analyzer, **options):
+    return InferenceEngine({"ct": analyzer}, PlaceholderAnalyzer(), **options)
+
+
+def test_requests_within_max_wait_share_a_batch_up_to_max_batch_size():
+    async def scenario():
+        analyzer = RecordingAnalyzer()
+        inference = engine(analyzer, max_batch_size=3, max_wait_ms=200)
+        reports = await asyncio.gather(*(inference.analyze("ct", image(i)) for i in range(5)))
+        await inference.stop()
+        return analyzer, reports
+
+    analyzer, reports = run(scenario())
+    assert reports == ["ct:0", "ct:4", "ct:8", "ct:12", "ct:16"]
+    assert [len(batch) for batch in analyzer.batches] == [3, 2]
+
+
+def test_scan_types_without_a_backend_use_the_default():
+    async def scenario():
+        inference = engine(RecordingAnalyzer(), max_wait_ms=1)
+        report = await inference.analyze("MRI", image(0))
+        await inference.stop()
+        return inference, report
+
+    inference, report = run(scenario())
+    assert report.startswith("AI Analysis for MRI scan")
+    assert inference.model_version("mri") == "placeholder-1"
+    assert inference.model_version("CT") == "recording-1"
+
+
+def test_a_failing_batch_fails_every_request_in_it():
+    async def scenario():
+        inference = engine(RecordingAnalyzer(error=RuntimeError("boom")), max_batch_size=4, max_wait_ms=200)
+        results = await asyncio.gather(*(inference.analyze("ct", image(i)) for i in range(3)), return_exceptions=True)
+        await inference.stop()
+        return results
+
+    results = run(scenario())
+    assert len(results) == 3
+    assert all(isinstance(result, RuntimeError) and str(result) == "boom" for result in results)
+
+
+def test_cancelled_requests_are_dropped_from_the_batch():
+    async def scenario():
+        analyzer = RecordingAnalyzer()
+        inference = engine(analyzer, max_batch_size=4, max_wait_ms=100)
+        cancelled = asyncio.create_task(inference.analyze("ct", image(1)))
+        kept = asyncio.create_task(inference.analyze("ct", image(2)))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        report = await kept
+        await inference.stop()
+        return analyzer, report, cancelled
+
+    analyzer, report, cancelled = run(scenario())
+    assert report == "ct:8"
+    assert cancelled.cancelled()
+    assert analyzer.batches == [["ct"]]
+
+
+def test_idle_batcher_retires_and_restarts_on_demand():
+    async def scenario():
+        analyzer = RecordingAnalyzer()
+        inference = engine(analyzer, max_wait_ms=1, idle_seconds=0.05)
+        assert await inference.analyze("ct", image(1)) == "ct:4"
+        assert analyzer in inference._batchers
+        await asyncio.sleep(0.2)
+        assert analyzer not in inference._batchers and analyzer not in inference._queues
+        assert await inference.analyze("ct", image(2)) == "ct:8"
+        await inference.stop()
+        return analyzer
+
+    assert len(run(scenario()).batches) == 2
+
+
+def test_stats_report_queues_and_batch_sizes():
+    async def scenario():
+        gate = threading.Event()
+        inference = engine(RecordingAnalyzer(gate=gate), max_wait_ms=1)
+        pending = asyncio.create_task(inference.analyze("ct", image(1)))
+        await asyncio.sleep(0.05)
+        stats = inference.stats()
+        gate.set()
+        await pending
+        await inference.stop()
+        return inference, stats
+
+    inference, stats = run(scenario())
+    assert stats["queued"] == {"recording-1": 0}
+    assert inference.stats()["queued"] == {}
+    assert inference.stats()["batch_size"]["count"] == 1
+
+
+@pytest.mark.parametrize("spec", ["ct", "ct=onnx", "ct=tflite:/m.tflite"])
+def test_parse_backends_rejects_invalid_entries(spec):
+    with pytest.raises(ValueError):
+        parse_backends(spec)
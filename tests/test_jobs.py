@@ -0,0 +1,185 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from jobs import COMPLETED, FAILED, PENDING, RUNNING, AnalysisQueue, QueueFull
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def scan(scan_id):
+    return {"id": scan_id, "user_id": "u1", "scan_type": "xray", "image_ref": f"ref-{scan_id}"}
+
+
+async def make_queue(analyze=None, db=None, **options):
+    db = db if db is not None else AsyncMongoMockClient()["test"]
+
+    async def placeholder(job):
+        return "report"
+
+    queue = AnalysisQueue(db, analyze or placeholder, retry_backoff_seconds=0, **options)
+    return queue, db
+
+
+async def submit(queue, db, scan_id):
+    await db.scan_reports.insert_one({**scan(scan_id), "analysis_status": PENDING})
+    return await queue.enqueue(scan(scan_id))
+
+
+def test_claim_takes_each_available_job_once():
+    async def scenario():
+        queue, db = await make_queue()
+        first = await submit(queue, db, "s1")
+        await submit(queue, db, "s2")
+        claimed = [await queue._claim(), await queue._claim(), await queue._claim()]
+        assert claimed[0]["id"] == first["id"]
+        assert {job["scan_id"] for job in claimed[:2]} == {"s1", "s2"}
+        assert claimed[2] is None
+        assert all(job["status"] == RUNNING and job["attempts"] == 1 for job in claimed[:2])
+        assert all(job["worker_id"] == queue.worker_id for job in claimed[:2])
+
+    run(scenario())
+
+
+def test_claim_skips_jobs_waiting_for_backoff():
+    async def scenario():
+        queue, db = await make_queue()
+        job = await submit(queue, db, "s1")
+        await db.analysis_jobs.update_one({"id": job["id"]}, {"$set": {"available_at": datetime.utcnow() + timedelta(hours=1)}})
+        assert await queue._claim() is None
+
+    run(scenario())
+
+
+def test_expired_lease_is_reclaimed_by_another_worker():
+    async def scenario():
+        queue, db = await make_queue()
+        other, _ = await make_queue(db=db)
+        await submit(queue, db, "s1")
+        job = await queue._claim()
+        assert await other._claim() is None
+        await db.analysis_jobs.update_one({"id": job["id"]}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+        reclaimed = await other._claim()
+        assert reclaimed["id"] == job["id"]
+        assert reclaimed["worker_id"] == other.worker_id
+        assert reclaimed["attempts"] == 2
+
+    run(scenario())
+
+
+def test_worker_that_lost_its_lease_does_not_write_the_result():
+    async def scenario():
+        queue, db = await make_queue()
+        other, _ = await make_queue(db=db)
+        await submit(queue, db, "s1")
+        job = await queue._claim()
+        await db.analysis_jobs.update_one({"id": job["id"]}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+        await other._claim()
+        await queue._run_job(job)
+        stored = await db.analysis_jobs.find_one({"id": job["id"]})
+        assert stored["status"] == RUNNING and stored["worker_id"] == other.worker_id
+        assert (await db.scan_reports.find_one({"id": "s1"})).get("ai_report") is None
+        assert queue.completed == 0
+
+    run(scenario())
+
+
+def test_successful_job_completes_the_scan():
+    async def scenario():
+        queue, db = await make_queue()
+        await submit(queue, db, "s1")
+        await queue._run_job(await queue._claim())
+        assert (await db.analysis_jobs.find_one({"scan_id": "s1"}))["status"] == COMPLETED
+        stored_scan = await db.scan_reports.find_one({"id": "s1"})
+        assert (stored_scan["analysis_status"], stored_scan["ai_report"]) == (COMPLETED, "report")
+        assert queue.completed == 1
+
+    run(scenario())
+
+
+def test_failures_are_retried_with_backoff_then_fail_permanently():
+    async def scenario():
+        async def broken(job):
+            raise RuntimeError("model exploded")
+
+        queue, db = await make_queue(broken, max_attempts=3)
+        queue.retry_backoff_seconds = 10
+        job = await submit(queue, db, "s1")
+        delays = []
+        for _ in range(2):
+            claimed = await queue._claim()
+            before = datetime.utcnow()
+            await queue._run_job(claimed)
+            stored = await db.analysis_jobs.find_one({"id": job["id"]})
+            assert stored["status"] == PENDING
+            assert stored["error"] == "RuntimeError: model exploded"
+            delays.append(round((stored["available_at"] - before).total_seconds()))
+            # Skip the wait
+            await db.analysis_jobs.update_one({"id": job["id"]}, {"$set": {"available_at": datetime.utcnow()}})
+        assert delays == [10, 20]
+
+        await queue._run_job(await queue._claim())
+        stored = await db.analysis_jobs.find_one({"id": job["id"]})
+        assert (stored["status"], stored["attempts"]) == (FAILED, 3)
+        assert (await db.scan_reports.find_one({"id": "s1"}))["analysis_status"] == FAILED
+        assert (queue.retried, queue.failed) == (2, 1)
+        assert await queue._claim() is None
+
+    run(scenario())
+
+
+def test_stop_hands_interrupted_jobs_back_without_counting_the_attempt():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def slow(job):
+            started.set()
+            await asyncio.sleep(60)
+
+        queue, db = await make_queue(slow, concurrency=1, poll_interval=0.01)
+        job = await submit(queue, db, "s1")
+        await queue.start()
+        await asyncio.wait_for(started.wait(), 5)
+        await queue.stop(drain_timeout=0.05)
+        stored = await db.analysis_jobs.find_one({"id": job["id"]})
+        assert (stored["status"], stored["attempts"], stored["locked_until"]) == (PENDING, 0, None)
+        assert (await db.scan_reports.find_one({"id": "s1"}))["analysis_status"] == PENDING
+        assert queue.active == 0
+
+    run(scenario())
+
+
+def test_stop_lets_running_jobs_finish_within_the_drain_timeout():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def quick(job):
+            started.set()
+            await asyncio.sleep(0.05)
+            return "done"
+
+        queue, db = await make_queue(quick, concurrency=1, poll_interval=0.01)
+        job = await submit(queue, db, "s1")
+        await queue.start()
+        await asyncio.wait_for(started.wait(), 5)
+        await queue.stop(drain_timeout=5)
+        assert (await db.analysis_jobs.find_one({"id": job["id"]}))["status"] == COMPLETED
+
+    run(scenario())
+
+
+def test_check_capacity_refuses_work_beyond_max_pending():
+    async def scenario():
+        queue, db = await make_queue(max_pending=2)
+        await submit(queue, db, "s1")
+        await queue.check_capacity()
+        await submit(queue, db, "s2")
+        assert await queue.remaining_capacity() == 0
+        with pytest.raises(QueueFull):
+            await queue.check_capacity()
+
+    run(scenario())
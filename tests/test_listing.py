@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+@pytest.fixture
+def user():
+    return server.User(email="reader@example.com", name="Reader", password_hash="x")
+
+
+@pytest.fixture
+def client(user):
+    server.app.dependency_overrides[server.get_current_user] = lambda: user
+    yield TestClient(server.app)
+    server.app.dependency_overrides.clear()
+
+
+def add_scans(user, count, tied=3):
+    """``count`` scans, the first ``tied`` of them created at the same instant; newest first."""
+    start = datetime(2024, 1, 1)
+    scans = [
+        {
+            "id": f"scan-{i:02d}-{uuid.uuid4().hex[:6]}",
+            "user_id": user.id,
+            "scan_type": "xray",
+            "analysis_status": "completed",
+            "created_at": start if i < tied else start + timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+    asyncio.run(server.db.scan_reports.insert_many([dict(scan) for scan in scans]))
+    return [scan["id"] for scan in sorted(scans, key=lambda s: (s["created_at"], s["id"]), reverse=True)]
+
+
+def cursor_for(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+def test_pages_cover_every_scan_once_across_created_at_ties(client, user):
+    expected = add_scans(user, 7, tied=4)
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/scans", params=params)
+        assert response.status_code == 200
+        seen += [scan["id"] for scan in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == expected
+    assert pages == 4
+
+
+def test_last_full_page_has_no_next_cursor(client, user):
+    add_scans(user, 4)
+    first = client.get("/api/scans", params={"limit": 2})
+    last = client.get("/api/scans", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+    assert len(last.json()) == 2
+    assert "X-Next-Cursor" not in last.headers
+
+
+@pytest.mark.parametrize("cursor", [
+    "!!!",
+    cursor_for({"created_at": "2024-01-01"}),
+    cursor_for(["not a date", "scan-1"]),
+    cursor_for(["2024-01-01T00:00:00"]),
+])
+def test_invalid_cursor_is_rejected(client, cursor):
+    response = client.get("/api/scans", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_fields_trim_the_summary_and_unknown_fields_are_rejected(client, user):
+    add_scans(user, 1)
+    response = client.get("/api/scans", params={"fields": "scan_type"})
+    assert set(response.json()[0]) == {"id", "scan_type", "created_at"}
+    response = client.get("/api/scans", params={"fields": "scan_type,password_hash"})
+    assert response.status_code == 400
+    assert "password_hash" in response.json()["detail"]
+
+
+def test_json_pages_are_capped_unless_streaming(client):
+    assert client.get("/api/scans", params={"limit": server.SCANS_PAGE_MAX + 1}).status_code == 400
+
+
+def ndjson_lines(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_ndjson_pages_end_with_the_next_cursor(client, user):
+    expected = add_scans(user, 5)
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        lines = ndjson_lines(client.get("/api/scans", params=params, headers=NDJSON))
+        cursor = lines[-1].get("next_cursor") if lines and "next_cursor" in lines[-1] else None
+        seen += [line["id"] for line in lines if "id" in line]
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_ndjson_last_page_carries_no_cursor(client, user):
+    add_scans(user, 2)
+    lines = ndjson_lines(client.get("/api/scans", params={"limit": 2}, headers=NDJSON))
+    assert len(lines) == 2
+    assert all("next_cursor" not in line for line in lines)
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from database import PoolMonitor
+from metrics import Counter, Histogram, Labelled, PrometheusWriter
+
+
+def render(component, stats):
+    writer = PrometheusWriter("test")
+    writer.stats(component, stats)
+    return writer.render().splitlines()
+
+
+def test_labelled_keys_become_labels_not_names():
+    lines = render("inference", {"queued": Labelled("analyzer", {"ct v1": 2, "placeholder": 0})})
+    assert lines == [
+        "# HELP test_inference_queued inference stats: queued",
+        "# TYPE test_inference_queued gauge",
+        'test_inference_queued{analyzer="ct v1"} 2',
+        'test_inference_queued{analyzer="placeholder"} 0',
+    ]
+
+
+def test_labelled_samples_are_grouped_per_metric():
+    lines = render("pool", Labelled("address", {"a:1": {"open": 1, "waiting": 0}, "b:2": {"open": 2, "waiting": 1}}))
+    samples = [line for line in lines if not line.startswith("#")]
+    assert samples == [
+        'test_pool_open{address="a:1"} 1',
+        'test_pool_open{address="b:2"} 2',
+        'test_pool_waiting{address="a:1"} 0',
+        'test_pool_waiting{address="b:2"} 1',
+    ]
+
+
+def test_labelled_histogram_snapshots_keep_their_labels():
+    histogram = Histogram(buckets=[1])
+    histogram.observe(0.5)
+    lines = render("search", {"latency": Labelled("kind", {"text": histogram.snapshot()})})
+    assert 'test_search_latency_bucket{kind="text",le="1"} 1' in lines
+    assert 'test_search_latency_count{kind="text"} 1' in lines
+
+
+def test_pool_monitor_reports_checkout_failures_by_reason():
+    monitor = PoolMonitor()
+    event = SimpleNamespace(address=("db", 27017), reason="timeout")
+    monitor.connection_check_out_started(event)
+    monitor.connection_check_out_failed(event)
+    lines = render("mongo_pool", monitor.stats())
+    assert 'test_mongo_pool_checkout_failed_total{address="db:27017",reason="timeout"} 1' in lines
+    assert 'test_mongo_pool_waiting{address="db:27017"} 0' in lines
+
+
+def test_counters_are_typed_and_suffixed():
+    lines = render("feed", {"resets": Counter(3), "open_feeds": 1})
+    assert "# TYPE test_feed_resets_total counter" in lines
+    assert "test_feed_resets_total 3" in lines
+    assert "# TYPE test_feed_open_feeds gauge" in lines
+
+
+def test_keys_flattening_to_the_same_name_are_rejected():
+    with pytest.raises(ValueError, match="test_cache_memory_hits"):
+        render("cache", {"memory": {"hits": 1}, "memory_hits": 1})
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+from ratelimit import MemoryBucketStore, Rate, RateLimiter, RateLimitRule, client_network, parse_overrides
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_rate_parse():
+    assert Rate.parse("10/minute") == Rate(10, 60)
+    assert Rate.parse(" 2/Second ") == Rate(2, 1)
+    assert Rate.parse("30/hour").per_second == pytest.approx(30 / 3600)
+    assert Rate.parse("off") is None
+    assert Rate.parse("0") is None
+
+
+@pytest.mark.parametrize("spec", ["10", "10/day", "x/minute", "-1/minute"])
+def test_rate_parse_rejects(spec):
+    with pytest.raises(ValueError):
+        Rate.parse(spec)
+
+
+def test_bucket_allows_burst_then_reports_wait(clock):
+    store = MemoryBucketStore()
+    rate = Rate(3, 60)  # one token every 20 s
+    assert [run(store.take("k", rate)) for _ in range(3)] == [0, 0, 0]
+    assert run(store.take("k", rate)) == pytest.approx(20)
+
+
+def test_bucket_refills_evenly_up_to_its_size(clock):
+    store = MemoryBucketStore()
+    rate = Rate(3, 60)
+    for _ in range(3):
+        run(store.take("k", rate))
+    clock.now += 10
+    # Half a token back: 10 s still to wait
+    assert run(store.take("k", rate)) == pytest.approx(10)
+    clock.now += 10
+    assert run(store.take("k", rate)) == 0
+    clock.now += 3600
+    assert [run(store.take("k", rate)) for _ in range(3)] == [0, 0, 0]
+    assert run(store.take("k", rate)) > 0
+
+
+def test_bucket_refund_is_capped_at_its_size(clock):
+    store = MemoryBucketStore()
+    rate = Rate(2, 60)
+    run(store.take("k", rate))
+    run(store.take("k", rate, cost=-1))
+    run(store.take("k", rate, cost=-1))
+    assert [run(store.take("k", rate)) for _ in range(2)] == [0, 0]
+    assert run(store.take("k", rate)) > 0
+
+
+def test_bucket_store_evicts_least_recently_used(clock):
+    store = MemoryBucketStore(maxsize=2)
+    rate = Rate(1, 60)
+    run(store.take("a", rate))
+    run(store.take("b", rate))
+    run(store.take("a", rate))
+    run(store.take("c", rate))
+    # a was used more recently than b, so it was kept and is still empty;
+    # b was dropped and starts afresh
+    assert run(store.take("a", rate)) > 0
+    assert run(store.take("b", rate)) == 0
+
+
+def limiter(**limits):
+    return RateLimiter({"login": RateLimitRule("login", limits)})
+
+
+def test_limiter_takes_the_longest_wait_across_scopes(clock):
+    rate_limiter = limiter(ip=Rate(1, 10), account=Rate(1, 60))
+    assert run(rate_limiter.check("login", ip="1.2.3.4", account="a@b.com")) == 0
+    assert run(rate_limiter.check("login", ip="1.2.3.4", account="a@b.com")) == pytest.approx(60)
+    assert rate_limiter.stats()["limited"] == {"login": 1}
+
+
+def test_limiter_keeps_identities_and_scopes_apart(clock):
+    rate_limiter = limiter(ip=Rate(1, 60), account=Rate(1, 60))
+    assert run(rate_limiter.check("login", ip="same")) == 0
+    assert run(rate_limiter.check("login", account="same")) == 0
+    assert run(rate_limiter.check("login", ip="other")) == 0
+
+
+def test_limiter_skips_missing_identities_unknown_routes_and_disabled(clock):
+    rate_limiter = limiter(ip=Rate(1, 60))
+    for _ in range(3):
+        assert run(rate_limiter.check("login", ip=None, user="u")) == 0
+        assert run(rate_limiter.check("register", ip="1.2.3.4")) == 0
+    rate_limiter.enabled = False
+    for _ in range(3):
+        assert run(rate_limiter.check("login", ip="1.2.3.4")) == 0
+
+
+def test_limiter_refund_only_charges_failures(clock):
+    rate_limiter = limiter(account=Rate(2, 60))
+    # Successful logins give their token back
+    for _ in range(5):
+        assert run(rate_limiter.check("login", account="a@b.com")) == 0
+        run(rate_limiter.refund("login", account="a@b.com"))
+    # Failures keep it
+    assert run(rate_limiter.check("login", account="a@b.com")) == 0
+    assert run(rate_limiter.check("login", account="a@b.com")) == 0
+    assert run(rate_limiter.check("login", account="a@b.com")) > 0
+
+
+def test_limiter_allows_requests_when_the_store_fails(clock):
+    class BrokenStore:
+        async def take(self, key, rate, cost=1):
+            raise ConnectionError("redis is down")
+
+    rate_limiter = RateLimiter({"login": RateLimitRule("login", {"ip": Rate(1, 60)})}, store=BrokenStore())
+    assert run(rate_limiter.check("login", ip="1.2.3.4")) == 0
+
+
+def rules():
+    return {
+        "login": RateLimitRule("login", {"ip": Rate(20, 60)}),
+        "scans": RateLimitRule("scans", {"user": Rate(60, 60)}),
+    }
+
+
+def test_parse_overrides_sets_and_disables_limits():
+    overridden = parse_overrides(rules(), " login.ip=5/second, scans.user=off,login.account=3/hour ,")
+    assert overridden["login"].limits == {"ip": Rate(5, 1), "account": Rate(3, 3600)}
+    assert overridden["scans"].limits == {"user": None}
+
+
+def test_parse_overrides_empty_spec_keeps_defaults():
+    assert parse_overrides(rules(), "") == rules()
+
+
+@pytest.mark.parametrize("spec", ["nope.ip=1/second", "login=1/second", "login.ip=", "login.ip=1/fortnight"])
+def test_parse_overrides_rejects_invalid_entries(spec):
+    with pytest.raises(ValueError):
+        parse_overrides(rules(), spec)
+
+
+@pytest.mark.parametrize("host, network", [
+    ("203.0.113.7", "203.0.113.0/24"),
+    ("2001:db8:1:2:3::4", "2001:db8:1:2::/64"),
+    ("testclient", "testclient"),
+    (None, None),
+])
+def test_client_network(host, network):
+    assert client_network(host) == network
@@ -0,0 +1,132 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from search import InvertedIndex, search_filter, tokenize
+from server import SEARCH_MAX_RESULTS, decode_search_cursor, encode_search_cursor
+
+
+def scan(scan_id, report, user_id="u1", scan_type="CT", created_at=datetime(2024, 1, 1)):
+    return {"id": scan_id, "user_id": user_id, "scan_type": scan_type, "ai_report": report, "created_at": created_at}
+
+
+def ids(hits):
+    return [scan_id for _, scan_id in hits]
+
+
+def test_tokenize_lowercases_and_drops_stop_words():
+    assert tokenize("The Nodule, in the LEFT lung: 5mm.") == ["nodule", "left", "lung", "5mm"]
+    assert tokenize(None) == []
+
+
+def test_bm25_ranks_by_term_frequency():
+    index = InvertedIndex()
+    index.add(scan("once", "nodule seen near the hilum with clear margins"))
+    index.add(scan("twice", "nodule and a second nodule near the hilum"))
+    index.add(scan("none", "clear lungs"))
+    hits = index.search(search_filter("u1"), "nodule")
+    assert ids(hits) == ["twice", "once"]
+    assert hits[0][0] > hits[1][0] > 0
+
+
+def test_bm25_rare_words_weigh_more():
+    index = InvertedIndex()
+    index.add(scan("common", "effusion"))
+    index.add(scan("rare", "fracture"))
+    for i in range(5):
+        index.add(scan(f"filler{i}", "effusion noted"))
+    hits = dict((scan_id, score) for score, scan_id in index.search(search_filter("u1"), "effusion fracture"))
+    assert hits["rare"] > hits["common"]
+
+
+def test_bm25_shorter_reports_score_higher_for_the_same_count():
+    index = InvertedIndex()
+    index.add(scan("short", "pneumothorax"))
+    index.add(scan("long", "pneumothorax with extensive surrounding findings described at great length"))
+    assert ids(index.search(search_filter("u1"), "pneumothorax")) == ["short", "long"]
+
+
+def test_ties_are_newest_first():
+    index = InvertedIndex()
+    index.add(scan("old", "cyst", created_at=datetime(2024, 1, 1)))
+    index.add(scan("new", "cyst", created_at=datetime(2024, 6, 1)))
+    assert ids(index.search(search_filter("u1"), "cyst")) == ["new", "old"]
+
+
+def test_search_is_scoped_to_the_user_and_scan_type():
+    index = InvertedIndex()
+    index.add(scan("mine", "mass", scan_type="CT"))
+    index.add(scan("mine_mri", "mass", scan_type="MRI"))
+    index.add(scan("theirs", "mass", user_id="u2"))
+    assert set(ids(index.search(search_filter("u1"), "mass"))) == {"mine", "mine_mri"}
+    assert ids(index.search(search_filter("u1", scan_type="MRI"), "mass")) == ["mine_mri"]
+    assert ids(index.search(search_filter("u2"), "mass")) == ["theirs"]
+
+
+def test_date_filter_is_half_open():
+    index = InvertedIndex()
+    for day in (1, 2, 3):
+        index.add(scan(f"day{day}", "opacity", created_at=datetime(2024, 1, day)))
+    query = search_filter("u1", created_from=datetime(2024, 1, 2), created_to=datetime(2024, 1, 3))
+    assert ids(index.search(query, "opacity")) == ["day2"]
+    assert ids(index.search(search_filter("u1", created_from=datetime(2024, 1, 2)), "opacity")) == ["day3", "day2"]
+    assert ids(index.search(search_filter("u1", created_to=datetime(2024, 1, 2)), "opacity")) == ["day1"]
+
+
+def test_remove_drops_the_scan_and_its_empty_postings():
+    index = InvertedIndex()
+    index.add(scan("a", "calcification granuloma"))
+    index.add(scan("b", "granuloma"))
+    index.remove("a")
+    index.remove("missing")
+    assert len(index) == 1
+    assert "calcification" not in index.postings
+    assert ids(index.search(search_filter("u1"), "calcification granuloma")) == ["b"]
+
+
+def test_re_adding_a_scan_replaces_its_words():
+    index = InvertedIndex()
+    index.add(scan("a", "pending"))
+    index.add(scan("a", "fracture of the radius"))
+    assert len(index) == 1
+    assert index.search(search_filter("u1"), "pending") == []
+    assert ids(index.search(search_filter("u1"), "radius")) == ["a"]
+    # A report with no words left is dropped entirely
+    index.add(scan("a", "the and of"))
+    assert len(index) == 0 and not index.postings
+
+
+def test_search_with_only_stop_words_finds_nothing():
+    index = InvertedIndex()
+    index.add(scan("a", "the nodule"))
+    assert index.search(search_filter("u1"), "the of") == []
+
+
+def cursor_for(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("offset", [0, 1, 20, SEARCH_MAX_RESULTS - 1])
+def test_search_cursor_round_trips(offset):
+    assert decode_search_cursor(encode_search_cursor(offset)) == offset
+
+
+@pytest.mark.parametrize("cursor", [
+    cursor_for({"offset": -1}),
+    cursor_for({"offset": SEARCH_MAX_RESULTS}),
+    cursor_for({"offset": "ten"}),
+    cursor_for({"offset": None}),
+    cursor_for({"page": 2}),
+    cursor_for([0]),
+    cursor_for(5),
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    "",
+])
+def test_search_cursor_rejects_out_of_range_and_malformed(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_search_cursor(cursor)
+    assert e.value.status_code == 400